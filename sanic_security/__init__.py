@@ -1,10 +1,34 @@
+import asyncio
+import datetime
+
 from sanic import Sanic
 from sanic.exceptions import SanicException
 from sanic.log import logger
 from sanic_ext.extensions.base import Extension
 from sanic_ext import Extend
 
+from sanic_security.cache import (
+    captcha_image_cache,
+    role_cache,
+    session_cache,
+    totp_attempts,
+    used_captcha_nonces,
+    used_totp_codes,
+)
+from sanic_security.captcha import captcha_pool
 from sanic_security.configuration import Config as sanic_security_config
+from sanic_security.configuration import config as security_config
+from sanic_security.executor import executor
+from sanic_security.keyring import keyring
+from sanic_security.orm.backend import (
+    AccountBackend,
+    RoleBackend,
+    SessionBackend,
+    VerificationSessionBackend,
+    validate_backend,
+)
+from sanic_security.delivery import delivery_queue
+from sanic_security.utils import load_captcha_encoder, register_session_cookies
 
 
 class ORMNotProvided():
@@ -25,7 +49,8 @@ class SanicSecurityExtension(Extension):
 
     Args:
         app (Sanic): The Sanic app instance. If no provided at setup, `init_app(app)` can later be called.
-        orm (str): ORM to use ['tortoise', 'umongo', 'custom'] [default: tortoise]
+        orm (str): ORM to use ['tortoise', 'umongo', 'memory', 'custom'] [default: tortoise]
+        session_store (str): Store sessions in ['redis'] instead of the ORM [default: None]
         account (object): Account model, properly configured for the DB used.
         session (object): Session model, properly configured for the DB used.
         role (object):  Role model, properly configured for the DB used.
@@ -40,6 +65,7 @@ class SanicSecurityExtension(Extension):
     Raises:
         ImportError (Exception): Invalid `ORM` specified
         Exception (Exception): Missing required models for `custom` provider
+        TypeError (Exception): Model not implementing its backend protocol, see `sanic_security.orm.backend`
     """
     logger.info("Setting up SanicSecurityExtension")
     name: str = "security"
@@ -54,7 +80,13 @@ class SanicSecurityExtension(Extension):
     captcha_session: object = None
     authentication_session: object = None
     orm = None
+    session_store = None
     _started = False
+    _background_tasks: list = []
+    _prepare_serializers = None
+    _ensure_ttl_indexes = None
+    _memory_snapshots = None
+    _redis = None
 
     def __init__(self, app: Sanic = None, orm = None, account: object = None, session: object = None,
                  role: object = None, verification: object = None,
@@ -110,9 +142,13 @@ class SanicSecurityExtension(Extension):
                     self.authentication_session = ORMNotProvided()
             else:
                 if self.orm == 'tortoise':
-                    from .orm.tortoise import Role, Account, VerificationSession, TwoStepSession, CaptchaSession, AuthenticationSession
+                    from .orm.tortoise import Role, Account, VerificationSession, TwoStepSession, CaptchaSession, AuthenticationSession, prepare_serializers
                 elif self.orm == 'umongo':
-                    from .orm.umongo import Role, Account, VerificationSession, TwoStepSession, CaptchaSession, AuthenticationSession
+                    from .orm.umongo import Role, Account, VerificationSession, TwoStepSession, CaptchaSession, AuthenticationSession, prepare_serializers, ensure_ttl_indexes
+                    self._ensure_ttl_indexes = ensure_ttl_indexes
+                elif self.orm == 'memory':
+                    from .orm.memory import Role, Account, VerificationSession, TwoStepSession, CaptchaSession, AuthenticationSession, prepare_serializers, load_snapshot, save_snapshot
+                    self._memory_snapshots = (load_snapshot, save_snapshot)
                 else:
                     raise ImportError("Invalid ORM specified")
     
@@ -122,6 +158,31 @@ class SanicSecurityExtension(Extension):
                 self.twostep_session = TwoStepSession()
                 self.captcha_session = CaptchaSession()
                 self.authentication_session = AuthenticationSession()
+                self._prepare_serializers = prepare_serializers
+
+            self.session_store = self.app.config.get('SANIC_SECURITY_SESSION_STORE', None)
+            if self.session_store == 'redis':
+                from .orm.redis import VerificationSession, TwoStepSession, CaptchaSession, AuthenticationSession, connect
+                self._redis = connect(
+                    self.app.config.get('SANIC_SECURITY_REDIS_URL'),
+                    self.app.config.get('SANIC_SECURITY_REDIS_POOL_SIZE'),
+                )
+                self.verification_session = VerificationSession()
+                self.twostep_session = TwoStepSession()
+                self.captcha_session = CaptchaSession()
+                self.authentication_session = AuthenticationSession()
+            elif self.session_store:
+                raise ImportError("Invalid session store specified")
+
+            for model, backend in (
+                (self.account, AccountBackend),
+                (self.role, RoleBackend),
+                (self.twostep_session, VerificationSessionBackend),
+                (self.captcha_session, VerificationSessionBackend),
+                (self.authentication_session, SessionBackend),
+            ):
+                if not isinstance(model, ORMNotProvided):
+                    validate_backend(model, backend)
 
         except ImportError as e:
             logger.critical(f"No such ORM provider: {orm}")
@@ -130,7 +191,175 @@ class SanicSecurityExtension(Extension):
             logger.critical(f"Sanic-Security ORM Setup Failure: {e}")
             raise e
         
+        self._register_session_cookies()
         self._register_extension(self.app)
+        self.app.register_listener(self._reset_caches, "before_server_start")
+        if self._memory_snapshots:
+            self.app.register_listener(self._load_memory_snapshot, "before_server_start")
+        self.app.register_listener(self._start_background_tasks, "after_server_start")
+        self.app.register_listener(self._stop_background_tasks, "before_server_stop")
+
+    def _register_session_cookies(self):
+        """
+        Resolves the cookie names of the provided session models, ensuring no two models share a cookie.
+        """
+        register_session_cookies(
+            *(
+                session_model
+                for session_model in (
+                    self.verification_session,
+                    self.twostep_session,
+                    self.captcha_session,
+                    self.authentication_session,
+                )
+                if not isinstance(session_model, ORMNotProvided)
+            )
+        )
+
+    async def _reset_caches(self, app, loop):
+        """
+        Applies the configured cache sizes, drops entries left over from a previous run, parses the configured keys,
+        resolves session cookie names and the captcha image encoder.
+        """
+        keyring.reload()
+        load_captcha_encoder()
+        self._register_session_cookies()
+        session_cache.configure(
+            security_config.SANIC_SECURITY_SESSION_CACHE_SIZE,
+            security_config.SANIC_SECURITY_SESSION_CACHE_TTL,
+        )
+        session_cache.clear()
+        role_cache.configure(
+            security_config.SANIC_SECURITY_ROLE_CACHE_SIZE,
+            security_config.SANIC_SECURITY_ROLE_CACHE_TTL,
+        )
+        role_cache.clear()
+        captcha_image_cache.configure(
+            security_config.SANIC_SECURITY_CAPTCHA_POOL_SIZE * 4,
+            security_config.SANIC_SECURITY_CAPTCHA_SESSION_EXPIRATION,
+        )
+        captcha_image_cache.clear()
+        used_captcha_nonces.configure(
+            security_config.SANIC_SECURITY_CAPTCHA_NONCE_CACHE_SIZE,
+            security_config.SANIC_SECURITY_CAPTCHA_SESSION_EXPIRATION,
+        )
+        used_captcha_nonces.clear()
+        for totp_cache in (used_totp_codes, totp_attempts):
+            totp_cache.configure(
+                security_config.SANIC_SECURITY_TOTP_CACHE_SIZE,
+                security_config.SANIC_SECURITY_TOTP_PERIOD * (2 * security_config.SANIC_SECURITY_TOTP_WINDOW + 1),
+            )
+            totp_cache.clear()
+        captcha_pool.clear()
+        delivery_queue.clear()
+
+    async def _start_background_tasks(self, app, loop):
+        """
+        Prepares model serializers, once the ORM is initialized, and schedules the periodic maintenance tasks enabled
+        in the configuration.
+        """
+        if self._prepare_serializers:
+            self._prepare_serializers()
+        if self._ensure_ttl_indexes and security_config.SANIC_SECURITY_SESSION_TTL_INDEXES:
+            await self._ensure_ttl_indexes()
+        self._background_tasks = []
+        if security_config.SANIC_SECURITY_STATELESS_AUTHENTICATION:
+            self._background_tasks.append(loop.create_task(self._refresh_revoked_sessions()))
+        if security_config.SANIC_SECURITY_SESSION_PURGE_INTERVAL > 0:
+            self._background_tasks.append(loop.create_task(self._purge_sessions()))
+        if security_config.SANIC_SECURITY_CAPTCHA_POOL_SIZE > 0:
+            self._background_tasks.append(loop.create_task(captcha_pool.run()))
+        self._background_tasks.extend(delivery_queue.start(loop))
+        if (
+            self._memory_snapshots
+            and security_config.SANIC_SECURITY_MEMORY_SNAPSHOT_PATH
+            and security_config.SANIC_SECURITY_MEMORY_SNAPSHOT_INTERVAL > 0
+        ):
+            self._background_tasks.append(loop.create_task(self._save_memory_snapshots()))
+
+    async def _stop_background_tasks(self, app, loop):
+        """
+        Cancels the periodic maintenance tasks, saves a final memory ORM snapshot if enabled, closes Redis connections
+        and shuts the executor down before the server stops.
+        """
+        for task in self._background_tasks:
+            task.cancel()
+        self._background_tasks = []
+        if self._memory_snapshots and security_config.SANIC_SECURITY_MEMORY_SNAPSHOT_PATH:
+            await self._memory_snapshots[1]()
+        if self._redis:
+            await self._redis.close()
+        executor.shutdown()
+
+    async def _load_memory_snapshot(self, app, loop):
+        """
+        Loads the memory ORM's store from its snapshot, before accounts are created on server start.
+        """
+        self._memory_snapshots[0]()
+
+    async def _save_memory_snapshots(self):
+        """
+        Periodically saves the memory ORM's store to its snapshot.
+        """
+        while True:
+            await asyncio.sleep(security_config.SANIC_SECURITY_MEMORY_SNAPSHOT_INTERVAL)
+            try:
+                await self._memory_snapshots[1]()
+            except Exception as e:
+                logger.error(f"[Sanic-Security] Failed to save memory snapshot: {e}")
+
+    async def _refresh_revoked_sessions(self):
+        """
+        Periodically reloads revoked authentication sessions used by stateless authentication.
+        """
+        from sanic_security.authentication import refresh_revoked_sessions, revoked_sessions
+
+        revoked_sessions.clear()
+        while True:
+            try:
+                await refresh_revoked_sessions()
+            except Exception as e:
+                logger.error(f"[Sanic-Security] Failed to refresh revoked sessions: {e}")
+            await asyncio.sleep(security_config.SANIC_SECURITY_REVOCATION_REFRESH_INTERVAL)
+
+    async def purge_sessions(self) -> int:
+        """
+        Deletes sessions that could no longer be used since longer ago than the configured purge retention, in batches
+        of the configured purge batch size.
+
+        Deactivated sessions are kept until they expire, as they are needed to revoke stateless sessions and to detect
+        reuse of refreshed sessions.
+
+        Returns:
+            purged
+        """
+        before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+            seconds=security_config.SANIC_SECURITY_SESSION_PURGE_RETENTION
+        )
+        batch_size = security_config.SANIC_SECURITY_SESSION_PURGE_BATCH_SIZE
+        purged = 0
+        for session_model in (self.twostep_session, self.captcha_session, self.authentication_session):
+            if not hasattr(session_model, "purge"):
+                continue
+            while True:
+                batch_purged = await session_model.purge(before, batch_size)
+                purged += batch_purged
+                if batch_purged < batch_size:
+                    break
+                await asyncio.sleep(0)
+        return purged
+
+    async def _purge_sessions(self):
+        """
+        Periodically deletes sessions that can no longer be used.
+        """
+        while True:
+            try:
+                purged = await self.purge_sessions()
+                logger.debug(f"[Sanic-Security] Purged {purged} sessions.")
+            except Exception as e:
+                logger.error(f"[Sanic-Security] Failed to purge sessions: {e}")
+            await asyncio.sleep(security_config.SANIC_SECURITY_SESSION_PURGE_INTERVAL)
 
     def label(self):
         return "Sanic-Security"
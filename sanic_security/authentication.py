@@ -1,5 +1,9 @@
 import base64
+import datetime
 import functools
+import time
+from json import dumps as json_dumps
+from types import SimpleNamespace
 
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
@@ -7,15 +11,22 @@ from sanic.log import logger
 from sanic.request import Request
 from sanic import Sanic
 
+from sanic_security.cache import session_cache
 from sanic_security.configuration import config as security_config
+from sanic_security.executor import executor
 from sanic_security.exceptions import (
+    AuthorizationError,
     NotFoundError,
     CredentialsError,
     IntegrityError,
     SessionError,
     DeactivatedError,
+    DeletedError,
+    ExpiredError,
+    UnverifiedError,
+    DisabledError,
 )
-from sanic_security.utils import get_ip, decode
+from sanic_security.utils import get_ip, decode, decode_raw
 
 """
 An effective, simple, and async security library for the Sanic framework.
@@ -37,6 +48,256 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 password_hasher = PasswordHasher()
 
+
+class RevocationSet:
+    """
+    Compact in-process set of revoked sessions and accounts, used by stateless authentication.
+
+    Session entries are dropped once the session they refer to has expired, as its JWT can no longer be used anyway.
+    Account entries cover accounts that were disabled, deleted or unverified after their sessions were encoded.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._accounts = set()
+        self.refreshed_at = None
+
+    def __contains__(self, session_id) -> bool:
+        return str(session_id) in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def is_account_revoked(self, account_id) -> bool:
+        return str(account_id) in self._accounts
+
+    def add(self, session_id, expiration_date: datetime.datetime = None) -> None:
+        """
+        Marks a session as revoked.
+
+        Args:
+            session_id (str): Identifier of the revoked session.
+            expiration_date (datetime): Date and time the session expires, naive dates are UTC. Revocations without one are kept indefinitely.
+        """
+        if expiration_date and not expiration_date.tzinfo:
+            expiration_date = expiration_date.replace(tzinfo=datetime.timezone.utc)
+        self._sessions[str(session_id)] = (
+            expiration_date.timestamp() if expiration_date else None
+        )
+
+    def update(self, revoked_sessions) -> None:
+        """
+        Merges revoked sessions and discards revocations of sessions that have since expired.
+
+        Args:
+            revoked_sessions (Iterable[Tuple[str, datetime]]): Identifiers and expiration dates of revoked sessions.
+        """
+        for session_id, expiration_date in revoked_sessions:
+            self.add(session_id, expiration_date)
+        now = time.time()
+        self._sessions = {
+            session_id: expires_at
+            for session_id, expires_at in self._sessions.items()
+            if expires_at is None or expires_at > now
+        }
+
+    def clear(self) -> None:
+        """
+        Forgets all revocations, so the next refresh reloads them in full.
+        """
+        self._sessions = {}
+        self._accounts = set()
+        self.refreshed_at = None
+
+    def set_accounts(self, account_ids) -> None:
+        """
+        Replaces the revoked accounts, so accounts that were re-enabled are accepted again.
+
+        Args:
+            account_ids (Iterable[str]): Identifiers of accounts that can no longer authenticate.
+        """
+        self._accounts = {str(account_id) for account_id in account_ids}
+
+
+revoked_sessions = RevocationSet()
+
+
+class BearerClaims:
+    """
+    Account state carried by a stateless authentication session.
+
+    Attributes:
+        id (str): Identifier of the account.
+        verified (bool): Account verification state when the session was encoded.
+        disabled (bool): Account disabled state when the session was encoded.
+        deleted (bool): Account deleted state when the session was encoded.
+    """
+
+    def __init__(self, claims: dict):
+        self.id = self.pk = claims["sub"]
+        self.verified = claims["verified"]
+        self.disabled = claims["disabled"]
+        self.deleted = claims.get("deleted", False)
+
+    def validate(self) -> None:
+        """
+        Raises an error with respect to account state, including accounts revoked since the session was encoded.
+
+        Raises:
+            DeletedError
+            UnverifiedError
+            DisabledError
+        """
+        if self.deleted:
+            raise DeletedError("Account has been deleted.")
+        elif not self.verified:
+            raise UnverifiedError()
+        elif self.disabled or revoked_sessions.is_account_revoked(self.id):
+            raise DisabledError()
+
+    async def fetch(self):
+        """
+        Retrieves the full account these claims were encoded from.
+
+        Returns:
+            account
+
+        Raises:
+            NotFoundError
+        """
+        _orm = Sanic.get_app().ctx.extensions['security']
+
+        return await _orm.account.lookup(id=self.id)
+
+    async def json(self) -> str:
+        return json_dumps({"id": self.id, "verified": self.verified, "disabled": self.disabled})
+
+
+class AuthenticationClaims:
+    """
+    Authentication session rebuilt from verified JWT claims, used when stateless authentication is enabled.
+
+    The bearer is a `BearerClaims` snapshot, use `await bearer.fetch()` when the full account is required.
+
+    Attributes:
+        id (str): Identifier of the authentication session.
+        date_created (datetime): Always None, as it is not encoded in the session's claims.
+        expiration_date (datetime): Date and time the session expires and can no longer be used.
+        ip (str): IP address of client that created the session.
+        bearer (BearerClaims): Account state associated with this session.
+        ctx (SimpleNamespace): Additional encoded session data.
+    """
+
+    session_type = "auth"
+    active = True
+
+    def __init__(self, claims: dict):
+        self.id = self.pk = claims["sid"]
+        self.date_created = None
+        self.expiration_date = (
+            datetime.datetime.fromtimestamp(claims["exp"], datetime.timezone.utc)
+            if "exp" in claims
+            else None
+        )
+        self.ip = claims.get("ip")
+        self.bearer = self.loaded_bearer = BearerClaims(claims)
+        self.ctx = SimpleNamespace(**claims.get("ctx", {}))
+
+    def validate(self) -> None:
+        """
+        Raises an error with respect to session state.
+
+        Raises:
+            ExpiredError
+            DeactivatedError
+        """
+        if self.expiration_date:
+            now = (
+                datetime.datetime.now(datetime.timezone.utc)
+                if self.expiration_date.tzinfo
+                else datetime.datetime.utcnow()
+            )
+            if now >= self.expiration_date:
+                raise ExpiredError()
+        if self.id in revoked_sessions:
+            raise DeactivatedError()
+
+    async def json(self) -> str:
+        return json_dumps({
+            "id": self.id,
+            "date_created": str(self.date_created),
+            "expiration_date": str(self.expiration_date),
+            "ip": self.ip,
+            "bearer": self.bearer.id,
+        })
+
+
+async def refresh_revoked_sessions() -> None:
+    """
+    Loads authentication sessions revoked since the last refresh, and the accounts that can no longer authenticate,
+    into the in-process revocation set.
+
+    Requires the authentication session model to provide `get_revoked()`, and the account model `get_revoked()`.
+    """
+    _orm = Sanic.get_app().ctx.extensions['security']
+
+    # Overlap refreshes slightly, so sessions deactivated while the previous refresh was running are not missed.
+    refreshed_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)
+    if hasattr(_orm.authentication_session, "get_revoked"):
+        revoked_sessions.update(
+            await _orm.authentication_session.get_revoked(since=revoked_sessions.refreshed_at)
+        )
+    if hasattr(_orm.account, "get_revoked"):
+        revoked_sessions.set_accounts(await _orm.account.get_revoked())
+    revoked_sessions.refreshed_at = refreshed_at
+
+
+def _check_password(password_hash: str, password: str) -> tuple:
+    try:
+        password_hasher.verify(password_hash, password)
+    except VerifyMismatchError:
+        return False, False
+    return True, password_hasher.check_needs_rehash(password_hash)
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hashes a password in the executor, so the event loop is not blocked.
+
+    Args:
+        password (str): Password being hashed.
+
+    Returns:
+        password_hash
+
+    Raises:
+        BusyError
+    """
+    return await executor.run(password_hasher.hash, password)
+
+
+async def verify_password(account, password: str) -> bool:
+    """
+    Checks a password against an account's password hash in the executor, so the event loop is not blocked.
+    The account's password is rehashed if the hasher's parameters have changed.
+
+    Args:
+        account (Account): Account whose password hash is checked.
+        password (str): Password being checked.
+
+    Returns:
+        verified
+
+    Raises:
+        BusyError
+    """
+    verified, needs_rehash = await executor.run(_check_password, account.password, password)
+    if needs_rehash:
+        account.password = await hash_password(password)
+        await account.save(update_fields=["password"])
+    return verified
+
+
 async def register(
     request: dict, verified: bool = False, disabled: bool = False
 ):
@@ -53,6 +314,7 @@ async def register(
 
     Raises:
         CredentialsError
+        BusyError
     """
 
     _orm = Sanic.get_app().ctx.extensions['security']
@@ -69,11 +331,12 @@ async def register(
           ):
               raise CredentialsError("An account with this username already exists.")
         except NotFoundError:
+            password = await hash_password(request.get("password"))
             try:
                 account = await _orm.account.new(
                     email=request.get("email").lower(),
                     username=request.get("username"),
-                    password=password_hasher.hash(request.get("password")),
+                    password=password,
                     phone=request.get("phone"),
                     verified=verified,
                     disabled=disabled,
@@ -102,6 +365,7 @@ async def login(request: Request, account = None):
         DeletedError
         UnverifiedError
         DisabledError
+        BusyError
     """
     _orm = Sanic.get_app().ctx.extensions['security']
 
@@ -127,19 +391,15 @@ async def login(request: Request, account = None):
                     raise e
             else:
                 raise e
-    try:
-        password_hasher.verify(account.password, password)
-        if password_hasher.check_needs_rehash(account.password):
-            account.password = password_hasher.hash(password)
-            await account.save(update_fields=["password"])
-        account.validate()
-        foo = await _orm.authentication_session.new(request, account)
-        return await _orm.authentication_session.new(request, account)
-    except VerifyMismatchError:
+    if not await verify_password(account, password):
         logger.warning(
             f"Client ({account.email}/{get_ip(request)}) login password attempt is incorrect"
         )
         raise CredentialsError("Incorrect password.", 401)
+    account.validate()
+    authentication_session = await _orm.authentication_session.new(request, account)
+    authentication_session.loaded_bearer = account
+    return authentication_session
 
 
 async def logout(request: Request):
@@ -163,13 +423,75 @@ async def logout(request: Request):
     if not authentication_session.active:
         raise DeactivatedError("Already logged out.", 403)
 
-    return await _orm.authentication_session.deactivate(authentication_session)
+    authentication_session = await _orm.authentication_session.deactivate(authentication_session)
+    session_cache.discard(authentication_session)
+    request.ctx.authentication_session = None
+    revoked_sessions.add(authentication_session.id, authentication_session.expiration_date)
+    return authentication_session
+
+
+async def refresh(request: Request):
+    """
+    Replaces the client's authentication session, even if expired, with a new one without checking credentials. The
+    session must not have passed its refresh expiration date.
+
+    Refreshed sessions belong to the family of the session first created on login, and are deactivated once refreshed.
+    A deactivated session being refreshed again indicates its token was reused, so every session of its family is
+    deactivated.
+
+    Args:
+        request (Request): Sanic request parameter.
+
+    Returns:
+        authentication_session
+
+    Raises:
+        NotFoundError
+        JWTDecodeError
+        DeletedError
+        ExpiredError
+        DeactivatedError
+        UnverifiedError
+        DisabledError
+        AuthorizationError
+    """
+    _orm = Sanic.get_app().ctx.extensions['security']
+
+    if not security_config.SANIC_SECURITY_AUTHENTICATION_SESSION_REFRESH:
+        raise AuthorizationError("Session refresh is disabled.")
+    claims = decode_raw(_orm.authentication_session, request, allow_expired=True)
+    authentication_session, bearer = await _orm.authentication_session.lookup(id=claims["sid"])
+    family = authentication_session.family or str(authentication_session.id)
+    if authentication_session.deleted:
+        raise DeletedError("Session has been deleted.")
+    elif not authentication_session.active:
+        revoked_sessions.update(await _orm.authentication_session.deactivate_family(family))
+        logger.warning(
+            f"Client ({bearer.pk}/{get_ip(request)}) refreshed a deactivated session, its session family was deactivated."
+        )
+        raise DeactivatedError("Session has already been refreshed or deactivated.")
+    refresh_expiration_date = authentication_session.refresh_expiration_date
+    if refresh_expiration_date and not refresh_expiration_date.tzinfo:
+        refresh_expiration_date = refresh_expiration_date.replace(tzinfo=datetime.timezone.utc)
+    if refresh_expiration_date and datetime.datetime.now(datetime.timezone.utc) >= refresh_expiration_date:
+        raise ExpiredError()
+    bearer.validate()
+    await _orm.authentication_session.deactivate(authentication_session)
+    revoked_sessions.add(authentication_session.id, authentication_session.expiration_date)
+    authentication_session = await _orm.authentication_session.new(request, bearer, family=family)
+    request.ctx.authentication_session = authentication_session
+    return authentication_session
 
 
 async def authenticate(request: Request):
     """
     Validates client.
 
+    When stateless authentication is enabled, sessions encoded with bearer claims are validated without
+    a database lookup and an `AuthenticationClaims` session is returned.
+
+    The authentication session is memoized on `request.ctx` for the rest of the request.
+
     Args:
         request (Request): Sanic request parameter.
 
@@ -187,9 +509,24 @@ async def authenticate(request: Request):
     """
     _orm = Sanic.get_app().ctx.extensions['security']
 
-    authentication_session, bearer = await decode(_orm.authentication_session, request)
+    authentication_session = getattr(request.ctx, "authentication_session", None)
+    if authentication_session:
+        return authentication_session
+
+    claims = None
+    if security_config.SANIC_SECURITY_STATELESS_AUTHENTICATION:
+        claims = decode_raw(_orm.authentication_session, request)
+        if "sub" in claims:
+            authentication_session = AuthenticationClaims(claims)
+            authentication_session.validate()
+            authentication_session.bearer.validate()
+            request.ctx.authentication_session = authentication_session
+            return authentication_session
+
+    authentication_session, bearer = await decode(_orm.authentication_session, request, claims)
     authentication_session.validate()
     bearer.validate()
+    request.ctx.authentication_session = authentication_session
     return authentication_session
 
 
@@ -197,6 +534,10 @@ def requires_authentication():
     """
     Validates client.
 
+    When stateless authentication is enabled, the session passed is an `AuthenticationClaims` and its bearer a
+    `BearerClaims` snapshot rather than an account. Use `await authentication_session.bearer.fetch()` to retrieve
+    the account.
+
     Example:
         This method is not called directly and instead used as a decorator:
 
@@ -257,7 +598,7 @@ def create_initial_admin_account(app: Sanic) -> None:
             account = await _orm.account.new(
                 username="Head Admin",
                 email=security_config.SANIC_SECURITY_INITIAL_ADMIN_EMAIL,
-                password=PasswordHasher().hash(security_config.SANIC_SECURITY_INITIAL_ADMIN_PASSWORD),
+                password=await hash_password(security_config.SANIC_SECURITY_INITIAL_ADMIN_PASSWORD),
                 verified=True,
                 phone=security_config.get('SANIC_SECURITY_INITIAL_ADMIN_PHONE', '1111111111'),
                 roles=[role]
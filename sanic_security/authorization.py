@@ -1,12 +1,14 @@
 import functools
 import logging
-from fnmatch import fnmatch
+from fnmatch import fnmatchcase
+from itertools import product
 
 from sanic.request import Request
 from sanic.log import logger
 from sanic import Sanic
 
-from sanic_security.authentication import authenticate
+from sanic_security.authentication import authenticate, BearerClaims
+from sanic_security.cache import role_cache
 from sanic_security.exceptions import AuthorizationError, NotFoundError
 from sanic_security.utils import get_ip
 
@@ -30,6 +32,144 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 
+class PermissionMatcher:
+    """
+    Wildcard permissions of a role compiled into a trie of permission parts, such as `resource:action`.
+
+    Each part may list several subparts separated by commas, and subparts may be wildcards. A granted permission with
+    fewer parts than a required one implies all of the required permission's remaining parts.
+
+    Args:
+        permissions (str): Permissions of a role, separated by comma and space, in wildcard format.
+    """
+
+    _TERMINAL = object()
+
+    def __init__(self, permissions: str = None):
+        self._root = ({}, [])
+        for permission in permissions.split(", ") if permissions else []:
+            self._insert(permission.strip())
+
+    def _insert(self, permission: str) -> None:
+        nodes = [self._root]
+        for part in permission.split(":"):
+            next_nodes = []
+            for literals, patterns in nodes:
+                for subpart in part.split(","):
+                    if any(char in subpart for char in "*?["):
+                        node = next(
+                            (node for pattern, node in patterns if pattern == subpart), None
+                        )
+                        if not node:
+                            node = ({}, [])
+                            patterns.append((subpart, node))
+                    else:
+                        node = literals.setdefault(subpart, ({}, []))
+                    next_nodes.append(node)
+            nodes = next_nodes
+        for literals, patterns in nodes:
+            literals[self._TERMINAL] = True
+
+    def _matches(self, node, parts: tuple) -> bool:
+        literals, patterns = node
+        if self._TERMINAL in literals:
+            return True
+        if not parts:
+            return any(pattern == "*" and self._matches(child, parts) for pattern, child in patterns)
+        part, remaining = parts[0], parts[1:]
+        child = literals.get(part)
+        if child and self._matches(child, remaining):
+            return True
+        return any(
+            fnmatchcase(part, pattern) and self._matches(child, remaining)
+            for pattern, child in patterns
+        )
+
+    def implies(self, required_permission: str) -> bool:
+        """
+        Determines if the compiled permissions grant a required permission, including every subpart it lists.
+
+        Args:
+            required_permission (str): Permission in wildcard format, such as `printer:query,delete`.
+
+        Returns:
+            implied
+        """
+        return all(
+            self._matches(self._root, parts)
+            for parts in product(*(part.split(",") for part in required_permission.split(":")))
+        )
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_permissions(permissions: str) -> PermissionMatcher:
+    """
+    Retrieves the compiled matcher of a role's permissions. Matchers are cached by permission string, so a role is
+    recompiled once its permissions change.
+
+    Args:
+        permissions (str): Permissions of a role, separated by comma and space, in wildcard format.
+
+    Returns:
+        permission_matcher
+    """
+    return PermissionMatcher(permissions)
+
+
+class AccountRoles:
+    """
+    Resolved role names and compiled permissions of an account.
+
+    Attributes:
+        roles (list): Roles of the account.
+        names (frozenset): Names of the account's roles.
+        permission_matchers (tuple): Compiled permissions of each of the account's roles.
+    """
+
+    def __init__(self, roles: list):
+        self.roles = roles
+        self.names = frozenset(role.name for role in roles)
+        self.permission_matchers = tuple(compile_permissions(role.permissions) for role in roles)
+
+    def has_any_role(self, *required_roles: str) -> bool:
+        return not self.names.isdisjoint(required_roles)
+
+    def implies_any(self, *required_permissions: str) -> bool:
+        return any(
+            permission_matcher.implies(required_permission)
+            for permission_matcher in self.permission_matchers
+            for required_permission in required_permissions
+        )
+
+
+async def get_account_roles(request: Request, authentication_session) -> AccountRoles:
+    """
+    Retrieves the roles of the client's account.
+
+    Roles are cached per account until they change through `assign_role`, `Account.add_role` or a role being saved,
+    and memoized on `request.ctx` for the rest of the request.
+
+    Args:
+        request (Request): Sanic request parameter.
+        authentication_session (AuthenticationSession): Authenticated session of the client.
+
+    Returns:
+        account_roles
+    """
+    _orm = Sanic.get_app().ctx.extensions['security']
+
+    account_roles = getattr(request.ctx, "account_roles", None)
+    if account_roles is None:
+        account_id = str(authentication_session.bearer.pk)
+        account_roles = role_cache.get(account_id)
+        if account_roles is None:
+            version = role_cache.version(account_id)
+            account_roles = AccountRoles(await _orm.account.get_roles(authentication_session.bearer.pk))
+            role_cache.set(account_id, account_roles, version)
+        request.ctx.account_roles = account_roles
+    return account_roles
+
+
 async def check_permissions(
     request: Request, *required_permissions: str
 ):
@@ -53,16 +193,10 @@ async def check_permissions(
         DisabledError
         AuthorizationError
     """
-    _orm = Sanic.get_app().ctx.extensions['security']
     authentication_session = await authenticate(request)
     logger.debug(f'Authentication Session: {authentication_session.bearer}')
-    roles = await _orm.account.get_roles(authentication_session.bearer.pk)
-    for role in roles:
-        for required_permission, role_permission in zip(
-            required_permissions, role.permissions.split(", ")
-        ):
-            if fnmatch(required_permission, role_permission):
-                return authentication_session
+    if (await get_account_roles(request, authentication_session)).implies_any(*required_permissions):
+        return authentication_session
     logging.warning(
         f"Client ({authentication_session.bearer.pk}/{get_ip(request)}) has insufficient permissions."
     )
@@ -90,13 +224,11 @@ async def check_roles(request: Request, *required_roles: str):
         DisabledError
         AuthorizationError
     """
-    _orm = Sanic.get_app().ctx.extensions['security']
     authentication_session = await authenticate(request)
-    roles = await _orm.account.get_roles(authentication_session.bearer.pk)
-    logger.debug(f'Found Roles: {roles}')
-    for role in roles:
-        if role.name in required_roles:
-            return authentication_session
+    account_roles = await get_account_roles(request, authentication_session)
+    logger.debug(f'Found Roles: {account_roles.names}')
+    if account_roles.has_any_role(*required_roles):
+        return authentication_session
     logging.warning(
         f"Client ({authentication_session.bearer.pk}/{get_ip(request)}) has insufficient roles."
     )
@@ -187,12 +319,14 @@ async def assign_role(
 
     Args:
         name (str):  The name of the role associated with the account.
-        account (Account): the account associated with the created role.
+        account (Account): the account associated with the created role. Stateless `BearerClaims` are resolved to their account.
         permissions (str):  The permissions of the role associated with the account. Permissions must be separated via comma and in wildcard format.
         description (str):  The description of the role associated with the account.
     """
     _orm = Sanic.get_app().ctx.extensions['security']
 
+    if isinstance(account, BearerClaims):
+        account = await account.fetch()
     try:
         # removed `permissions` lookup, as names should be unique in a sane RBAC model
         role = await _orm.role.lookup(name=name)
@@ -204,4 +338,5 @@ async def assign_role(
         )
     logger.debug(f'Calling to add new role [{role}] to account [{account}]')
     await _orm.account.add_role(account, role=role)
+    role_cache.bump(str(account.pk))
     return role
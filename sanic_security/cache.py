@@ -0,0 +1,259 @@
+import time
+from collections import OrderedDict
+
+from sanic_security.configuration import config as security_config
+
+"""
+An effective, simple, and async security library for the Sanic framework.
+Copyright (C) 2020-present Aidan Stewart
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+class TTLCache:
+    """
+    Bounded in-process cache, entries expire after a time to live and the least recently used entry is evicted when full.
+
+    Attributes:
+        maxsize (int): Maximum amount of entries held. Setting to 0 will disable the cache.
+        ttl (int): The amount of seconds an entry is held. Setting to 0 will disable the cache.
+        hits (int): Amount of lookups answered by the cache.
+        misses (int): Amount of lookups not found or expired in the cache.
+        evictions (int): Amount of entries removed to make room for new ones.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: int = 5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, key, default=None):
+        """
+        Retrieves an entry and marks it as recently used.
+
+        Args:
+            key (Hashable): Key of the entry.
+            default (Any): Returned when the entry is missing or expired.
+
+        Returns:
+            value
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value) -> None:
+        """
+        Stores an entry, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key (Hashable): Key of the entry.
+            value (Any): Value being cached.
+        """
+        if not self.enabled:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def values(self):
+        now = time.monotonic()
+        return [value for expires_at, value in self._entries.values() if expires_at > now]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def configure(self, maxsize: int, ttl: int) -> None:
+        """
+        Resizes the cache, evicting the least recently used entries that no longer fit.
+
+        Args:
+            maxsize (int): Maximum amount of entries held.
+            ttl (int): The amount of seconds an entry is held, applies to entries stored from now on.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        while self._entries and len(self._entries) > max(maxsize, 0):
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """
+        Retrieves counters used to size the cache.
+
+        Returns:
+            stats
+        """
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SessionCache(TTLCache):
+    """
+    Caches (session, bearer) pairs retrieved by session lookups, keyed by session model and session id.
+
+    Entries must be discarded whenever a session or its bearer changes, see `discard` and `discard_bearer`.
+    """
+
+    @staticmethod
+    def key(cls, id) -> tuple:
+        """
+        Retrieves the cache key of a session.
+
+        Args:
+            cls: Session model, or instance of it.
+            id: Session identifier.
+
+        Returns:
+            key
+        """
+        return (cls if isinstance(cls, type) else cls.__class__, str(id))
+
+    def discard(self, session) -> None:
+        """
+        Removes a session from the cache.
+
+        Args:
+            session: Session that has changed.
+        """
+        self.pop(self.key(session, session.id))
+
+    def discard_bearer(self, account) -> None:
+        """
+        Removes all sessions associated with an account from the cache.
+
+        Args:
+            account: Account that has changed.
+        """
+        account_id = str(account.id)
+        for key, (expires_at, (session, bearer)) in list(self._entries.items()):
+            if bearer is not None and str(bearer.id) == account_id:
+                del self._entries[key]
+
+
+class VersionedCache(TTLCache):
+    """
+    Caches values stamped with a per-key version and a cache-wide generation. Bumping either invalidates the entries
+    they cover, including values that were being loaded while the bump happened.
+
+    Example:
+        Capture the version before loading, so a concurrent change is not cached stale:
+
+            version = role_cache.version(account_id)
+            roles = await load_roles(account_id)
+            role_cache.set(account_id, roles, version)
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: int = 30):
+        super().__init__(maxsize, ttl)
+        self._versions = {}
+        self.generation = 0
+
+    def version(self, key) -> tuple:
+        return self._versions.get(key, 0), self.generation
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        if entry[0] != self.version(key):
+            self.pop(key)
+            self.hits -= 1
+            self.misses += 1
+            return default
+        return entry[1]
+
+    def set(self, key, value, version: tuple = None) -> None:
+        super().set(key, (version or self.version(key), value))
+
+    def bump(self, key=None) -> None:
+        """
+        Invalidates the entry of a key, or every entry if no key is given.
+
+        Args:
+            key (Hashable): Key being invalidated.
+        """
+        if key is None:
+            self.generation += 1
+            self._entries.clear()
+        else:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self.pop(key)
+
+    def values(self):
+        return [value for version, value in super().values()]
+
+    def clear(self) -> None:
+        super().clear()
+        self._versions.clear()
+        self.generation += 1
+
+
+session_cache = SessionCache(
+    security_config.SANIC_SECURITY_SESSION_CACHE_SIZE,
+    security_config.SANIC_SECURITY_SESSION_CACHE_TTL,
+)
+role_cache = VersionedCache(
+    security_config.SANIC_SECURITY_ROLE_CACHE_SIZE,
+    security_config.SANIC_SECURITY_ROLE_CACHE_TTL,
+)
+used_captcha_nonces = TTLCache(
+    security_config.SANIC_SECURITY_CAPTCHA_NONCE_CACHE_SIZE,
+    security_config.SANIC_SECURITY_CAPTCHA_SESSION_EXPIRATION,
+)
+used_totp_codes = TTLCache(
+    security_config.SANIC_SECURITY_TOTP_CACHE_SIZE,
+    security_config.SANIC_SECURITY_TOTP_PERIOD * (2 * security_config.SANIC_SECURITY_TOTP_WINDOW + 1),
+)
+totp_attempts = TTLCache(
+    security_config.SANIC_SECURITY_TOTP_CACHE_SIZE,
+    security_config.SANIC_SECURITY_TOTP_PERIOD * (2 * security_config.SANIC_SECURITY_TOTP_WINDOW + 1),
+)
+captcha_image_cache = TTLCache(
+    security_config.SANIC_SECURITY_CAPTCHA_POOL_SIZE * 4,
+    security_config.SANIC_SECURITY_CAPTCHA_SESSION_EXPIRATION,
+)
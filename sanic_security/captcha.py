@@ -1,10 +1,28 @@
+import asyncio
+import datetime
 import functools
+import hashlib
+import hmac
+import secrets
+from collections import deque
 from contextlib import suppress
+from json import dumps as json_dumps
+from types import SimpleNamespace
 
 from sanic import Request, Sanic
 
-from sanic_security.exceptions import NotFoundError, JWTDecodeError
-from sanic_security.utils import decode
+from sanic_security.cache import captcha_image_cache, used_captcha_nonces
+from sanic_security.configuration import config as security_config
+from sanic_security.exceptions import ChallengeError, DeactivatedError, NotFoundError, JWTDecodeError
+from sanic_security.executor import executor
+from sanic_security.utils import (
+    decode,
+    decode_raw,
+    get_code,
+    get_expiration_date,
+    get_ip,
+    render_captcha,
+)
 
 """
 An effective, simple, and async security library for the Sanic framework.
@@ -25,30 +43,233 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 
+class CaptchaPool:
+    """
+    Bounded pool of pre-rendered captcha challenges, so captchas are not rendered while a client waits.
+
+    A background producer renders captchas until the pool is full, at the configured refill rate, and starts again once
+    captchas taken from the pool leave it under its low watermark.
+
+    Attributes:
+        refills (int): Amount of times the producer started refilling the pool.
+    """
+
+    def __init__(self):
+        self._captchas = deque()
+        self._refill = None
+        self.refills = 0
+
+    def __len__(self) -> int:
+        return len(self._captchas)
+
+    def pop(self):
+        """
+        Takes a pre-rendered captcha from the pool, waking up the producer if the pool falls under its low watermark.
+
+        Returns:
+            code, image (None if the pool is empty)
+        """
+        captcha = self._captchas.popleft() if self._captchas else None
+        if self._refill and len(self._captchas) < security_config.SANIC_SECURITY_CAPTCHA_POOL_LOW_WATERMARK:
+            self._refill.set()
+        return captcha
+
+    async def fill(self) -> None:
+        """
+        Renders captchas in the executor until the pool is full.
+        """
+        self.refills += 1
+        while len(self._captchas) < security_config.SANIC_SECURITY_CAPTCHA_POOL_SIZE:
+            code = get_code()
+            self._captchas.append((code, await executor.run(render_captcha, code)))
+            if security_config.SANIC_SECURITY_CAPTCHA_POOL_REFILL_RATE > 0:
+                await asyncio.sleep(1 / security_config.SANIC_SECURITY_CAPTCHA_POOL_REFILL_RATE)
+
+    async def run(self) -> None:
+        """
+        Keeps the pool filled, used as a background task.
+        """
+        self._refill = asyncio.Event()
+        try:
+            while True:
+                self._refill.clear()
+                await self.fill()
+                if len(self._captchas) >= security_config.SANIC_SECURITY_CAPTCHA_POOL_LOW_WATERMARK:
+                    await self._refill.wait()
+        finally:
+            self._refill = None
+
+    def clear(self) -> None:
+        self._captchas.clear()
+
+
+captcha_pool = CaptchaPool()
+
+
+class CaptchaClaims:
+    """
+    Captcha session encoded in its signed cookie, used when stateless captcha is enabled.
+
+    The cookie holds the solution encrypted with a key derived from the challenge's nonce, so it can be recovered to
+    render the challenge's image. Each challenge can only be attempted once, attempted nonces are remembered until the
+    challenge expires.
+
+    Attributes:
+        id (str): Nonce of the captcha challenge.
+        code (str): Solution of the captcha challenge.
+        date_created (datetime): Always None, as it is not encoded in the session's claims.
+        expiration_date (datetime): Date and time the challenge expires and can no longer be attempted.
+        ip (str): IP address of client that requested the challenge.
+        ctx (SimpleNamespace): Encoded session data, holding the encrypted solution.
+    """
+
+    session_type = "capt"
+    active = True
+
+    def __init__(self, claims: dict):
+        self.id = self.pk = claims["sid"]
+        self.date_created = None
+        self.expiration_date = (
+            datetime.datetime.fromtimestamp(claims["exp"], datetime.timezone.utc)
+            if "exp" in claims
+            else None
+        )
+        self.ip = claims.get("ip")
+        self.bearer = None
+        self.ctx = SimpleNamespace(**claims.get("ctx", {}))
+        try:
+            self.code = self._cipher(self.id, bytes.fromhex(self.ctx.challenge)).decode()
+        except (AttributeError, TypeError, ValueError):
+            raise JWTDecodeError("Captcha challenge is malformed.")
+
+    @staticmethod
+    def _cipher(nonce: str, data: bytes) -> bytes:
+        secret = security_config.SANIC_SECURITY_SECRET
+        key = hmac.new(
+            secret.encode() if isinstance(secret, str) else secret,
+            f"captcha:{nonce}".encode(),
+            hashlib.sha256,
+        ).digest()
+        return bytes(byte ^ key[index % len(key)] for index, byte in enumerate(data))
+
+    @classmethod
+    async def new(cls, request: Request, code: str = None):
+        """
+        Creates a captcha challenge without storing it.
+
+        Args:
+            request (Request): Sanic request parameter.
+            code (str): Solution of the challenge, a random code is generated if None.
+
+        Returns:
+            captcha_claims
+        """
+        nonce = secrets.token_urlsafe(16)
+        claims = {
+            "sid": nonce,
+            "ip": get_ip(request),
+            "ctx": {"challenge": cls._cipher(nonce, (code or get_code()).encode()).hex()},
+        }
+        expiration_date = get_expiration_date(security_config.SANIC_SECURITY_CAPTCHA_SESSION_EXPIRATION)
+        if expiration_date:
+            claims["exp"] = expiration_date.replace(tzinfo=datetime.timezone.utc).timestamp()
+        return cls(claims)
+
+    def validate(self) -> None:
+        """
+        Raises an error with respect to session state.
+
+        Raises:
+            DeactivatedError
+        """
+        if self.id in used_captcha_nonces:
+            raise DeactivatedError("Captcha challenge has already been attempted.")
+
+    async def check_code(self, request: Request, code: str) -> None:
+        """
+        Checks if code passed is the challenge's solution, the challenge can not be attempted again afterwards.
+
+        Args:
+            request (Request): Sanic request parameter.
+            code (str): Code being cross-checked with the solution.
+
+        Raises:
+            ChallengeError
+        """
+        used_captcha_nonces.set(self.id, True)
+        if not code or not hmac.compare_digest(self.code.encode(), code.encode()):
+            raise ChallengeError("The value provided does not match.")
+
+    async def json(self) -> str:
+        return json_dumps({
+            "id": self.id,
+            "expiration_date": str(self.expiration_date),
+            "ip": self.ip,
+        })
+
+
 async def request_captcha(request: Request):
     """
     Creates a captcha session and deactivates the client's current captcha session if found.
 
+    The captcha is taken from the pool of pre-rendered captchas when available, see `get_image`. When stateless captcha
+    is enabled, a `CaptchaClaims` challenge is created instead, without accessing the database.
+
+    Args:
+        request (Request): Sanic request parameter.
+
+    Returns:
+        captcha_session
+    """
+    _orm = Sanic.get_app().ctx.extensions['security']
+
+    if security_config.SANIC_SECURITY_STATELESS_CAPTCHA:
+        new_captcha_session = CaptchaClaims.new
+    else:
+        new_captcha_session = _orm.captcha_session.new
+        with suppress(NotFoundError, JWTDecodeError):
+            captcha_session, _ = await decode(_orm.captcha_session, request)
+            if captcha_session.active:
+                await _orm.captcha_session.deactivate(captcha_session)
+    captcha = captcha_pool.pop()
+    if not captcha:
+        return await new_captcha_session(request)
+    code, image = captcha
+    captcha_session = await new_captcha_session(request, code=code)
+    captcha_image_cache.set(str(captcha_session.id), image)
+    return captcha_session
+
+
+async def decode_captcha(request: Request):
+    """
+    Decodes the client's captcha session, a `CaptchaClaims` when stateless captcha is enabled.
+
     Args:
         request (Request): Sanic request parameter.
 
+    Raises:
+        JWTDecodeError
+        ExpiredError
+        NotFoundError
+
     Returns:
         captcha_session
     """
     _orm = Sanic.get_app().ctx.extensions['security']
 
-    with suppress(NotFoundError, JWTDecodeError):
-        captcha_session = await decode(_orm.captcha_session, request)
-        if captcha_session.active:
-            captcha_session.active = False
-            await captcha_session.save(update_fields=["active"])
-    return await _orm.captcha_session.new(request)
+    if security_config.SANIC_SECURITY_STATELESS_CAPTCHA:
+        return CaptchaClaims(decode_raw(_orm.captcha_session, request))
+    captcha_session, _ = await decode(_orm.captcha_session, request)
+    return captcha_session
 
 
 async def captcha(request: Request):
     """
     Validates a captcha challenge attempt.
 
+    A successful attempt is memoized on `request.ctx` for the rest of the request. Stateless captcha challenges are
+    verified against their signed cookie, see `CaptchaClaims`.
+
     Args:
         request (Request): Sanic request parameter. All request bodies are sent as form-data with the following arguments: captcha.
 
@@ -64,11 +285,14 @@ async def captcha(request: Request):
     Returns:
         captcha_session
     """
-    _orm = Sanic.get_app().ctx.extensions['security']
+    captcha_session = getattr(request.ctx, "captcha_session", None)
+    if captcha_session:
+        return captcha_session
 
-    captcha_session, _ = await decode(_orm.captcha_session, request)
+    captcha_session = await decode_captcha(request)
     captcha_session.validate()
     await captcha_session.check_code(request, request.form.get("captcha"))
+    request.ctx.captcha_session = captcha_session
     return captcha_session
 
 
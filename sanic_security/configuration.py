@@ -27,6 +27,9 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 DEFAULT_CONFIG = {
     "SANIC_SECURITY_SECRET": "This is a big secret. Shhhhh",
     "SANIC_SECURITY_PUBLIC_SECRET": None,
+    "SANIC_SECURITY_KEY_ID": None,
+    "SANIC_SECURITY_VERIFICATION_KEYS": None,
+    "SANIC_SECURITY_SESSION_REISSUE_THRESHOLD": 0,
     "SANIC_SECURITY_SESSION_SAMESITE": "strict",
     "SANIC_SECURITY_SESSION_SECURE": True,
     "SANIC_SECURITY_SESSION_HTTPONLY": True,
@@ -37,15 +40,57 @@ DEFAULT_CONFIG = {
     "SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS": 5,
     "SANIC_SECURITY_CAPTCHA_SESSION_EXPIRATION": 60,
     "SANIC_SECURITY_CAPTCHA_FONT": "captcha.ttf",
+    "SANIC_SECURITY_CAPTCHA_RENDER_LIMIT": 2,
+    "SANIC_SECURITY_CAPTCHA_FORMAT": "jpeg",
+    "SANIC_SECURITY_CAPTCHA_WIDTH": 190,
+    "SANIC_SECURITY_CAPTCHA_HEIGHT": 90,
+    "SANIC_SECURITY_CAPTCHA_QUALITY": 75,
+    "SANIC_SECURITY_CAPTCHA_CACHE_CONTROL": None,
+    "SANIC_SECURITY_CAPTCHA_ETAG": False,
+    "SANIC_SECURITY_STATELESS_CAPTCHA": False,
+    "SANIC_SECURITY_CAPTCHA_NONCE_CACHE_SIZE": 65536,
+    "SANIC_SECURITY_CAPTCHA_POOL_SIZE": 0,
+    "SANIC_SECURITY_CAPTCHA_POOL_LOW_WATERMARK": 16,
+    "SANIC_SECURITY_CAPTCHA_POOL_REFILL_RATE": 50,
     "SANIC_SECURITY_TWO_STEP_SESSION_EXPIRATION": 200,
+    "SANIC_SECURITY_TWO_STEP_DELIVERY_CHANNEL": "email",
+    "SANIC_SECURITY_DELIVERY_QUEUE_SIZE": 1000,
+    "SANIC_SECURITY_DELIVERY_WORKERS": 2,
+    "SANIC_SECURITY_DELIVERY_RETRIES": 3,
+    "SANIC_SECURITY_DELIVERY_RETRY_DELAY": 1,
+    "SANIC_SECURITY_TOTP_ISSUER": None,
+    "SANIC_SECURITY_TOTP_DIGITS": 6,
+    "SANIC_SECURITY_TOTP_PERIOD": 30,
+    "SANIC_SECURITY_TOTP_WINDOW": 1,
+    "SANIC_SECURITY_TOTP_CACHE_SIZE": 65536,
     "SANIC_SECURITY_AUTHENTICATION_SESSION_EXPIRATION": 2592000,
     "SANIC_SECURITY_AUTHENTICATION_SESSION_REFRESH": True,
+    "SANIC_SECURITY_STATELESS_AUTHENTICATION": False,
+    "SANIC_SECURITY_REVOCATION_REFRESH_INTERVAL": 60,
+    "SANIC_SECURITY_SESSION_PURGE_INTERVAL": 3600,
+    "SANIC_SECURITY_SESSION_PURGE_RETENTION": 86400,
+    "SANIC_SECURITY_SESSION_PURGE_BATCH_SIZE": 500,
+    "SANIC_SECURITY_SESSION_TTL_INDEXES": False,
+    "SANIC_SECURITY_SESSION_CACHE_SIZE": 1024,
+    "SANIC_SECURITY_SESSION_CACHE_TTL": 5,
+    "SANIC_SECURITY_ROLE_CACHE_SIZE": 1024,
+    "SANIC_SECURITY_ROLE_CACHE_TTL": 30,
+    "SANIC_SECURITY_ROLE_SNAPSHOTS": False,
+    "SANIC_SECURITY_SESSION_STORE": None,
+    "SANIC_SECURITY_REDIS_URL": "redis://127.0.0.1:6379/0",
+    "SANIC_SECURITY_REDIS_POOL_SIZE": 10,
+    "SANIC_SECURITY_REDIS_PREFIX": "sanic_security:",
+    "SANIC_SECURITY_MEMORY_SNAPSHOT_PATH": None,
+    "SANIC_SECURITY_MEMORY_SNAPSHOT_INTERVAL": 60,
+    "SANIC_SECURITY_EXECUTOR": "thread",
+    "SANIC_SECURITY_EXECUTOR_WORKERS": 4,
+    "SANIC_SECURITY_EXECUTOR_QUEUE_SIZE": 64,
     "SANIC_SECURITY_ALLOW_LOGIN_WITH_USERNAME": False,
     "SANIC_SECURITY_INITIAL_ADMIN_EMAIL": "admin@example.com",
     "SANIC_SECURITY_INITIAL_ADMIN_PASSWORD": "admin123",
     "SANIC_SECURITY_INITIAL_ADMIN_PHONE": "1111111111",
     "SANIC_SECURITY_TEST_DATABASE_URL": "sqlite://:memory:",
-    "SANIC_SECURITY_ORM": 'tortoise', # Currently supports ['tortoise', 'umongo']
+    "SANIC_SECURITY_ORM": 'tortoise', # Currently supports ['tortoise', 'umongo', 'memory']
     "SANIC_SECURITY_ACCOUNT": None,
     "SANIC_SECURITY_SESSION": None,
     "SANIC_SECURITY_ROLE": None,
@@ -63,6 +108,9 @@ class Config(dict):
     Attributes:
         SANIC_SECURITY_SECRET (str): The secret used by the hashing algorithm for generating and signing JWTs. This should be a string unique to your application. Keep it safe.
         SANIC_SECURITY_PUBLIC_SECRET (str): The secret used for verifying and decoding JWTs and can be publicly shared. This should be a string unique to your application.
+        SANIC_SECURITY_KEY_ID (str): Identifier of the current key, encoded in the `kid` header of session JWTs so the right key is found during key rotation.
+        SANIC_SECURITY_VERIFICATION_KEYS (dict): Previous keys, by key identifier, still accepted for verifying session JWTs during key rotation.
+        SANIC_SECURITY_SESSION_REISSUE_THRESHOLD (float): Share of a session cookie's remaining lifetime that must pass before it is reissued when encoded with the request it was sent in. Setting to 0 will reissue on every encode.
         SANIC_SECURITY_SESSION_SAMESITE (str): The SameSite attribute of session cookies.
         SANIC_SECURITY_SESSION_SECURE (bool): The Secure attribute of session cookies.
         SANIC_SECURITY_SESSION_HTTPONLY (bool): The HttpOnly attribute of session cookies. HIGHLY recommended that you do not turn this off, unless you know what you are doing.
@@ -73,18 +121,63 @@ class Config(dict):
         SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS (str): The maximum amount of session challenge attempts allowed.
         SANIC_SECURITY_CAPTCHA_SESSION_EXPIRATION (int): The amount of seconds till captcha session expiration on creation. Setting to 0 will disable expiration.
         SANIC_SECURITY_CAPTCHA_FONT (str): The file path to the font being used for captcha generation.
+        SANIC_SECURITY_CAPTCHA_RENDER_LIMIT (int): Maximum amount of captchas being rendered at once when requested, further requests are rejected until one completes.
+        SANIC_SECURITY_CAPTCHA_FORMAT (str): Image format of captcha challenges, either jpeg, png or webp.
+        SANIC_SECURITY_CAPTCHA_WIDTH (int): Width of captcha images in pixels.
+        SANIC_SECURITY_CAPTCHA_HEIGHT (int): Height of captcha images in pixels.
+        SANIC_SECURITY_CAPTCHA_QUALITY (int): Encoding quality of jpeg and webp captcha images, from 1 to 100. Lower quality results in smaller images.
+        SANIC_SECURITY_CAPTCHA_CACHE_CONTROL (str): Cache-Control header of captcha images, such as "private, no-cache". Setting to None will omit the header.
+        SANIC_SECURITY_CAPTCHA_ETAG (bool): Captcha images are served with an ETag, so clients already holding an image are answered with 304 Not Modified.
+        SANIC_SECURITY_STATELESS_CAPTCHA (bool): Captcha challenges are encoded in their signed cookie instead of being stored in the database, each challenge can be attempted once. Requires captcha session expiration.
+        SANIC_SECURITY_CAPTCHA_NONCE_CACHE_SIZE (int): Maximum amount of attempted stateless captcha challenges remembered by each worker to prevent replays, should cover the challenges attempted within the captcha session expiration.
+        SANIC_SECURITY_CAPTCHA_POOL_SIZE (int): Maximum amount of captchas rendered ahead of being requested. Setting to 0 will disable the captcha pool.
+        SANIC_SECURITY_CAPTCHA_POOL_LOW_WATERMARK (int): Amount of pre-rendered captchas under which the captcha pool is refilled.
+        SANIC_SECURITY_CAPTCHA_POOL_REFILL_RATE (int): Maximum amount of captchas rendered per second while refilling the captcha pool. Setting to 0 will render without pause.
         SANIC_SECURITY_TWO_STEP_SESSION_EXPIRATION (int):  The amount of seconds till two step session expiration on creation. Setting to 0 will disable expiration.
+        SANIC_SECURITY_TWO_STEP_DELIVERY_CHANNEL (str): Channel two-step codes are delivered through when a transport is registered for it, either email or sms.
+        SANIC_SECURITY_DELIVERY_QUEUE_SIZE (int): Maximum amount of messages waiting to be delivered per channel, further requests are rejected until messages are delivered.
+        SANIC_SECURITY_DELIVERY_WORKERS (int): Amount of worker tasks delivering messages per channel.
+        SANIC_SECURITY_DELIVERY_RETRIES (int): Maximum amount of times a message failing to be delivered is retried.
+        SANIC_SECURITY_DELIVERY_RETRY_DELAY (float): Base amount of seconds before retrying delivery, doubled on each retry with random jitter.
+        SANIC_SECURITY_TOTP_ISSUER (str): Issuer displayed by authenticator apps for enrolled TOTP secrets. Setting to None will omit the issuer.
+        SANIC_SECURITY_TOTP_DIGITS (int): Amount of digits of TOTP codes.
+        SANIC_SECURITY_TOTP_PERIOD (int): The amount of seconds each TOTP code is valid for.
+        SANIC_SECURITY_TOTP_WINDOW (int): Amount of TOTP periods before and after the current one whose codes are still accepted, to tolerate clock drift.
+        SANIC_SECURITY_TOTP_CACHE_SIZE (int): Maximum amount of used TOTP codes and failed TOTP attempt counters remembered by each worker.
         SANIC_SECURITY_AUTHENTICATION_SESSION_EXPIRATION (bool): The amount of seconds till authentication session expiration on creation. Setting to 0 will disable expiration.
         SANIC_SECURITY_AUTHENTICATION_SESSION_REFRESH (bool): A refresh token can be used to generate a new session instead of reauthenticating.
+        SANIC_SECURITY_STATELESS_AUTHENTICATION (bool): Authenticates clients from verified JWT claims alone, without a session lookup. Revoked sessions and accounts are tracked in memory. Authenticated sessions are then `AuthenticationClaims`, whose bearer must be fetched for full account access.
+        SANIC_SECURITY_REVOCATION_REFRESH_INTERVAL (int): The amount of seconds between reloads of revoked sessions and accounts from the database when stateless authentication is enabled. Bounds how long a deactivated session or disabled account remains usable on other workers.
+        SANIC_SECURITY_SESSION_PURGE_INTERVAL (int): The amount of seconds between purges of sessions that can no longer be used. Setting to 0 will disable purging.
+        SANIC_SECURITY_SESSION_PURGE_RETENTION (int): The amount of seconds sessions are kept after they can no longer be used, before being purged.
+        SANIC_SECURITY_SESSION_PURGE_BATCH_SIZE (int): Maximum amount of sessions deleted at once while purging.
+        SANIC_SECURITY_SESSION_TTL_INDEXES (bool): Creates MongoDB TTL indexes that delete sessions after the purge retention, when using uMongo.
+        SANIC_SECURITY_SESSION_CACHE_SIZE (int): The maximum amount of looked up sessions held in memory. Setting to 0 will disable the session cache.
+        SANIC_SECURITY_SESSION_CACHE_TTL (int): The amount of seconds a looked up session is held in memory. Bounds how long a session changed on another worker is served stale. Setting to 0 will disable the session cache.
+        SANIC_SECURITY_ROLE_CACHE_SIZE (int): The maximum amount of accounts whose roles are held in memory. Setting to 0 will disable the role cache.
+        SANIC_SECURITY_ROLE_CACHE_TTL (int): The amount of seconds an account's roles are held in memory. Bounds how long roles changed on another worker are served stale. Setting to 0 will disable the role cache.
+        SANIC_SECURITY_ROLE_SNAPSHOTS (bool): Embeds copies of an account's roles in the account document (uMongo), so authorization does not fetch roles.
+        SANIC_SECURITY_SESSION_STORE (str): Stores sessions in Redis ('redis') rather than with the ORM, accounts and roles remain with the ORM. Setting to None will store sessions with the ORM.
+        SANIC_SECURITY_REDIS_URL (str): URL of the Redis server sessions are stored in, or fake:// for an in-process stand-in.
+        SANIC_SECURITY_REDIS_POOL_SIZE (int): The maximum amount of open Redis connections.
+        SANIC_SECURITY_REDIS_PREFIX (str): Prefix attached to the beginning of Redis keys.
+        SANIC_SECURITY_MEMORY_SNAPSHOT_PATH (str): File the memory ORM's store is loaded from on start and saved to, periodically and on stop. Setting to None will disable snapshots.
+        SANIC_SECURITY_MEMORY_SNAPSHOT_INTERVAL (int): The amount of seconds between memory ORM snapshots. Setting to 0 will only save on stop.
+        SANIC_SECURITY_EXECUTOR (str): Executor running password hashing off the event loop ('thread', 'process' or 'inline' to run on the event loop).
+        SANIC_SECURITY_EXECUTOR_WORKERS (int): The amount of threads or processes in the executor.
+        SANIC_SECURITY_EXECUTOR_QUEUE_SIZE (int): The maximum amount of calls waiting for an executor worker, further calls are rejected with a 503 error.
         SANIC_SECURITY_ALLOW_LOGIN_WITH_USERNAME (bool): Allows login via username and email.
         SANIC_SECURITY_INITIAL_ADMIN_EMAIL (str): Email used when creating the initial admin account.
         SANIC_SECURITY_INITIAL_ADMIN_PASSWORD (str) Password used when creating the initial admin account.
         SANIC_SECURITY_TEST_DATABASE_URL (str): Database URL for connecting to the database Sanic Security will use for testing
-        SANIC_SECURITY_ORM (str): ORM to use (right now, 'tortoise', 'umongo', or 'manual')
+        SANIC_SECURITY_ORM (str): ORM to use (right now, 'tortoise', 'umongo', 'memory', or 'manual')
     """
 
     SANIC_SECURITY_SECRET: str
     SANIC_SECURITY_PUBLIC_SECRET: str
+    SANIC_SECURITY_KEY_ID: str
+    SANIC_SECURITY_VERIFICATION_KEYS: dict
+    SANIC_SECURITY_SESSION_REISSUE_THRESHOLD: float
     SANIC_SECURITY_SESSION_SAMESITE: str
     SANIC_SECURITY_SESSION_SECURE: bool
     SANIC_SECURITY_SESSION_HTTPONLY: bool
@@ -95,9 +188,51 @@ class Config(dict):
     SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS: int
     SANIC_SECURITY_CAPTCHA_SESSION_EXPIRATION: int
     SANIC_SECURITY_CAPTCHA_FONT: str
+    SANIC_SECURITY_CAPTCHA_RENDER_LIMIT: int
+    SANIC_SECURITY_CAPTCHA_FORMAT: str
+    SANIC_SECURITY_CAPTCHA_WIDTH: int
+    SANIC_SECURITY_CAPTCHA_HEIGHT: int
+    SANIC_SECURITY_CAPTCHA_QUALITY: int
+    SANIC_SECURITY_CAPTCHA_CACHE_CONTROL: str
+    SANIC_SECURITY_CAPTCHA_ETAG: bool
+    SANIC_SECURITY_STATELESS_CAPTCHA: bool
+    SANIC_SECURITY_CAPTCHA_NONCE_CACHE_SIZE: int
+    SANIC_SECURITY_CAPTCHA_POOL_SIZE: int
+    SANIC_SECURITY_CAPTCHA_POOL_LOW_WATERMARK: int
+    SANIC_SECURITY_CAPTCHA_POOL_REFILL_RATE: int
     SANIC_SECURITY_TWO_STEP_SESSION_EXPIRATION: int
+    SANIC_SECURITY_TWO_STEP_DELIVERY_CHANNEL: str
+    SANIC_SECURITY_DELIVERY_QUEUE_SIZE: int
+    SANIC_SECURITY_DELIVERY_WORKERS: int
+    SANIC_SECURITY_DELIVERY_RETRIES: int
+    SANIC_SECURITY_DELIVERY_RETRY_DELAY: float
+    SANIC_SECURITY_TOTP_ISSUER: str
+    SANIC_SECURITY_TOTP_DIGITS: int
+    SANIC_SECURITY_TOTP_PERIOD: int
+    SANIC_SECURITY_TOTP_WINDOW: int
+    SANIC_SECURITY_TOTP_CACHE_SIZE: int
     SANIC_SECURITY_AUTHENTICATION_SESSION_EXPIRATION: int
     SANIC_SECURITY_AUTHENTICATION_SESSION_REFRESH: bool
+    SANIC_SECURITY_STATELESS_AUTHENTICATION: bool
+    SANIC_SECURITY_REVOCATION_REFRESH_INTERVAL: int
+    SANIC_SECURITY_SESSION_PURGE_INTERVAL: int
+    SANIC_SECURITY_SESSION_PURGE_RETENTION: int
+    SANIC_SECURITY_SESSION_PURGE_BATCH_SIZE: int
+    SANIC_SECURITY_SESSION_TTL_INDEXES: bool
+    SANIC_SECURITY_SESSION_CACHE_SIZE: int
+    SANIC_SECURITY_SESSION_CACHE_TTL: int
+    SANIC_SECURITY_ROLE_CACHE_SIZE: int
+    SANIC_SECURITY_ROLE_CACHE_TTL: int
+    SANIC_SECURITY_ROLE_SNAPSHOTS: bool
+    SANIC_SECURITY_SESSION_STORE: str
+    SANIC_SECURITY_REDIS_URL: str
+    SANIC_SECURITY_REDIS_POOL_SIZE: int
+    SANIC_SECURITY_REDIS_PREFIX: str
+    SANIC_SECURITY_MEMORY_SNAPSHOT_PATH: str
+    SANIC_SECURITY_MEMORY_SNAPSHOT_INTERVAL: int
+    SANIC_SECURITY_EXECUTOR: str
+    SANIC_SECURITY_EXECUTOR_WORKERS: int
+    SANIC_SECURITY_EXECUTOR_QUEUE_SIZE: int
     SANIC_SECURITY_ALLOW_LOGIN_WITH_USERNAME: bool
     SANIC_SECURITY_INITIAL_ADMIN_EMAIL: str
     SANIC_SECURITY_INITIAL_ADMIN_PASSWORD: str
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import random
+
+from sanic.log import logger
+
+from sanic_security.configuration import config as security_config
+from sanic_security.exceptions import BusyError
+from sanic_security.executor import executor
+
+"""
+An effective, simple, and async security library for the Sanic framework.
+Copyright (C) 2020-present Aidan Stewart
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+class DeliveryMessage:
+    """
+    Verification code waiting to be delivered to a client.
+
+    Attributes:
+        channel (str): Name of the transport delivering the message, such as email or sms.
+        recipient (str): Address the message is delivered to, such as an email address or phone number.
+        code (str): Verification code being delivered.
+        attempts (int): Amount of failed attempts to deliver the message.
+    """
+
+    def __init__(self, channel: str, recipient: str, code: str):
+        self.channel = channel
+        self.recipient = recipient
+        self.code = code
+        self.attempts = 0
+
+    def json(self) -> dict:
+        return {"channel": self.channel, "recipient": self.recipient, "code": self.code}
+
+
+class Transport:
+    """
+    Delivers batches of messages through a provider, such as an SMTP server or an SMS gateway.
+
+    Subclasses implement `send`, raising an exception if the batch could not be delivered so it is retried.
+
+    Attributes:
+        batch_size (int): Maximum amount of messages sent at once.
+    """
+
+    batch_size = 1
+
+    async def send(self, messages: list) -> None:
+        """
+        Delivers a batch of messages.
+
+        Args:
+            messages (list[DeliveryMessage]): Messages being delivered.
+        """
+        raise NotImplementedError()
+
+
+class MemoryTransport(Transport):
+    """
+    Keeps delivered messages in memory, for testing.
+
+    Attributes:
+        sent (list[DeliveryMessage]): Messages delivered.
+    """
+
+    def __init__(self, batch_size: int = 100):
+        self.batch_size = batch_size
+        self.sent = []
+
+    async def send(self, messages: list) -> None:
+        self.sent.extend(messages)
+
+
+class FileTransport(Transport):
+    """
+    Appends delivered messages to a file as JSON lines, for local development.
+
+    Attributes:
+        path (str): Path of the file messages are appended to.
+    """
+
+    def __init__(self, path: str, batch_size: int = 100):
+        self.path = path
+        self.batch_size = batch_size
+
+    def _write(self, lines: list) -> None:
+        with open(self.path, "a") as file:
+            file.writelines(lines)
+
+    async def send(self, messages: list) -> None:
+        await executor.run(self._write, [json.dumps(message.json()) + "\n" for message in messages])
+
+
+class DeliveryQueue:
+    """
+    Delivers verification codes in the background, so clients don't wait on providers.
+
+    Each channel has a bounded queue drained by worker tasks in batches of its transport's batch size. Failed batches
+    are retried with exponential backoff and full jitter, and dropped once out of retries.
+
+    Attributes:
+        delivered (int): Amount of messages delivered.
+        failed (int): Amount of messages dropped after running out of retries.
+    """
+
+    def __init__(self):
+        self._transports = {}
+        self._queues = {}
+        self.delivered = self.failed = 0
+
+    def register_transport(self, channel: str, transport: Transport) -> None:
+        """
+        Delivers messages of a channel through a transport.
+
+        Args:
+            channel (str): Name of the channel, such as email or sms.
+            transport (Transport): Transport delivering the channel's messages.
+        """
+        self._transports[channel] = transport
+
+    def has_transport(self, channel: str) -> bool:
+        return channel in self._transports
+
+    @property
+    def pending(self) -> int:
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def _get_queue(self, channel: str) -> asyncio.Queue:
+        queue = self._queues.get(channel)
+        if not queue:
+            queue = self._queues[channel] = asyncio.Queue(security_config.SANIC_SECURITY_DELIVERY_QUEUE_SIZE)
+        return queue
+
+    def enqueue(self, message: DeliveryMessage) -> None:
+        """
+        Queues a message to be delivered through its channel's transport.
+
+        Args:
+            message (DeliveryMessage): Message being delivered.
+
+        Raises:
+            BusyError
+        """
+        if message.channel not in self._transports:
+            raise ValueError(f"No transport registered for channel {message.channel}.")
+        try:
+            self._get_queue(message.channel).put_nowait(message)
+        except asyncio.QueueFull:
+            raise BusyError()
+
+    async def _send(self, transport: Transport, messages: list) -> None:
+        while messages:
+            try:
+                await transport.send(messages)
+                self.delivered += len(messages)
+                return
+            except Exception as e:
+                for message in messages:
+                    message.attempts += 1
+                retries = [
+                    message for message in messages
+                    if message.attempts <= security_config.SANIC_SECURITY_DELIVERY_RETRIES
+                ]
+                self.failed += len(messages) - len(retries)
+                logger.warning(f"[Sanic-Security] Failed to deliver {len(messages)} messages: {e}")
+                messages = retries
+                if messages:
+                    await asyncio.sleep(
+                        random.uniform(0, security_config.SANIC_SECURITY_DELIVERY_RETRY_DELAY * 2 ** (messages[0].attempts - 1))
+                    )
+
+    async def _work(self, channel: str) -> None:
+        queue = self._get_queue(channel)
+        while True:
+            messages = [await queue.get()]
+            while len(messages) < self._transports[channel].batch_size and not queue.empty():
+                messages.append(queue.get_nowait())
+            try:
+                await self._send(self._transports[channel], messages)
+            finally:
+                for _ in messages:
+                    queue.task_done()
+
+    def start(self, loop) -> list:
+        """
+        Schedules the configured amount of worker tasks for each channel.
+
+        Args:
+            loop: Event loop the workers are scheduled on.
+
+        Returns:
+            worker_tasks
+        """
+        return [
+            loop.create_task(self._work(channel))
+            for channel in self._transports
+            for _ in range(security_config.SANIC_SECURITY_DELIVERY_WORKERS)
+        ]
+
+    async def join(self) -> None:
+        """
+        Waits until every queued message has been delivered or dropped.
+        """
+        for queue in list(self._queues.values()):
+            await queue.join()
+
+    def clear(self) -> None:
+        if self.pending:
+            logger.warning(f"[Sanic-Security] Discarding {self.pending} undelivered messages.")
+        self._queues.clear()
+
+
+delivery_queue = DeliveryQueue()
@@ -106,3 +106,8 @@ class CredentialsError(SecurityError):
 class IntegrityError(SecurityError):
     def __init__(self, message, code=400):
         super().__init__(message, code)
+
+
+class BusyError(SecurityError):
+    def __init__(self, message="Server is busy, try again later.", code=503):
+        super().__init__(message, code)
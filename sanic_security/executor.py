@@ -0,0 +1,126 @@
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from sanic_security.configuration import config as security_config
+from sanic_security.exceptions import BusyError
+
+"""
+An effective, simple, and async security library for the Sanic framework.
+Copyright (C) 2020-present Aidan Stewart
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+class BoundedExecutor:
+    """
+    Runs blocking, CPU bound work (such as password hashing) outside of the event loop, in a thread or process pool
+    with a bounded amount of pending calls.
+
+    The pool is created on first use with the configured executor type and workers.
+
+    Attributes:
+        pending (int): Amount of calls submitted and not yet completed.
+        capped_pending (dict): Amount of calls submitted and not yet completed by `run_capped`, by name.
+    """
+
+    def __init__(self):
+        self._executor: Executor = None
+        self.pending = 0
+        self.capped_pending = {}
+
+    @property
+    def limit(self) -> int:
+        return (
+            security_config.SANIC_SECURITY_EXECUTOR_WORKERS
+            + security_config.SANIC_SECURITY_EXECUTOR_QUEUE_SIZE
+        )
+
+    def _get_executor(self) -> Executor:
+        if not self._executor:
+            if security_config.SANIC_SECURITY_EXECUTOR == "process":
+                self._executor = ProcessPoolExecutor(
+                    security_config.SANIC_SECURITY_EXECUTOR_WORKERS
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    security_config.SANIC_SECURITY_EXECUTOR_WORKERS,
+                    thread_name_prefix="sanic-security",
+                )
+        return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Runs a function in the executor. Functions run in a process pool must be picklable.
+
+        Args:
+            func (Callable): Blocking function being run.
+            *args: Arguments passed to the function.
+            **kwargs: Keyword arguments passed to the function.
+
+        Returns:
+            result
+
+        Raises:
+            BusyError
+        """
+        if security_config.SANIC_SECURITY_EXECUTOR == "inline":
+            return func(*args, **kwargs)
+        if self.pending >= self.limit:
+            raise BusyError()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), functools.partial(func, *args, **kwargs)
+            )
+        finally:
+            self.pending -= 1
+
+    async def run_capped(self, name: str, cap: int, func, *args, **kwargs):
+        """
+        Runs a function in the executor with at most `cap` pending calls of the same name, so one kind of work (such as
+        captcha rendering) cannot take over the executor.
+
+        Args:
+            name (str): Name of the kind of work being run.
+            cap (int): Maximum amount of pending calls of this name.
+            func (Callable): Blocking function being run.
+            *args: Arguments passed to the function.
+            **kwargs: Keyword arguments passed to the function.
+
+        Returns:
+            result
+
+        Raises:
+            BusyError
+        """
+        if self.capped_pending.get(name, 0) >= cap:
+            raise BusyError()
+        self.capped_pending[name] = self.capped_pending.get(name, 0) + 1
+        try:
+            return await self.run(func, *args, **kwargs)
+        finally:
+            self.capped_pending[name] -= 1
+
+    def shutdown(self) -> None:
+        """
+        Shuts the pool down, a new one is created on next use.
+        """
+        if self._executor:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+executor = BoundedExecutor()
@@ -0,0 +1,116 @@
+from jwt.algorithms import get_default_algorithms
+
+from sanic_security.configuration import config as security_config
+from sanic_security.exceptions import JWTDecodeError
+
+"""
+An effective, simple, and async security library for the Sanic framework.
+Copyright (C) 2020-present Aidan Stewart
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+class Keyring:
+    """
+    Parsed keys used to sign and verify session JWTs, so keys are not parsed on every request.
+
+    Verification keys are indexed by key id (`kid` header). The current key is used for tokens without a key id, and
+    previous keys listed in `SANIC_SECURITY_VERIFICATION_KEYS` keep verifying tokens signed before a key rotation.
+    The keyring is rebuilt whenever the keys in the configuration change.
+
+    Attributes:
+        kid (str): Key id of the current signing key, encoded in the header of issued tokens.
+        algorithm (str): Algorithm used to encode and decode session JWTs.
+    """
+
+    def __init__(self):
+        self.kid = None
+        self.algorithm = None
+        self._signing_key = None
+        self._verification_key = None
+        self._verification_keys = {}
+        self._source = None
+
+    @staticmethod
+    def _get_source() -> tuple:
+        return (
+            security_config.SANIC_SECURITY_SECRET,
+            security_config.SANIC_SECURITY_PUBLIC_SECRET,
+            security_config.SANIC_SECURITY_SESSION_ENCODING_ALGORITHM,
+            security_config.SANIC_SECURITY_KEY_ID,
+            security_config.SANIC_SECURITY_VERIFICATION_KEYS,
+        )
+
+    def reload(self) -> None:
+        """
+        Parses the keys in the configuration.
+        """
+        source = self._get_source()
+        secret, public_secret, algorithm, kid, verification_keys = source
+        prepare_key = get_default_algorithms()[algorithm].prepare_key
+        self.kid = kid
+        self.algorithm = algorithm
+        self._signing_key = prepare_key(secret)
+        self._verification_key = prepare_key(public_secret or secret)
+        self._verification_keys = {
+            previous_kid: prepare_key(previous_key)
+            for previous_kid, previous_key in (verification_keys or {}).items()
+        }
+        if kid:
+            self._verification_keys[kid] = self._verification_key
+        self._source = source
+
+    def _ensure_loaded(self) -> None:
+        if self._source != self._get_source():
+            self.reload()
+
+    @property
+    def has_key_ids(self) -> bool:
+        self._ensure_loaded()
+        return bool(self._verification_keys)
+
+    def get_signing_key(self):
+        """
+        Retrieves the parsed key used to sign session JWTs.
+
+        Returns:
+            signing_key
+        """
+        self._ensure_loaded()
+        return self._signing_key
+
+    def get_verification_key(self, kid: str = None):
+        """
+        Retrieves the parsed key used to verify session JWTs.
+
+        Args:
+            kid (str): Key id from the token header, the current key is used if None.
+
+        Returns:
+            verification_key
+
+        Raises:
+            JWTDecodeError
+        """
+        self._ensure_loaded()
+        if not kid:
+            return self._verification_key
+        try:
+            return self._verification_keys[kid]
+        except KeyError:
+            raise JWTDecodeError("Session token signed with an unknown key.")
+
+
+keyring = Keyring()
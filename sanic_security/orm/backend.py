@@ -0,0 +1,192 @@
+import asyncio
+from typing import Protocol, runtime_checkable
+
+from sanic.request import Request
+
+from sanic_security.exceptions import NotFoundError
+
+"""
+An effective, simple, and async security library for the Sanic framework.
+Copyright (C) 2020-present Aidan Stewart
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+@runtime_checkable
+class AccountBackend(Protocol):
+    """
+    Methods Sanic Security calls on the account model.
+
+    Backends can also implement `lookup_many(ids)` and `get_roles_many(ids)` efficiently, see `lookup_many` and
+    `get_roles_many` for the fallbacks used otherwise.
+    """
+
+    async def lookup(self, email: str = None, username: str = None, phone: str = None, id: str = None):
+        ...
+
+    async def new(self, **kwargs):
+        ...
+
+    async def get_roles(self, id=None) -> list:
+        ...
+
+    async def add_role(self, id=None, role=None):
+        ...
+
+
+@runtime_checkable
+class RoleBackend(Protocol):
+    """
+    Methods Sanic Security calls on the role model.
+    """
+
+    async def lookup(self, name: str):
+        ...
+
+    async def new(self, **kwargs):
+        ...
+
+
+@runtime_checkable
+class SessionBackend(Protocol):
+    """
+    Methods Sanic Security calls on session models.
+
+    Backends can also implement `lookup_many(ids)` and `deactivate_many(sessions)` efficiently, see `lookup_many` and
+    `deactivate_many` for the fallbacks used otherwise.
+    """
+
+    async def new(self, request: Request, *args, **kwargs):
+        ...
+
+    async def lookup(self, id: str = None):
+        ...
+
+    async def deactivate(self, session):
+        ...
+
+
+@runtime_checkable
+class VerificationSessionBackend(SessionBackend, Protocol):
+    """
+    Methods Sanic Security calls on verification session models.
+    """
+
+    async def check_code(self, request: Request, code: str) -> None:
+        ...
+
+
+def get_missing_methods(model, backend) -> list:
+    """
+    Retrieves the methods of a backend protocol a model does not implement.
+
+    Args:
+        model: Model, or an instance of it.
+        backend: Backend protocol, such as `AccountBackend`.
+
+    Returns:
+        missing_methods
+    """
+    return [
+        method for method in dir(backend)
+        if not method.startswith("_") and callable(getattr(backend, method))
+        and not callable(getattr(model, method, None))
+    ]
+
+
+def validate_backend(model, backend) -> None:
+    """
+    Raises an error if a model does not implement a backend protocol.
+
+    Args:
+        model: Model, or an instance of it.
+        backend: Backend protocol, such as `AccountBackend`.
+
+    Raises:
+        TypeError
+    """
+    missing_methods = get_missing_methods(model, backend)
+    if missing_methods:
+        cls = model if isinstance(model, type) else model.__class__
+        raise TypeError(f"{cls.__name__} does not implement {', '.join(missing_methods)} of {backend.__name__}.")
+
+
+async def lookup_many(model, ids: list) -> list:
+    """
+    Retrieves accounts, or sessions and their bearers, by id. Identifiers not found are skipped.
+
+    Uses the model's `lookup_many` if implemented, otherwise looks each identifier up concurrently.
+
+    Args:
+        model: Account or session model.
+        ids (list): Identifiers being retrieved.
+
+    Returns:
+        accounts (list), or sessions and their bearers (list of session, bearer)
+    """
+    if hasattr(model, "lookup_many"):
+        return await model.lookup_many(ids)
+    found = []
+    for result in await asyncio.gather(*(model.lookup(id=id) for id in ids), return_exceptions=True):
+        if isinstance(result, NotFoundError):
+            continue
+        elif isinstance(result, BaseException):
+            raise result
+        found.append(result)
+    return found
+
+
+async def get_roles_many(model, ids: list) -> dict:
+    """
+    Retrieves the roles of several accounts. Accounts not found are skipped.
+
+    Uses the model's `get_roles_many` if implemented, otherwise retrieves each account's roles concurrently.
+
+    Args:
+        model: Account model.
+        ids (list): Identifiers of the accounts.
+
+    Returns:
+        roles (dict of account id, roles)
+    """
+    if hasattr(model, "get_roles_many"):
+        return await model.get_roles_many(ids)
+    roles = {}
+    results = await asyncio.gather(*(model.get_roles(id) for id in ids), return_exceptions=True)
+    for id, result in zip(ids, results):
+        if isinstance(result, NotFoundError):
+            continue
+        elif isinstance(result, BaseException):
+            raise result
+        roles[str(id)] = list(result)
+    return roles
+
+
+async def deactivate_many(model, sessions: list) -> list:
+    """
+    Deactivates several sessions.
+
+    Uses the model's `deactivate_many` if implemented, otherwise deactivates each session in turn.
+
+    Args:
+        model: Session model.
+        sessions (list): Sessions being deactivated.
+
+    Returns:
+        sessions
+    """
+    if hasattr(model, "deactivate_many"):
+        return await model.deactivate_many(sessions)
+    return [await model.deactivate(session) for session in sessions]
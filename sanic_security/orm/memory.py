@@ -0,0 +1,802 @@
+import datetime
+import heapq
+import os
+import re
+import uuid
+from json import dumps as json_dumps, loads as json_loads
+from types import SimpleNamespace
+
+import phonenumbers
+from sanic.log import logger
+from sanic.request import Request
+
+from sanic_security.cache import role_cache, session_cache
+from sanic_security.configuration import config as security_config
+from sanic_security.exceptions import *
+from sanic_security.utils import get_ip, get_code, get_expiration_date
+
+"""
+An effective, simple, and async security library for the Sanic framework.
+Copyright (C) 2020-present Aidan Stewart
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _aware(date: datetime.datetime):
+    return date.replace(tzinfo=datetime.timezone.utc) if date and not date.tzinfo else date
+
+
+class MemoryStore:
+    """
+    Indexed in-process storage of the memory ORM's models, for single node deployments and tests.
+
+    Accounts are indexed by id, email, username and phone, and roles by name. Sessions are kept in a map per session
+    type, with a heap ordered by the date they can no longer be used so purging doesn't scan every session, and
+    indexes of revoked sessions and session families. The store can be saved to and loaded from a JSON snapshot.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self) -> None:
+        self.accounts = {}
+        self.account_indexes = {"email": {}, "username": {}, "phone": {}}
+        self.roles = {}
+        self.roles_by_name = {}
+        self.sessions = {}
+        self.purge_heaps = {}
+        self.revoked_sessions = {}
+        self.families = {}
+
+    def add_account(self, account) -> None:
+        for field, index in self.account_indexes.items():
+            value = getattr(account, field)
+            if value and value in index:
+                raise AccountError(f"An account with this {field} already exists.", 400)
+        self.accounts[account.id] = account
+        for field, index in self.account_indexes.items():
+            if getattr(account, field):
+                index[getattr(account, field)] = account
+
+    def add_role(self, role) -> None:
+        if role.name in self.roles_by_name:
+            raise AccountError(f"A role with this name already exists.", 400)
+        self.roles[role.id] = role
+        self.roles_by_name[role.name] = role
+
+    def add_session(self, session) -> None:
+        self.sessions.setdefault(session.session_type, {})[session.id] = session
+        purge_date = getattr(session, session.purge_field)
+        if purge_date:
+            heapq.heappush(
+                self.purge_heaps.setdefault(session.session_type, []), (purge_date.timestamp(), session.id)
+            )
+        if not session.active or session.deleted:
+            self.revoked_sessions.setdefault(session.session_type, {})[session.id] = session
+        if getattr(session, "family", None):
+            self.families.setdefault(session.family, set()).add(session.id)
+
+    def remove_session(self, session) -> None:
+        self.sessions.get(session.session_type, {}).pop(session.id, None)
+        self.revoked_sessions.get(session.session_type, {}).pop(session.id, None)
+        family = getattr(session, "family", None)
+        if family in self.families:
+            self.families[family].discard(session.id)
+            if not self.families[family]:
+                del self.families[family]
+
+    def dump(self) -> str:
+        """
+        Serializes the store into a JSON snapshot.
+
+        Returns:
+            snapshot
+        """
+        return json_dumps({
+            "accounts": [_dump_model(account) for account in self.accounts.values()],
+            "roles": [_dump_model(role) for role in self.roles.values()],
+            "sessions": {
+                session_type: [_dump_model(session) for session in sessions.values()]
+                for session_type, sessions in self.sessions.items()
+            },
+        })
+
+    def load(self, snapshot: str) -> None:
+        """
+        Replaces the store's models with the models of a JSON snapshot.
+
+        Args:
+            snapshot (str): Snapshot created by `dump`.
+        """
+        data = json_loads(snapshot)
+        self.clear()
+        for fields in data["roles"]:
+            self.add_role(Role(**_load_fields(fields)))
+        for fields in data["accounts"]:
+            fields = _load_fields(fields)
+            fields["roles"] = [self.roles[role_id] for role_id in fields.get("roles", []) if role_id in self.roles]
+            self.add_account(Account(**fields))
+        for session_type, sessions in data["sessions"].items():
+            session_model = _session_models[session_type]
+            for fields in sessions:
+                fields = _load_fields(fields)
+                fields["bearer"] = self.accounts.get(fields.get("bearer"))
+                self.add_session(session_model(**fields))
+
+
+store = MemoryStore()
+
+
+def _dump_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"$date": value.isoformat()}
+    elif isinstance(value, SimpleNamespace):
+        return {"$ctx": {key: _dump_value(item) for key, item in vars(value).items()}}
+    elif isinstance(value, BaseModel):
+        return value.id
+    elif isinstance(value, list):
+        return [_dump_value(item) for item in value]
+    return value
+
+
+def _dump_model(model) -> dict:
+    return {key: _dump_value(value) for key, value in vars(model).items()}
+
+
+def _load_value(value):
+    if isinstance(value, dict) and "$date" in value:
+        return datetime.datetime.fromisoformat(value["$date"])
+    elif isinstance(value, dict) and "$ctx" in value:
+        return SimpleNamespace(**{key: _load_value(item) for key, item in value["$ctx"].items()})
+    return value
+
+
+def _load_fields(fields: dict) -> dict:
+    return {key: _load_value(value) for key, value in fields.items()}
+
+
+def _write_snapshot(path: str, snapshot: str) -> None:
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as file:
+        file.write(snapshot)
+    os.replace(temporary_path, path)
+
+
+def load_snapshot() -> bool:
+    """
+    Loads the store from the configured snapshot path, if a snapshot was saved.
+
+    Returns:
+        loaded
+    """
+    path = security_config.SANIC_SECURITY_MEMORY_SNAPSHOT_PATH
+    if not path or not os.path.isfile(path):
+        return False
+    with open(path) as file:
+        store.load(file.read())
+    logger.info(f"[Sanic-Security] Loaded {len(store.accounts)} accounts from memory snapshot {path}.")
+    return True
+
+
+async def save_snapshot() -> None:
+    """
+    Saves the store to the configured snapshot path. The store is serialized on the event loop, so the snapshot is
+    consistent, and written in the executor.
+    """
+    from sanic_security.executor import executor
+
+    path = security_config.SANIC_SECURITY_MEMORY_SNAPSHOT_PATH
+    if path:
+        await executor.run(_write_snapshot, path, store.dump())
+
+
+def prepare_serializers() -> None:
+    """
+    Memory models are serialized from their attributes, there is nothing to prepare.
+    """
+
+
+class BaseModel:
+    """
+    Base Sanic Security model that all other models derive from.
+
+    Attributes:
+        id (str): Primary key of model.
+        date_created (datetime): Time this model was created.
+        date_updated (datetime): Time this model was updated.
+        deleted (bool): Renders the model filterable without removing it from the store.
+    """
+
+    json_exclude = ()
+
+    def __init__(self, **kwargs):
+        self.id = self.pk = kwargs.pop("id", None)
+        kwargs.pop("pk", None)
+        self.date_created = self.date_updated = _now()
+        self.deleted = False
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def validate(self) -> None:
+        """
+        Raises an error with respect to state.
+
+        Raises:
+            SecurityError
+        """
+        raise NotImplementedError()
+
+    async def verify(self) -> None:
+        self.verified = True
+        self.date_updated = _now()
+        session_cache.discard_bearer(self)
+
+    async def json(self) -> dict:
+        """
+        A JSON serializable dict to be used in a HTTP request or response. Account passwords and TOTP secrets are
+        excluded.
+
+        Returns:
+           data (json)
+        """
+        return {
+            key: value.isoformat() if isinstance(value, datetime.datetime) else _dump_value(value)
+            for key, value in vars(self).items()
+            if key not in self.json_exclude
+        }
+
+
+class Account(BaseModel):
+    """
+    Contains all identifiable user information.
+
+    Attributes:
+        username (str): Public identifier.
+        email (str): Private identifier and can be used for verification.
+        phone (str): Mobile phone number with country code included and can be used for verification. Can be null or empty.
+        password (str): Password of account for protection. Must be hashed via Argon.
+        disabled (bool): Renders the account unusable but available.
+        verified (bool): Renders the account unusable until verified via two-step verification or other method.
+        totp_secret (str): Base32 secret enrolled for TOTP two-step verification, None if not enrolled.
+        roles (list[Role]): Roles associated with this account.
+    """
+
+    json_exclude = ("password", "totp_secret")
+
+    username: str = None
+    email: str = None
+    phone: str = None
+    password: str = None
+    disabled: bool = False
+    verified: bool = False
+    totp_secret: str = None
+
+    def __init__(self, **kwargs):
+        self.roles = []
+        super().__init__(**kwargs)
+
+    def validate(self) -> None:
+        """
+        Raises an error with respect to account state.
+
+        Raises:
+            DeletedError
+            UnverifiedError
+            DisabledError
+        """
+        if self.deleted:
+            raise DeletedError("Account has been deleted.")
+        elif not self.verified:
+            raise UnverifiedError()
+        elif self.disabled:
+            raise DisabledError()
+
+    async def set_totp_secret(self, secret: str = None) -> None:
+        """
+        Enrolls the account in TOTP two-step verification.
+
+        Args:
+            secret (str): Base32 secret of the account, unenrolls the account if None.
+        """
+        self.totp_secret = secret
+        self.date_updated = _now()
+        session_cache.discard_bearer(self)
+
+    @staticmethod
+    async def lookup(email: str = None, username: str = None, phone: str = None, id: str = None):
+        """
+        Retrieve an account by primary identifier
+
+        Args (one of):
+            email (str): Email associated to account being retrieved.
+            username (str): Username associated to account being retrieved.
+            phone (str): Phone associated to account being retrieved.
+            id (str): Id associated to account being retrieved.
+
+        Returns:
+            account
+
+        Raises:
+            NotFoundError
+        """
+        if email:
+            account = store.account_indexes["email"].get(email)
+        elif username:
+            account = store.account_indexes["username"].get(username)
+        elif phone:
+            account = store.account_indexes["phone"].get(phone)
+        elif id:
+            account = store.accounts.get(str(id))
+        else:
+            raise NotFoundError("Lookup requested by no identifier provided")
+        if not account or account.deleted:
+            raise NotFoundError("Account with this identifier does not exist.")
+        return account
+
+    @staticmethod
+    async def new(email: str = None, username: str = None,
+                  password: str = None, phone: str = None,
+                  verified: bool = False, disabled: bool = False,
+                  roles: list = []
+                 ):
+        """
+        Abstracted method for the defined ORM to create a new Account entry.
+
+        Args:
+            email (str): Email address for new account. MUST BE UNIQUE
+            username (str): Username for new account (optional). If provided, MUST BE UNIQUE
+            password (str): Password for new account (should already be hashed)
+            phone (str): Phone number for new account
+            verified (bool): Verification status
+            disabled (bool): Disabled status
+            roles (list): Roles (list of names of valid Role)
+
+        Returns:
+            Account (object)
+
+        Raises:
+            AccountError
+        """
+        if not email or not re.search(r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$", email) or len(email) > 255:
+            raise AccountError(f"Value '{email}' is not a valid email.", 400)
+        if username and not re.search(r"^[A-Za-z0-9 @_-]{3,32}$", username):
+            raise AccountError(f"Value '{username}' is not a valid username.", 400)
+        if phone:
+            try:
+                if not phonenumbers.is_possible_number(phonenumbers.parse(phone, "US")):  # Default to US
+                    raise ValueError()
+            except Exception:
+                raise AccountError(f"Value '{phone}' is not a valid phone number.", 400)
+        account = Account(
+            id=str(uuid.uuid4()),
+            email=email,
+            username=username,
+            password=password,
+            phone=phone,
+            verified=verified,
+            disabled=disabled,
+            roles=list(roles),
+        )
+        store.add_account(account)
+        logger.debug(f"Successfully Created a New Memory User: {account.id}")
+        return account
+
+    @staticmethod
+    async def get_revoked():
+        """
+        Retrieves accounts that can no longer authenticate.
+
+        Returns:
+            account_ids (list)
+        """
+        return [
+            account.id for account in store.accounts.values()
+            if account.deleted or account.disabled or not account.verified
+        ]
+
+    async def get_roles(self, id = None):
+        """
+        Returns a list of roles for provided account
+
+        Args:
+            id (str): Account ID to return roles for
+
+        Returns:
+            roles (list)
+
+        Raises:
+            NotFoundError
+        """
+        account = self if self.pk else store.accounts.get(str(id))
+        if not account or account.deleted:
+            raise NotFoundError("Lookup returned no matching user")
+        return list(account.roles)
+
+    async def add_role(self, id = None, role = None):
+        """
+        Add a role to an existing Account
+
+        Args:
+            id (str): ID of account to add a role to, or the account itself. Optional if not used as account property
+            role (str): Role to add
+
+        Returns:
+            Account
+
+        Raises:
+            NotFoundError
+        """
+        if isinstance(id, Account):
+            account = id
+        else:
+            account = store.accounts.get(str(id)) if id else self
+        if not account or not account.pk:
+            raise NotFoundError("Lookup requested by no identifier provided")
+        if role not in account.roles:
+            account.roles.append(role)
+        account.date_updated = _now()
+        role_cache.bump(str(account.id))
+        return account
+
+
+class Session(BaseModel):
+    """
+    Used for client identification and verification. Base session model that all session models derive from.
+
+    Attributes:
+        expiration_date (datetime): Date and time the session expires and can no longer be used.
+        active (bool): Determines if the session can be used.
+        ip (str): IP address of client creating session.
+        bearer (Account): Account associated with this session.
+        ctx (SimpleNamespace): Store whatever additional information you need about the session. Fields stored will be encoded.
+        purge_field (str): Date after which the session can no longer be used, and may be purged.
+    """
+
+    session_type = None
+    purge_field = "expiration_date"
+
+    expiration_date: datetime.datetime = None
+    active: bool = True
+    ip: str = None
+    bearer: Account = None
+
+    def __init__(self, **kwargs):
+        self.ctx = SimpleNamespace()
+        super().__init__(**kwargs)
+        self.expiration_date = _aware(self.expiration_date)
+
+    @classmethod
+    async def _create(cls, **kwargs):
+        session = cls(id=str(uuid.uuid4()), **kwargs)
+        store.add_session(session)
+        return session
+
+    @classmethod
+    async def new(cls, request: Request, account: Account, **kwargs):
+        """
+        Creates session with pre-set values.
+
+        Args:
+            request (Request): Sanic request parameter.
+            account (Account): Account being associated to the session.
+            **kwargs (dict[str, Any]): Extra arguments applied during session creation.
+
+        Returns:
+            session
+        """
+        raise NotImplementedError()
+
+    def validate(self) -> None:
+        """
+        Raises an error with respect to session state.
+
+        Raises:
+            DeletedError
+            ExpiredError
+            DeactivatedError
+        """
+        if self.deleted:
+            raise DeletedError("Session has been deleted.")
+        elif self.expiration_date and _now() >= self.expiration_date:
+            raise ExpiredError()
+        elif not self.active:
+            raise DeactivatedError()
+
+    @classmethod
+    async def lookup(cls, id: str = None, roles: bool = False):
+        """
+        Looks up a session and its bearer based upon its ID.
+
+        Args:
+            id (string): Session Identifier
+            roles (bool): Unused, roles are always available on the bearer.
+
+        Returns:
+            session, session bearer
+
+        Raises:
+            NotFoundError
+        """
+        session = store.sessions.get(cls.session_type, {}).get(str(id))
+        if not session or session.deleted:
+            raise NotFoundError("Session could not be found.")
+        return session, session.bearer
+
+    @classmethod
+    async def get_revoked(cls, since: datetime.datetime = None):
+        """
+        Retrieves deactivated or deleted sessions that have not yet expired.
+
+        Args:
+            since (datetime): Only retrieve sessions revoked after this time, all revoked sessions if None.
+
+        Returns:
+            revoked_sessions (list of id, expiration_date)
+        """
+        now = _now()
+        since = _aware(since)
+        return [
+            (session.id, session.expiration_date)
+            for session in store.revoked_sessions.get(cls.session_type, {}).values()
+            if (not session.expiration_date or session.expiration_date > now)
+            and (not since or session.date_updated >= since)
+        ]
+
+    @classmethod
+    async def purge(cls, before: datetime.datetime, limit: int) -> int:
+        """
+        Deletes a batch of sessions that can no longer be used since before a date, see `purge_field`.
+
+        Args:
+            before (datetime): Sessions that could no longer be used since before this date are deleted.
+            limit (int): Maximum amount of sessions deleted.
+
+        Returns:
+            purged
+        """
+        before = _aware(before).timestamp()
+        purge_heap = store.purge_heaps.get(cls.session_type, [])
+        sessions = store.sessions.get(cls.session_type, {})
+        purged = 0
+        while purge_heap and purge_heap[0][0] < before and purged < limit:
+            _, session_id = heapq.heappop(purge_heap)
+            session = sessions.get(session_id)
+            if session:
+                store.remove_session(session)
+                session_cache.discard(session)
+                purged += 1
+        return purged
+
+    @classmethod
+    async def deactivate(cls, session):
+        """
+        Sets a session as deactivated/deleted session
+
+        Args:
+            session: Session being deactivated.
+
+        Returns:
+            session
+        """
+        session.active = False
+        session.date_updated = _now()
+        store.revoked_sessions.setdefault(session.session_type, {})[session.id] = session
+        session_cache.discard(session)
+        return session
+
+
+class VerificationSession(Session):
+    """
+    Used for a client verification method that requires some form of code, challenge, or key.
+
+    Attributes:
+        attempts (int): The amount of incorrect times a user entered a code not equal to this verification sessions code.
+        code (str): Used as a secret key that would be sent via email, text, etc to complete the verification challenge.
+    """
+
+    attempts: int = 0
+    code: str = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if not self.code:
+            self.code = get_code()
+
+    @classmethod
+    async def new(cls, request: Request, account: Account, **kwargs):
+        raise NotImplementedError
+
+    async def check_code(self, request: Request, code: str) -> None:
+        """
+        Checks if code passed is equivalent to the session code.
+
+        Attempts are counted and the session deactivated without awaiting in between, so concurrent attempts can't
+        exceed the maximum amount of attempts or use the session twice. Once maxed out, the session code is no longer
+        accepted.
+
+        Args:
+            code (str): Code being cross-checked with session code.
+            request (Request): Sanic request parameter.
+
+        Raises:
+            ChallengeError
+            DeactivatedError
+            MaxedOutChallengeError
+        """
+        session_cache.discard(self)
+        if self.attempts < security_config.SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS:
+            if self.code != code:
+                self.attempts += 1
+                raise ChallengeError("The value provided does not match.")
+            elif self.active:
+                await self.deactivate(self)
+                return
+            raise DeactivatedError("Session has already been used.")
+        logger.warning(
+            f"Client ({self.bearer.email if self.bearer else None}/{get_ip(request)}) has maxed out on session challenge attempts"
+        )
+        raise MaxedOutChallengeError()
+
+
+class TwoStepSession(VerificationSession):
+    """
+    Validates a client using a code sent via email or text.
+    """
+
+    session_type = "twos"
+
+    @classmethod
+    async def new(cls, request: Request, account: Account, **kwargs):
+        return await cls._create(
+            **kwargs,
+            ip=get_ip(request),
+            bearer=account,
+            expiration_date=get_expiration_date(
+                security_config.SANIC_SECURITY_TWO_STEP_SESSION_EXPIRATION
+            ),
+        )
+
+
+class CaptchaSession(VerificationSession):
+    """
+    Validates a client with a captcha challenge.
+    """
+
+    session_type = "capt"
+
+    @classmethod
+    async def new(cls, request: Request, **kwargs):
+        return await cls._create(
+            **kwargs,
+            ip=get_ip(request),
+            expiration_date=get_expiration_date(
+                security_config.SANIC_SECURITY_CAPTCHA_SESSION_EXPIRATION
+            ),
+        )
+
+
+class AuthenticationSession(Session):
+    """
+    Used to authenticate and identify a client.
+
+    Attributes:
+        refresh_expiration_date (datetime): Date and time the session can no longer be refreshed.
+        family (str): Identifier of the session first created on login, shared by every session refreshed from it.
+    """
+
+    session_type = "auth"
+    purge_field = "refresh_expiration_date"
+
+    refresh_expiration_date: datetime.datetime = None
+    family: str = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.refresh_expiration_date = _aware(self.refresh_expiration_date)
+
+    @classmethod
+    async def new(cls, request: Request, account: Account, **kwargs):
+        return await cls._create(
+            **kwargs,
+            bearer=account,
+            ip=get_ip(request),
+            expiration_date=get_expiration_date(
+                security_config.SANIC_SECURITY_AUTHENTICATION_SESSION_EXPIRATION
+            ),
+            refresh_expiration_date=get_expiration_date(
+                security_config.SANIC_SECURITY_AUTHENTICATION_SESSION_EXPIRATION * 2
+            ),
+        )
+
+    @classmethod
+    async def deactivate_family(cls, family: str):
+        """
+        Deactivates every active session refreshed from the same session.
+
+        Args:
+            family (str): Identifier of the session first created on login.
+
+        Returns:
+            deactivated_sessions (list of id, expiration_date)
+        """
+        sessions = store.sessions.get(cls.session_type, {})
+        deactivated_sessions = []
+        for session_id in list(store.families.get(family, ())):
+            session = sessions.get(session_id)
+            if session and session.active:
+                await cls.deactivate(session)
+                deactivated_sessions.append((session.id, session.expiration_date))
+        return deactivated_sessions
+
+
+class Role(BaseModel):
+    """
+    Assigned to an account to authorize an action.
+
+    Attributes:
+        name (str): Name of the role.
+        description (str): Description of the role.
+        permissions (str): Permissions of the role. Must be separated via comma and in
+                           wildcard format (printer:query, printer:query,delete).
+    """
+
+    name: str = None
+    description: str = None
+    permissions: str = None
+
+    def validate(self) -> None:
+        raise NotImplementedError()
+
+    async def save(self) -> None:
+        """
+        Applies changes made to the role, such as its permissions.
+        """
+        self.date_updated = _now()
+        role_cache.bump()
+
+    @staticmethod
+    async def lookup(name: str):
+        """
+        Retrieve a role by its name.
+
+        Args:
+            name (str): Role name being retrieved.
+
+        Returns:
+            role
+
+        Raises:
+            NotFoundError
+        """
+        role = store.roles_by_name.get(name)
+        if not role:
+            raise NotFoundError("Role with this name does not exist.")
+        return role
+
+    @staticmethod
+    async def new(**kwargs):
+        role = Role(id=str(uuid.uuid4()), **kwargs)
+        store.add_role(role)
+        return role
+
+
+_session_models = {
+    session_model.session_type: session_model
+    for session_model in (TwoStepSession, CaptchaSession, AuthenticationSession)
+}
@@ -0,0 +1,738 @@
+import asyncio
+import datetime
+import time
+import uuid
+from json import dumps as json_dumps, loads as json_loads
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+from sanic import Sanic
+from sanic.log import logger
+from sanic.request import Request
+
+from sanic_security.cache import session_cache
+from sanic_security.configuration import config as security_config
+from sanic_security.exceptions import *
+from sanic_security.orm.backend import lookup_many
+from sanic_security.utils import get_ip, get_code, get_expiration_date
+
+"""
+An effective, simple, and async security library for the Sanic framework.
+Copyright (C) 2020-present Aidan Stewart
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+class RedisError(Exception):
+    """
+    Raised when Redis replies with an error.
+    """
+
+
+class RedisConnection:
+    """
+    Connection speaking the Redis serialization protocol (RESP), replies are decoded as UTF-8.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @staticmethod
+    def encode(command) -> bytes:
+        encoded = [b"*%d\r\n" % len(command)]
+        for argument in command:
+            argument = argument if isinstance(argument, bytes) else str(argument).encode()
+            encoded.append(b"$%d\r\n%b\r\n" % (len(argument), argument))
+        return b"".join(encoded)
+
+    async def read(self):
+        line = await self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Redis connection closed.")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        elif prefix == b"-":
+            return RedisError(payload.decode())
+        elif prefix == b":":
+            return int(payload)
+        elif prefix == b"$":
+            length = int(payload)
+            return None if length < 0 else (await self.reader.readexactly(length + 2))[:-2].decode()
+        elif prefix == b"*":
+            length = int(payload)
+            return None if length < 0 else [await self.read() for _ in range(length)]
+        raise RedisError(f"Unexpected reply {line!r}.")
+
+    async def execute(self, *commands) -> list:
+        """
+        Sends commands at once and reads their replies, errors are returned rather than raised so every reply is read.
+
+        Args:
+            *commands (tuple): Commands with their arguments.
+
+        Returns:
+            replies
+        """
+        self.writer.write(b"".join(self.encode(command) for command in commands))
+        await self.writer.drain()
+        return [await self.read() for _ in commands]
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class RedisClient:
+    """
+    Minimal Redis client with a bounded pool of connections, opened when first needed.
+
+    Attributes:
+        url (str): Redis URL (redis://[[username]:password@]host[:port][/database]).
+        pool_size (int): Maximum amount of open connections.
+    """
+
+    def __init__(self, url: str, pool_size: int = 10):
+        self.url = url
+        self.pool_size = pool_size
+        self._connections = []
+        self._semaphore = asyncio.Semaphore(pool_size)
+
+    async def _connect(self) -> RedisConnection:
+        url = urlparse(self.url)
+        connection = RedisConnection(*await asyncio.open_connection(url.hostname or "127.0.0.1", url.port or 6379))
+        setup = []
+        if url.password:
+            setup.append(("AUTH", url.username, url.password) if url.username else ("AUTH", url.password))
+        if url.path.strip("/"):
+            setup.append(("SELECT", url.path.strip("/")))
+        for reply in await connection.execute(*setup) if setup else []:
+            if isinstance(reply, RedisError):
+                connection.close()
+                raise reply
+        return connection
+
+    async def pipeline(self, *commands) -> list:
+        """
+        Executes commands in a single round trip on one connection.
+
+        Args:
+            *commands (tuple): Commands with their arguments.
+
+        Returns:
+            replies
+
+        Raises:
+            RedisError
+        """
+        async with self._semaphore:
+            connection = self._connections.pop() if self._connections else await self._connect()
+            try:
+                replies = await connection.execute(*commands)
+            except BaseException:
+                connection.close()
+                raise
+            self._connections.append(connection)
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    async def execute(self, *command):
+        return (await self.pipeline(command))[0]
+
+    async def close(self) -> None:
+        for connection in self._connections:
+            connection.close()
+        self._connections.clear()
+
+
+class FakeRedis:
+    """
+    In-process stand-in for a Redis server, implementing the commands used by the Redis session store, for tests and
+    local development. Like Redis, keys expire when accessed after their expiration.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expirations = {}
+
+    def _get(self, key: str, default_factory=None):
+        expires_at = self._expirations.get(key)
+        if expires_at is not None and expires_at <= time.time() * 1000:
+            self._data.pop(key, None)
+            del self._expirations[key]
+        if key not in self._data and default_factory:
+            self._data[key] = default_factory()
+        return self._data.get(key)
+
+    def _command_ping(self):
+        return "PONG"
+
+    def _command_select(self, database):
+        return "OK"
+
+    def _command_del(self, *keys):
+        deleted = 0
+        for key in keys:
+            deleted += self._get(key) is not None
+            self._data.pop(key, None)
+            self._expirations.pop(key, None)
+        return deleted
+
+    def _command_exists(self, *keys):
+        return sum(self._get(key) is not None for key in keys)
+
+    def _command_pexpireat(self, key, timestamp):
+        if self._get(key) is None:
+            return 0
+        self._expirations[key] = int(timestamp)
+        return 1
+
+    def _command_hset(self, key, *fields):
+        stored_fields = self._get(key, dict)
+        added = sum(field not in stored_fields for field in fields[::2])
+        stored_fields.update(zip(fields[::2], fields[1::2]))
+        return added
+
+    def _command_hget(self, key, field):
+        return (self._get(key) or {}).get(field)
+
+    def _command_hgetall(self, key):
+        return [item for pair in (self._get(key) or {}).items() for item in pair]
+
+    def _command_hincrby(self, key, field, increment):
+        stored_fields = self._get(key, dict)
+        stored_fields[field] = str(int(stored_fields.get(field, 0)) + int(increment))
+        return int(stored_fields[field])
+
+    def _command_sadd(self, key, *members):
+        stored_members = self._get(key, set)
+        added = sum(member not in stored_members for member in members)
+        stored_members.update(members)
+        return added
+
+    def _command_smembers(self, key):
+        return list(self._get(key) or ())
+
+    def _command_zadd(self, key, *scored_members):
+        sorted_set = self._get(key, dict)
+        added = sum(member not in sorted_set for member in scored_members[1::2])
+        sorted_set.update((member, float(score)) for score, member in zip(scored_members[::2], scored_members[1::2]))
+        return added
+
+    def _command_zrem(self, key, *members):
+        sorted_set = self._get(key) or {}
+        return sum(sorted_set.pop(member, None) is not None for member in members)
+
+    def _command_zrangebyscore(self, key, minimum, maximum, *options):
+        def in_range(score, bound, lower):
+            exclusive = bound.startswith("(")
+            bound = float(bound.lstrip("("))
+            if lower:
+                return score > bound if exclusive else score >= bound
+            return score < bound if exclusive else score <= bound
+
+        members = [
+            member for member, score in sorted((self._get(key) or {}).items(), key=lambda item: (item[1], item[0]))
+            if in_range(score, minimum, True) and in_range(score, maximum, False)
+        ]
+        if options and options[0].upper() == "LIMIT":
+            offset, count = int(options[1]), int(options[2])
+            members = members[offset:offset + count if count >= 0 else None]
+        return members
+
+    async def pipeline(self, *commands) -> list:
+        replies = []
+        for name, *arguments in commands:
+            handler = getattr(self, f"_command_{name.lower()}", None)
+            if not handler:
+                raise RedisError(f"ERR unknown command '{name}'")
+            replies.append(handler(*(str(argument) for argument in arguments)))
+        return replies
+
+    async def execute(self, *command):
+        return (await self.pipeline(command))[0]
+
+    async def close(self) -> None:
+        pass
+
+
+client = None
+
+
+def connect(url: str, pool_size: int = 10):
+    """
+    Creates the client used by the Redis session store.
+
+    Args:
+        url (str): Redis URL, or fake:// for an in-process `FakeRedis`.
+        pool_size (int): Maximum amount of open connections.
+
+    Returns:
+        client
+    """
+    global client
+    client = FakeRedis() if url.startswith("fake://") else RedisClient(url, pool_size)
+    return client
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _aware(date: datetime.datetime):
+    return date.replace(tzinfo=datetime.timezone.utc) if date and not date.tzinfo else date
+
+
+def _key(*parts) -> str:
+    return security_config.SANIC_SECURITY_REDIS_PREFIX + ":".join(str(part) for part in parts)
+
+
+class Session:
+    """
+    Used for client identification and verification, stored as a Redis hash expiring natively once it can no longer be
+    used and the purge retention has passed. Bearers are looked up with the account model of the primary ORM.
+
+    Attributes:
+        id (str): Primary key of session.
+        date_created (datetime): Time this session was created.
+        date_updated (datetime): Time this session was updated.
+        deleted (bool): Always False, sessions are deleted rather than marked deleted.
+        expiration_date (datetime): Date and time the session expires and can no longer be used.
+        active (bool): Determines if the session can be used.
+        ip (str): IP address of client creating session.
+        bearer (Account): Account associated with this session.
+        ctx (SimpleNamespace): Store whatever additional information you need about the session. Fields stored will be encoded.
+        purge_field (str): Date after which the session can no longer be used, and may be purged.
+    """
+
+    session_type = None
+    purge_field = "expiration_date"
+    date_fields = ("date_created", "date_updated", "expiration_date")
+    int_fields = ()
+
+    expiration_date: datetime.datetime = None
+    active: bool = True
+    deleted: bool = False
+    ip: str = None
+    bearer = None
+
+    def __init__(self, **kwargs):
+        self.id = self.pk = kwargs.pop("id", None)
+        self.date_created = self.date_updated = _now()
+        self.ctx = SimpleNamespace()
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        for field in self.date_fields:
+            setattr(self, field, _aware(getattr(self, field)))
+
+    def _dump(self) -> list:
+        fields = {
+            "id": self.id,
+            "active": int(self.active),
+            "ip": self.ip,
+            "bearer": self.bearer.id if self.bearer else None,
+            "ctx": json_dumps(vars(self.ctx)),
+        }
+        fields.update((field, getattr(self, field).timestamp()) for field in self.date_fields if getattr(self, field))
+        fields.update((field, getattr(self, field)) for field in self.int_fields)
+        return [item for pair in fields.items() if pair[1] is not None for item in pair]
+
+    @classmethod
+    def _load(cls, reply: list):
+        fields = dict(zip(reply[::2], reply[1::2]))
+        for field in cls.date_fields:
+            fields[field] = (
+                datetime.datetime.fromtimestamp(float(fields[field]), datetime.timezone.utc)
+                if fields.get(field)
+                else None
+            )
+        for field in cls.int_fields:
+            fields[field] = int(fields.get(field, 0))
+        fields["active"] = int(fields.get("active", 0)) > 0
+        fields["ctx"] = SimpleNamespace(**json_loads(fields.get("ctx", "{}")))
+        return cls(**fields)
+
+    def _expire_commands(self, key: str) -> list:
+        purge_date = getattr(self, self.purge_field)
+        if not purge_date:
+            return []
+        expires_at = purge_date.timestamp() + security_config.SANIC_SECURITY_SESSION_PURGE_RETENTION
+        return [("PEXPIREAT", key, int(expires_at * 1000))]
+
+    @classmethod
+    async def _create(cls, **kwargs):
+        session = cls(id=str(uuid.uuid4()), **kwargs)
+        key = _key(cls.session_type, session.id)
+        commands = [("HSET", key, *session._dump()), *session._expire_commands(key)]
+        if getattr(session, session.purge_field):
+            commands.append(
+                ("ZADD", _key(cls.session_type, "purge"), getattr(session, session.purge_field).timestamp(), session.id)
+            )
+        if getattr(session, "family", None):
+            family_key = _key(cls.session_type, "family", session.family)
+            commands.extend([("SADD", family_key, session.id), *session._expire_commands(family_key)])
+        await client.pipeline(*commands)
+        return session
+
+    @classmethod
+    async def new(cls, request: Request, account, **kwargs):
+        """
+        Creates session with pre-set values.
+
+        Args:
+            request (Request): Sanic request parameter.
+            account (Account): Account being associated to the session.
+            **kwargs (dict[str, Any]): Extra arguments applied during session creation.
+
+        Returns:
+            session
+        """
+        raise NotImplementedError()
+
+    def validate(self) -> None:
+        """
+        Raises an error with respect to session state.
+
+        Raises:
+            DeletedError
+            ExpiredError
+            DeactivatedError
+        """
+        if self.deleted:
+            raise DeletedError("Session has been deleted.")
+        elif self.expiration_date and _now() >= self.expiration_date:
+            raise ExpiredError()
+        elif not self.active:
+            raise DeactivatedError()
+
+    async def json(self) -> dict:
+        """
+        A JSON serializable dict to be used in a HTTP request or response.
+
+        Returns:
+           data (json)
+        """
+        return {
+            key: value.isoformat() if isinstance(value, datetime.datetime) else value
+            for key, value in {
+                **vars(self),
+                "bearer": self.bearer.id if self.bearer else None,
+                "ctx": vars(self.ctx),
+            }.items()
+            if key not in ("pk", "loaded_bearer")
+        }
+
+    @classmethod
+    async def lookup(cls, id: str = None, roles: bool = False):
+        """
+        Looks up a session and its bearer based upon its ID.
+
+        Args:
+            id (string): Session Identifier
+            roles (bool): Unused, roles are retrieved by the primary ORM.
+
+        Returns:
+            session, session bearer
+
+        Raises:
+            NotFoundError
+        """
+        reply = await client.execute("HGETALL", _key(cls.session_type, id))
+        if not reply:
+            raise NotFoundError("Session could not be found.")
+        session = cls._load(reply)
+        bearer_id = dict(zip(reply[::2], reply[1::2])).get("bearer")
+        if bearer_id:
+            session.bearer = await Sanic.get_app().ctx.extensions["security"].account.lookup(id=bearer_id)
+        return session, session.bearer
+
+    @classmethod
+    async def lookup_many(cls, ids: list) -> list:
+        """
+        Looks up sessions by id in a single round trip, and their bearers in a batch with the primary ORM.
+        Identifiers not found are skipped.
+
+        Args:
+            ids (list): Session identifiers.
+
+        Returns:
+            sessions and their bearers (list of session, bearer)
+        """
+        replies = await client.pipeline(*(("HGETALL", _key(cls.session_type, id)) for id in ids)) if ids else []
+        replies = [reply for reply in replies if reply]
+        bearer_ids = {dict(zip(reply[::2], reply[1::2])).get("bearer") for reply in replies} - {None}
+        bearers = {
+            str(bearer.id): bearer
+            for bearer in await lookup_many(Sanic.get_app().ctx.extensions["security"].account, list(bearer_ids))
+        } if bearer_ids else {}
+        sessions = []
+        for reply in replies:
+            session = cls._load(reply)
+            session.bearer = bearers.get(dict(zip(reply[::2], reply[1::2])).get("bearer"))
+            sessions.append((session, session.bearer))
+        return sessions
+
+    @classmethod
+    async def get_revoked(cls, since: datetime.datetime = None):
+        """
+        Retrieves deactivated sessions that have not yet expired.
+
+        Args:
+            since (datetime): Only retrieve sessions revoked after this time, all revoked sessions if None.
+
+        Returns:
+            revoked_sessions (list of id, expiration_date)
+        """
+        session_ids = await client.execute(
+            "ZRANGEBYSCORE", _key(cls.session_type, "revoked"), _aware(since).timestamp() if since else "-inf", "+inf"
+        )
+        if not session_ids:
+            return []
+        expiration_dates = await client.pipeline(
+            *(("HGET", _key(cls.session_type, session_id), "expiration_date") for session_id in session_ids)
+        )
+        now = _now().timestamp()
+        return [
+            (session_id, datetime.datetime.fromtimestamp(float(expiration_date), datetime.timezone.utc))
+            for session_id, expiration_date in zip(session_ids, expiration_dates)
+            if expiration_date and float(expiration_date) > now
+        ]
+
+    @classmethod
+    async def purge(cls, before: datetime.datetime, limit: int) -> int:
+        """
+        Deletes a batch of sessions that can no longer be used since before a date, see `purge_field`. Sessions also
+        expire natively after the purge retention, so purging only trims the store's indexes unless the retention
+        changed.
+
+        Args:
+            before (datetime): Sessions that could no longer be used since before this date are deleted.
+            limit (int): Maximum amount of sessions deleted.
+
+        Returns:
+            purged
+        """
+        purge_key = _key(cls.session_type, "purge")
+        session_ids = await client.execute(
+            "ZRANGEBYSCORE", purge_key, "-inf", f"({_aware(before).timestamp()}", "LIMIT", 0, limit
+        )
+        if session_ids:
+            await client.pipeline(
+                ("DEL", *(_key(cls.session_type, session_id) for session_id in session_ids)),
+                ("ZREM", purge_key, *session_ids),
+                ("ZREM", _key(cls.session_type, "revoked"), *session_ids),
+            )
+            for session_id in session_ids:
+                session_cache.pop(session_cache.key(cls, session_id))
+        return len(session_ids)
+
+    @classmethod
+    async def deactivate_many(cls, sessions: list) -> list:
+        """
+        Deactivates several sessions in a single round trip.
+
+        Args:
+            sessions (list): Sessions being deactivated.
+
+        Returns:
+            sessions
+        """
+        date_updated = _now()
+        commands = []
+        for session in sessions:
+            session.active = False
+            session.date_updated = date_updated
+            key = _key(session.session_type, session.id)
+            commands.extend([
+                ("HSET", key, "active", 0, "date_updated", date_updated.timestamp()),
+                *session._expire_commands(key),
+                ("ZADD", _key(session.session_type, "revoked"), date_updated.timestamp(), session.id),
+            ])
+        if commands:
+            await client.pipeline(*commands)
+        for session in sessions:
+            session_cache.discard(session)
+        return sessions
+
+    @classmethod
+    async def deactivate(cls, session):
+        """
+        Sets a session as deactivated/deleted session
+
+        Args:
+            session: Session being deactivated.
+
+        Returns:
+            session
+        """
+        return (await cls.deactivate_many([session]))[0]
+
+
+class VerificationSession(Session):
+    """
+    Used for a client verification method that requires some form of code, challenge, or key.
+
+    Attributes:
+        attempts (int): The amount of incorrect times a user entered a code not equal to this verification sessions code.
+        code (str): Used as a secret key that would be sent via email, text, etc to complete the verification challenge.
+    """
+
+    int_fields = ("attempts",)
+
+    attempts: int = 0
+    code: str = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if not self.code:
+            self.code = get_code()
+
+    def _dump(self) -> list:
+        return super()._dump() + ["code", self.code]
+
+    @classmethod
+    async def new(cls, request: Request, account, **kwargs):
+        raise NotImplementedError
+
+    async def check_code(self, request: Request, code: str) -> None:
+        """
+        Checks if code passed is equivalent to the session code.
+
+        Attempts are counted and the session deactivated with atomic increments, so concurrent attempts can't exceed
+        the maximum amount of attempts or use the session twice. Once maxed out, the session code is no longer accepted.
+
+        Args:
+            code (str): Code being cross-checked with session code.
+            request (Request): Sanic request parameter.
+
+        Raises:
+            ChallengeError
+            DeactivatedError
+            MaxedOutChallengeError
+        """
+        session_cache.discard(self)
+        key = _key(self.session_type, self.id)
+        if self.code != code:
+            attempts, *_ = await client.pipeline(("HINCRBY", key, "attempts", 1), *self._expire_commands(key))
+            if attempts <= security_config.SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS:
+                raise ChallengeError("The value provided does not match.")
+        elif int(await client.execute("HGET", key, "attempts") or 0) < security_config.SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS:
+            self.date_updated = _now()
+            active, *_ = await client.pipeline(
+                ("HINCRBY", key, "active", -1),
+                ("HSET", key, "date_updated", self.date_updated.timestamp()),
+                *self._expire_commands(key),
+                ("ZADD", _key(self.session_type, "revoked"), self.date_updated.timestamp(), self.id),
+            )
+            self.active = False
+            if active == 0:
+                return
+            raise DeactivatedError("Session has already been used.")
+        logger.warning(
+            f"Client ({self.bearer.email if self.bearer else None}/{get_ip(request)}) has maxed out on session challenge attempts"
+        )
+        raise MaxedOutChallengeError()
+
+
+class TwoStepSession(VerificationSession):
+    """
+    Validates a client using a code sent via email or text.
+    """
+
+    session_type = "twos"
+
+    @classmethod
+    async def new(cls, request: Request, account, **kwargs):
+        return await cls._create(
+            **kwargs,
+            ip=get_ip(request),
+            bearer=account,
+            expiration_date=get_expiration_date(
+                security_config.SANIC_SECURITY_TWO_STEP_SESSION_EXPIRATION
+            ),
+        )
+
+
+class CaptchaSession(VerificationSession):
+    """
+    Validates a client with a captcha challenge.
+    """
+
+    session_type = "capt"
+
+    @classmethod
+    async def new(cls, request: Request, **kwargs):
+        return await cls._create(
+            **kwargs,
+            ip=get_ip(request),
+            expiration_date=get_expiration_date(
+                security_config.SANIC_SECURITY_CAPTCHA_SESSION_EXPIRATION
+            ),
+        )
+
+
+class AuthenticationSession(Session):
+    """
+    Used to authenticate and identify a client.
+
+    Attributes:
+        refresh_expiration_date (datetime): Date and time the session can no longer be refreshed.
+        family (str): Identifier of the session first created on login, shared by every session refreshed from it.
+    """
+
+    session_type = "auth"
+    purge_field = "refresh_expiration_date"
+    date_fields = Session.date_fields + ("refresh_expiration_date",)
+
+    refresh_expiration_date: datetime.datetime = None
+    family: str = None
+
+    def _dump(self) -> list:
+        return super()._dump() + (["family", self.family] if self.family else [])
+
+    @classmethod
+    async def new(cls, request: Request, account, **kwargs):
+        return await cls._create(
+            **kwargs,
+            bearer=account,
+            ip=get_ip(request),
+            expiration_date=get_expiration_date(
+                security_config.SANIC_SECURITY_AUTHENTICATION_SESSION_EXPIRATION
+            ),
+            refresh_expiration_date=get_expiration_date(
+                security_config.SANIC_SECURITY_AUTHENTICATION_SESSION_EXPIRATION * 2
+            ),
+        )
+
+    @classmethod
+    async def deactivate_family(cls, family: str):
+        """
+        Deactivates every active session refreshed from the same session.
+
+        Args:
+            family (str): Identifier of the session first created on login.
+
+        Returns:
+            deactivated_sessions (list of id, expiration_date)
+        """
+        session_ids = await client.execute("SMEMBERS", _key(cls.session_type, "family", family))
+        if not session_ids:
+            return []
+        replies = await client.pipeline(*(("HGETALL", _key(cls.session_type, session_id)) for session_id in session_ids))
+        sessions = [session for session in (cls._load(reply) for reply in replies if reply) if session.active]
+        await cls.deactivate_many(sessions)
+        return [(session.id, session.expiration_date) for session in sessions]
@@ -1,10 +1,12 @@
 import datetime
 from types import SimpleNamespace
+from typing import Optional
 
 from sanic.log import logger
 from sanic.request import Request
 from sanic.response import HTTPResponse
 from tortoise import fields, Model
+from tortoise.expressions import F, Q
 from tortoise.validators import RegexValidator, Validator
 from tortoise.exceptions import DoesNotExist, ValidationError
 from tortoise.contrib.pydantic import pydantic_model_creator
@@ -12,6 +14,7 @@ from tortoise.contrib.pydantic import pydantic_model_creator
 import re
 import phonenumbers
 
+from sanic_security.cache import role_cache, session_cache
 from sanic_security.configuration import config as security_config
 from sanic_security.exceptions import *
 from sanic_security.utils import get_ip, get_code, get_expiration_date
@@ -53,6 +56,34 @@ class PhoneNumberValidator(Validator):
             raise ValidationError(f"Value '{value}' is not a valid phone number")
 
 
+_pydantic_models = {}
+
+
+def get_pydantic_model(cls):
+    """
+    Retrieves the pydantic model used to serialize a model class, created once per class.
+
+    Args:
+        cls (Type[Model]): Model class being serialized.
+
+    Returns:
+        pydantic_model
+    """
+    pydantic_model = _pydantic_models.get(cls)
+    if not pydantic_model:
+        pydantic_model = _pydantic_models[cls] = pydantic_model_creator(cls)
+    return pydantic_model
+
+
+def prepare_serializers() -> None:
+    """
+    Creates the pydantic models of all Sanic Security models ahead of the first response. Requires Tortoise to be
+    initialized.
+    """
+    for cls in (Account, Role, TwoStepSession, CaptchaSession, AuthenticationSession):
+        get_pydantic_model(cls)
+
+
 class BaseModel(Model):
     """
     Base Sanic Security model that all other models derive from.
@@ -81,19 +112,18 @@ class BaseModel(Model):
     async def verify(self) -> None:
         self.verified = True
         await self.save(update_fields=["verified"])
+        session_cache.discard_bearer(self)
 
     async def json(data) -> dict:
         """
         A JSON serializable dict to be used in a HTTP request or response, catchall for all models.
 
-        Async for uniformity with uMongo ORM, as well as anything custom
-
-        TODO: Should probably be customized to remove sensitive data, like password
+        Async for uniformity with uMongo ORM, as well as anything custom. Account passwords are excluded.
 
         Returns:
            data (json)
         """
-        _data = await pydantic_model_creator(data.__class__).from_tortoise_orm(data)
+        _data = await get_pydantic_model(data.__class__).from_tortoise_orm(data)
         return _data.json()
 
     class Meta:
@@ -111,6 +141,7 @@ class Account(BaseModel):
         password (str): Password of account for protection. Must be hashed via Argon.
         disabled (bool): Renders the account unusable but available.
         verified (bool): Renders the account unusable until verified via two-step verification or other method.
+        totp_secret (str): Base32 secret enrolled for TOTP two-step verification, None if not enrolled.
         roles (ManyToManyRelation[Role]): Roles associated with this account.
     """
 
@@ -120,10 +151,14 @@ class Account(BaseModel):
     password: str = fields.CharField(max_length=255)
     disabled: bool = fields.BooleanField(default=False)
     verified: bool = fields.BooleanField(default=False)
+    totp_secret: Optional[str] = fields.CharField(max_length=64, null=True)
     roles: fields.ManyToManyRelation["Role"] = fields.ManyToManyField(
         "models.Role", through="account_role"
     )
 
+    class PydanticMeta:
+        exclude = ("password", "totp_secret")
+
     def validate(self) -> None:
         """
         Raises an error with respect to account state.
@@ -140,6 +175,17 @@ class Account(BaseModel):
         elif self.disabled:
             raise DisabledError()
 
+    async def set_totp_secret(self, secret: str = None) -> None:
+        """
+        Enrolls the account in TOTP two-step verification.
+
+        Args:
+            secret (str): Base32 secret of the account, unenrolls the account if None.
+        """
+        self.totp_secret = secret
+        await self.save(update_fields=["totp_secret"])
+        session_cache.discard_bearer(self)
+
     @staticmethod
     async def lookup(email: str = None, username: str = None, phone: str = None, id: str = None):
         """
@@ -232,6 +278,45 @@ class Account(BaseModel):
             logger.error(f'Generic Exception! {e}')
             raise AccountError(e.message)
 
+    @staticmethod
+    async def get_revoked():
+        """
+        Retrieves accounts that can no longer authenticate.
+
+        Returns:
+            account_ids (list)
+        """
+        return await Account.filter(
+            Q(deleted=True) | Q(disabled=True) | Q(verified=False)
+        ).values_list("id", flat=True)
+
+    @staticmethod
+    async def lookup_many(ids: list) -> list:
+        """
+        Retrieves accounts by id in a single query, identifiers not found are skipped.
+
+        Args:
+            ids (list): Identifiers of the accounts being retrieved.
+
+        Returns:
+            accounts
+        """
+        return await Account.filter(id__in=ids, deleted=False)
+
+    @staticmethod
+    async def get_roles_many(ids: list) -> dict:
+        """
+        Retrieves the roles of several accounts in two queries, accounts not found are skipped.
+
+        Args:
+            ids (list): Identifiers of the accounts.
+
+        Returns:
+            roles (dict of account id, roles)
+        """
+        accounts = await Account.filter(id__in=ids, deleted=False).prefetch_related("roles")
+        return {str(account.id): list(account.roles) for account in accounts}
+
     async def get_roles(self, id = None):
         """
         Returns a list of roles for provided account
@@ -282,6 +367,7 @@ class Account(BaseModel):
             raise NotFoundError("Lookup requested by no identifier provided")
 
         await account.roles.add(role)
+        role_cache.bump(str(account.id))
         return account
 
 
@@ -295,6 +381,7 @@ class Session(BaseModel):
         ip (str): IP address of client creating session.
         bearer (ForeignKeyRelation[Account]): Account associated with this session.
         ctx (SimpleNamespace): Store whatever additional information you need about the session. Fields stored will be encoded.
+        purge_field (str): Date after which the session can no longer be used, and may be purged.
     """
 
     expiration_date: datetime.datetime = fields.DatetimeField(null=True)
@@ -304,6 +391,7 @@ class Session(BaseModel):
         "models.Account", null=True
     )
     ctx = SimpleNamespace()
+    purge_field = "expiration_date"
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -343,12 +431,13 @@ class Session(BaseModel):
             raise DeactivatedError()
 
     @classmethod
-    async def lookup(cls, id: str = None):
+    async def lookup(cls, id: str = None, roles: bool = False):
         """
-        Looks up a session based upon its ID
+        Looks up a session and its bearer based upon its ID, in a single query joining the bearer.
 
         Args:
             id (string): Session Identifier
+            roles (bool): Also fetches the bearer's roles in one more query, for authorization.
         
         Returns:
             session, session bearer
@@ -356,9 +445,84 @@ class Session(BaseModel):
         Raises:
             NotFoundError
         """
-        _session = await cls.filter(id=id).prefetch_related("bearer").get()
+        _session = await cls.filter(id=id, deleted=False).select_related("bearer").first()
+        if not _session:
+            raise NotFoundError("Session could not be found.")
+        if roles and _session.bearer:
+            await _session.bearer.fetch_related("roles")
         return _session, _session.bearer
 
+    @classmethod
+    async def get_revoked(cls, since: datetime.datetime = None):
+        """
+        Retrieves deactivated or deleted sessions that have not yet expired.
+
+        Args:
+            since (datetime): Only retrieve sessions revoked after this time, all revoked sessions if None.
+
+        Returns:
+            revoked_sessions (list of id, expiration_date)
+        """
+        query = cls.filter(
+            Q(expiration_date__isnull=True) | Q(expiration_date__gt=datetime.datetime.now(datetime.timezone.utc)),
+            Q(active=False) | Q(deleted=True),
+        )
+        if since:
+            query = query.filter(date_updated__gte=since)
+        return await query.values_list("id", "expiration_date")
+
+    @classmethod
+    async def purge(cls, before: datetime.datetime, limit: int) -> int:
+        """
+        Deletes a batch of sessions that can no longer be used since before a date, see `purge_field`.
+
+        Args:
+            before (datetime): Sessions that could no longer be used since before this date are deleted.
+            limit (int): Maximum amount of sessions deleted.
+
+        Returns:
+            purged
+        """
+        session_ids = await cls.filter(**{f"{cls.purge_field}__lt": before}).limit(limit).values_list(
+            "id", flat=True
+        )
+        if session_ids:
+            await cls.filter(id__in=session_ids).delete()
+        return len(session_ids)
+
+    @classmethod
+    async def lookup_many(cls, ids: list) -> list:
+        """
+        Looks up sessions and their bearers by id in a single query, identifiers not found are skipped.
+
+        Args:
+            ids (list): Session identifiers.
+
+        Returns:
+            sessions and their bearers (list of session, bearer)
+        """
+        sessions = await cls.filter(id__in=ids, deleted=False).select_related("bearer")
+        return [(session, session.bearer) for session in sessions]
+
+    @classmethod
+    async def deactivate_many(cls, sessions: list) -> list:
+        """
+        Deactivates several sessions in a single query.
+
+        Args:
+            sessions (list): Sessions being deactivated.
+
+        Returns:
+            sessions
+        """
+        date_updated = datetime.datetime.now(datetime.timezone.utc)
+        await cls.filter(id__in=[session.id for session in sessions]).update(active=False, date_updated=date_updated)
+        for session in sessions:
+            session.active = False
+            session.date_updated = date_updated
+            session_cache.discard(session)
+        return sessions
+
     @classmethod
     async def deactivate(cls, session):
         """
@@ -373,9 +537,9 @@ class Session(BaseModel):
         Raises:
             NotFoundError
         """
-        # TODO: Should probably be removing old sessions, not just setting inactive
         session.active = False
-        await session.save(update_fields=["active"])
+        await session.save(update_fields=["active", "date_updated"])
+        session_cache.discard(session)
         return session
 
     class Meta:
@@ -402,27 +566,37 @@ class VerificationSession(Session):
         """
         Checks if code passed is equivalent to the session code.
 
+        Attempts are counted and the session deactivated with conditional updates, so concurrent attempts can't exceed
+        the maximum amount of attempts or use the session twice. Once maxed out, the session code is no longer accepted.
+
         Args:
             code (str): Code being cross-checked with session code.
             request (Request): Sanic request parameter.
 
         Raises:
             ChallengeError
+            DeactivatedError
             MaxedOutChallengeError
         """
+        session_cache.discard(self)
+        query = self.__class__.filter(
+            id=self.id, attempts__lt=security_config.SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS
+        )
         if self.code != code:
-            if self.attempts < security_config.SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS:
+            if await query.update(attempts=F("attempts") + 1):
                 self.attempts += 1
-                await self.save(update_fields=["attempts"])
                 raise ChallengeError("The value provided does not match.")
-            else:
-                logger.warning(
-                    f"Client ({self.bearer.email}/{get_ip(request)}) has maxed out on session challenge attempts"
-                )
-                raise MaxedOutChallengeError()
-        else:
+        elif await query.filter(active=True).update(
+            active=False, date_updated=datetime.datetime.now(datetime.timezone.utc)
+        ):
             self.active = False
-            await self.save(update_fields=["active"])
+            return
+        elif await query.exists():
+            raise DeactivatedError("Session has already been used.")
+        logger.warning(
+            f"Client ({self.bearer.email}/{get_ip(request)}) has maxed out on session challenge attempts"
+        )
+        raise MaxedOutChallengeError()
 
     class Meta:
         abstract = True
@@ -433,6 +607,8 @@ class TwoStepSession(VerificationSession):
     Validates a client using a code sent via email or text.
     """
 
+    session_type = "twos"
+
     @classmethod
     async def new(cls, request: Request, account: Account, **kwargs):
         return await TwoStepSession.create(
@@ -453,6 +629,8 @@ class CaptchaSession(VerificationSession):
     Validates a client with a captcha challenge.
     """
 
+    session_type = "capt"
+
     @classmethod
     async def new(cls, request: Request, **kwargs):
         return await CaptchaSession.create(
@@ -470,8 +648,17 @@ class CaptchaSession(VerificationSession):
 class AuthenticationSession(Session):
     """
     Used to authenticate and identify a client.
+
+    Attributes:
+        refresh_expiration_date (datetime): Date and time the session can no longer be refreshed.
+        family (str): Identifier of the session first created on login, shared by every session refreshed from it.
     """
 
+    session_type = "auth"
+    purge_field = "refresh_expiration_date"
+    refresh_expiration_date: Optional[datetime.datetime] = fields.DatetimeField(null=True)
+    family: Optional[str] = fields.CharField(max_length=36, null=True)
+
     @classmethod
     async def new(cls, request: Request, account: Account, **kwargs):
         return await AuthenticationSession.create(
@@ -486,6 +673,24 @@ class AuthenticationSession(Session):
             ),
         )
 
+    @classmethod
+    async def deactivate_family(cls, family: str):
+        """
+        Deactivates every active session refreshed from the same session.
+
+        Args:
+            family (str): Identifier of the session first created on login.
+
+        Returns:
+            deactivated_sessions (list of id, expiration_date)
+        """
+        query = cls.filter(family=family, active=True)
+        deactivated_sessions = await query.values_list("id", "expiration_date")
+        await query.update(active=False, date_updated=datetime.datetime.now(datetime.timezone.utc))
+        for session_id, _ in deactivated_sessions:
+            session_cache.pop(session_cache.key(cls, session_id))
+        return deactivated_sessions
+
 
 class Role(BaseModel):
     """
@@ -505,6 +710,10 @@ class Role(BaseModel):
     def validate(self) -> None:
         raise NotImplementedError()
 
+    async def save(self, *args, **kwargs) -> None:
+        await super().save(*args, **kwargs)
+        role_cache.bump()
+
     @staticmethod
     async def lookup(name: str):
         """
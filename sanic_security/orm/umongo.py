@@ -15,8 +15,10 @@ from sanic.response import HTTPResponse
 from umongo import Document, EmbeddedDocument, fields, validate, pre_load, MixinDocument
 from umongo.frameworks.motor_asyncio import MotorAsyncIOReference
 from umongo.exceptions import NotCreatedError
-from pymongo.errors import DuplicateKeyError
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
+from sanic_security.cache import role_cache, session_cache
 from sanic_security.configuration import config as security_config
 from sanic_security.exceptions import *
 from sanic_security.utils import get_ip, get_code, get_expiration_date
@@ -52,6 +54,49 @@ async def init(sanic):
     await setup_indexes()
 
 
+_marshmallow_schemas = {}
+
+
+def get_marshmallow_schema(cls):
+    """
+    Retrieves the marshmallow schema used to serialize a document class, created once per class.
+    Account passwords and TOTP secrets are excluded.
+
+    Args:
+        cls (Type[Document]): Document class being serialized.
+
+    Returns:
+        marshmallow_schema
+    """
+    schema = _marshmallow_schemas.get(cls)
+    if not schema:
+        schema = _marshmallow_schemas[cls] = cls.schema.as_marshmallow_schema()(
+            exclude=[field for field in ('password', 'totp_secret') if field in cls.schema.fields]
+        )
+    return schema
+
+
+async def ensure_ttl_indexes() -> None:
+    """
+    Creates TTL indexes, so MongoDB deletes sessions the configured purge retention after they can no longer be used.
+    """
+    for cls in (TwoStepSession, CaptchaSession, AuthenticationSession):
+        try:
+            await cls.collection.create_index(
+                cls.purge_field, expireAfterSeconds=security_config.SANIC_SECURITY_SESSION_PURGE_RETENTION
+            )
+        except OperationFailure as e:
+            logger.warning(f"[Sanic-Security] Could not create TTL index on {cls.__name__}.{cls.purge_field}: {e}")
+
+
+def prepare_serializers() -> None:
+    """
+    Creates the marshmallow schemas of all Sanic Security documents ahead of the first response.
+    """
+    for cls in (Account, Session, Role):
+        get_marshmallow_schema(cls)
+
+
 @instance.register
 class BaseMixin(MixinDocument):
     """
@@ -81,16 +126,31 @@ class BaseMixin(MixinDocument):
     async def verify(self) -> None:
         self.verified = True
         await self.commit()
+        session_cache.discard_bearer(self)
 
     async def json(self, cls) -> dict:
-        _ma = cls.schema.as_marshmallow_schema()
-        schema = _ma()
-        return schema.dump(self)
+        return get_marshmallow_schema(cls).dump(self)
 
     class Meta:
         abstract = True
 
 
+@instance.register
+class RoleSnapshot(EmbeddedDocument):
+    """
+    Copy of a role embedded in the accounts it is assigned to, so authorization does not need to fetch roles.
+
+    Attributes:
+        role_id (ObjectId): Primary key of the role.
+        name (str): Name of the role.
+        permissions (str): Permissions of the role.
+    """
+
+    role_id = fields.ObjectIdField()
+    name: str = fields.StringField(max_length=255)
+    permissions: str = fields.StringField(max_length=255, allow_none=True)
+
+
 @instance.register
 class Account(Document, BaseMixin):
     """
@@ -103,7 +163,9 @@ class Account(Document, BaseMixin):
         password (str): Password of account for protection. Must be hashed via Argon.
         disabled (bool): Renders the account unusable but available.
         verified (bool): Renders the account unusable until verified via two-step verification or other method.
+        totp_secret (str): Base32 secret enrolled for TOTP two-step verification, None if not enrolled.
         roles (ManyToManyRelation[Role]): Roles associated with this account.
+        role_snapshots (list[RoleSnapshot]): Copies of the account's roles, kept when role snapshots are enabled.
     """
 
     username = fields.StringField(required=False, unique=True, validate=[validate.Regexp(r"^[A-Za-z0-9 @_-]{3,32}$")])
@@ -120,7 +182,9 @@ class Account(Document, BaseMixin):
     current_login_ip: str = fields.StringField(validate=[validate.Length(max=60)], null=True)
     disabled: bool = fields.BooleanField(load_default=False)
     verified: bool = fields.BooleanField(load_default=False)
+    totp_secret: str = fields.StringField(load_default=None, allow_none=True)
     roles = fields.ListField(fields.ReferenceField('Role', fetch=True), null=True, fetch=True) 
+    role_snapshots = fields.ListField(fields.EmbeddedField(RoleSnapshot), null=True)
 
     @pre_load
     def clean(self, data, many, **kwargs):
@@ -150,10 +214,19 @@ class Account(Document, BaseMixin):
         elif self.disabled:
             raise DisabledError()
 
+    async def set_totp_secret(self, secret: str = None) -> None:
+        """
+        Enrolls the account in TOTP two-step verification.
+
+        Args:
+            secret (str): Base32 secret of the account, unenrolls the account if None.
+        """
+        self.totp_secret = secret
+        await self.commit()
+        session_cache.discard_bearer(self)
+
     async def json(self) -> dict:
-        _ma = Account().schema.as_marshmallow_schema()
-        schema = _ma(exclude=['password'])
-        return schema.dump(self)
+        return get_marshmallow_schema(Account).dump(self)
 
     @staticmethod
     async def new(**kwargs):
@@ -191,6 +264,62 @@ class Account(Document, BaseMixin):
 
         return await Account.find_one({'id': _account.inserted_id, 'deleted': False})
 
+    @staticmethod
+    async def get_revoked():
+        """
+        Retrieves accounts that can no longer authenticate.
+
+        Returns:
+            account_ids (list)
+        """
+        account_ids = []
+        async for account in Account.find({'$or': [{'deleted': True}, {'disabled': True}, {'verified': False}]}):
+            account_ids.append(account.id)
+        return account_ids
+
+    @staticmethod
+    async def lookup_many(ids: list) -> list:
+        """
+        Retrieves accounts by id in a single query, identifiers not found are skipped.
+
+        Args:
+            ids (list): Identifiers of the accounts being retrieved.
+
+        Returns:
+            accounts
+        """
+        return [
+            account async for account in
+            Account.find({'id': {'$in': [objectid.ObjectId(id) for id in ids]}, 'deleted': False})
+        ]
+
+    @staticmethod
+    async def get_roles_many(ids: list) -> dict:
+        """
+        Retrieves the roles of several accounts in two queries, accounts not found are skipped.
+
+        Args:
+            ids (list): Identifiers of the accounts.
+
+        Returns:
+            roles (dict of account id, roles)
+        """
+        accounts = await Account.lookup_many(ids)
+        if security_config.SANIC_SECURITY_ROLE_SNAPSHOTS:
+            roles = {str(account.id): list(account.role_snapshots) for account in accounts if account.role_snapshots}
+            accounts = [account for account in accounts if str(account.id) not in roles]
+        else:
+            roles = {}
+        fetched_roles = {
+            role.pk: role for role in
+            await Account.fetch_roles([reference for account in accounts for reference in account.roles or []])
+        }
+        for account in accounts:
+            roles[str(account.id)] = [
+                fetched_roles[reference.pk] for reference in account.roles or [] if reference.pk in fetched_roles
+            ]
+        return roles
+
     async def get_roles(self, id = None):
         """
         Returns a list of roles for provided account
@@ -207,14 +336,39 @@ class Account(Document, BaseMixin):
 
         account = self
         if not account.pk:
-            account = await Account.find_one({'id': id})
+            account = await Account.find_one({'id': objectid.ObjectId(id)})
         if not account:
             raise NotFoundError("Lookup returned no matching user")
         elif not account.roles:
             return []
 
-        roles = [await role.fetch() for role in account.roles]
-        return roles
+        if security_config.SANIC_SECURITY_ROLE_SNAPSHOTS and account.role_snapshots:
+            return list(account.role_snapshots)
+        return await Account.fetch_roles(account.roles)
+
+    @staticmethod
+    async def fetch_roles(references) -> list:
+        """
+        Retrieves referenced roles in a single query.
+
+        Args:
+            references (list): References to the roles being retrieved.
+
+        Returns:
+            roles (list, in the order referenced)
+        """
+        role_ids = [reference.pk for reference in references]
+        roles = {role.pk: role async for role in Role.find({'id': {'$in': role_ids}})}
+        return [roles[role_id] for role_id in role_ids if role_id in roles]
+
+    async def sync_role_snapshots(self) -> None:
+        """
+        Replaces the account's role snapshots with copies of its current roles.
+        """
+        self.role_snapshots = [
+            RoleSnapshot(role_id=role.pk, name=role.name, permissions=role.permissions)
+            for role in await Account.fetch_roles(self.roles or [])
+        ]
 
     async def add_role(self, id = None, role = None):
         """
@@ -233,19 +387,23 @@ class Account(Document, BaseMixin):
         """
 
         logger.debug(f'Trying to add role: {role} to user {id}')
-        account = await id.fetch()
+        # `id` is either a reference to the account or an already fetched document
+        account = await id.fetch() if hasattr(id, 'fetch') else id
         logger.debug(f'Fetched account = {account}')
         if not account.pk:
             if not id:
                 raise AccountError('Must provide Account object or pass `id` parameter!')
-            account = await Account.find_one({'id': id})
+            account = await Account.find_one({'id': objectid.ObjectId(id)})
         if not account:
             raise NotFoundError("Lookup requested by no identifier provided")
         if account.roles:
             account.roles.append(role)
         else:
             account.roles = [role]
+        if security_config.SANIC_SECURITY_ROLE_SNAPSHOTS:
+            await account.sync_role_snapshots()
         await account.commit()
+        role_cache.bump(str(account.id))
         return account
 
     @staticmethod
@@ -277,7 +435,7 @@ class Account(Document, BaseMixin):
                 account = await Account.find_one({'phone': phone, 'deleted': False})
                 logger.debug(f"Lookup user identified by phone: {phone}")
             elif id:
-                account = await Account.find_one({'id': id, 'deleted': False})
+                account = await Account.find_one({'id': objectid.ObjectId(id), 'deleted': False})
                 logger.debug(f"Lookup user identified by id: {id}")
             else:
                 raise NotFoundError("Lookup requested by no identifier provided")
@@ -301,6 +459,7 @@ class Session(BaseMixin, MixinDocument):
         ip (str): IP address of client creating session.
         bearer (ForeignKeyRelation[Account]): Account associated with this session.
         ctx (SimpleNamespace): Store whatever additional information you need about the session. Fields stored will be encoded.
+        purge_field (str): Date after which the session can no longer be used, and may be purged.
     """
 
     expiration_date: dt.datetime = fields.DateTimeField(null=True)
@@ -309,6 +468,7 @@ class Session(BaseMixin, MixinDocument):
     ip: str = fields.StringField(max_length=16)
     bearer = fields.ReferenceField('Account', fetch=True)
     ctx = SimpleNamespace()
+    purge_field = "expiration_date"
 
     @classmethod
     async def new(cls, request: Request, account: Account, **kwargs):
@@ -341,6 +501,8 @@ class Session(BaseMixin, MixinDocument):
         """
 
         _session = await cls.find_one({'id': objectid.ObjectId(id)})
+        if not _session:
+            raise NotFoundError("Session could not be found.")
 
         if isinstance(_session.bearer, str) or isinstance(_session.bearer, MotorAsyncIOReference):
             return _session, await _session.bearer.fetch()
@@ -366,6 +528,91 @@ class Session(BaseMixin, MixinDocument):
         elif not self.active:
             raise DeactivatedError()
 
+    @classmethod
+    async def get_revoked(cls, since: dt.datetime = None):
+        """
+        Retrieves deactivated or deleted sessions that have not yet expired.
+
+        Args:
+            since (datetime): Only retrieve sessions revoked after this time, all revoked sessions if None.
+
+        Returns:
+            revoked_sessions (list of id, expiration_date)
+        """
+        query = {
+            '$and': [
+                {'$or': [{'expiration_date': None}, {'expiration_date': {'$gt': dt.datetime.utcnow()}}]},
+                {'$or': [{'active': False}, {'deleted': True}]},
+            ]
+        }
+        if since:
+            query['date_updated'] = {'$gte': since.astimezone(dt.timezone.utc).replace(tzinfo=None)}
+        revoked = []
+        async for session in cls.find(query):
+            revoked.append((session.id, session.expiration_date))
+        return revoked
+
+    @classmethod
+    async def purge(cls, before: dt.datetime, limit: int) -> int:
+        """
+        Deletes a batch of sessions that can no longer be used since before a date, see `purge_field`.
+
+        Args:
+            before (datetime): Sessions that could no longer be used since before this date are deleted.
+            limit (int): Maximum amount of sessions deleted.
+
+        Returns:
+            purged
+        """
+        before = before.astimezone(dt.timezone.utc).replace(tzinfo=None)
+        session_ids = [
+            session['_id']
+            async for session in cls.collection.find({cls.purge_field: {'$lt': before}}, {'_id': 1}).limit(limit)
+        ]
+        if session_ids:
+            await cls.collection.delete_many({'_id': {'$in': session_ids}})
+        return len(session_ids)
+
+    @classmethod
+    async def lookup_many(cls, ids: list) -> list:
+        """
+        Looks up sessions and their bearers by id in two queries, identifiers not found are skipped.
+
+        Args:
+            ids (list): Session identifiers.
+
+        Returns:
+            sessions and their bearers (list of session, bearer)
+        """
+        sessions = [session async for session in cls.find({'id': {'$in': [objectid.ObjectId(id) for id in ids]}})]
+        bearers = {
+            bearer.pk: bearer for bearer in
+            await Account.lookup_many([str(session.bearer.pk) for session in sessions if session.bearer])
+        }
+        return [(session, bearers.get(session.bearer.pk) if session.bearer else None) for session in sessions]
+
+    @classmethod
+    async def deactivate_many(cls, sessions: list) -> list:
+        """
+        Deactivates several sessions in a single query.
+
+        Args:
+            sessions (list): Sessions being deactivated.
+
+        Returns:
+            sessions
+        """
+        date_updated = dt.datetime.utcnow()
+        await cls.collection.update_many(
+            {'_id': {'$in': [session.pk for session in sessions]}},
+            {'$set': {'active': False, 'date_updated': date_updated}},
+        )
+        for session in sessions:
+            session.active = False
+            session.date_updated = date_updated
+            session_cache.discard(session)
+        return sessions
+
     @classmethod
     async def deactivate(cls, session):
         """
@@ -383,20 +630,19 @@ class Session(BaseMixin, MixinDocument):
         """
         try:
             session.active = False
+            session.date_updated = dt.datetime.utcnow()
             deactivated_session = (
-                #TODO: Should probably be removing old sessions, not just setting inactive
                 await session.commit()
             )
             if not deactivated_session:
                 raise NotCreatedError
         except NotCreatedError:
             raise NotFoundError("Session could not be found.")
+        session_cache.discard(session)
         return session
 
     async def json(self) -> dict:
-        _ma = Session().schema.as_marshmallow_schema()
-        schema = _ma()
-        return schema.dump(self)
+        return get_marshmallow_schema(Session).dump(self)
 
     class Meta:
         abstract = True
@@ -423,27 +669,47 @@ class VerificationSession(Session, BaseMixin, MixinDocument):
         """
         Checks if code passed is equivalent to the session code.
 
+        Attempts are counted and the session deactivated with conditional updates, so concurrent attempts can't exceed
+        the maximum amount of attempts or use the session twice. Once maxed out, the session code is no longer accepted.
+
         Args:
             code (str): Code being cross-checked with session code.
             request (Request): Sanic request parameter.
 
         Raises:
             ChallengeError
+            DeactivatedError
             MaxedOutChallengeError
         """
+        session_cache.discard(self)
+        query = {
+            '_id': self.pk,
+            'attempts': {'$not': {'$gte': security_config.SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS}},
+        }
         if self.code != code:
-            if self.attempts < security_config.SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS:
-                self.attempts += 1
-                await self.commit()
+            session = await self.collection.find_one_and_update(
+                query,
+                {'$inc': {'attempts': 1}},
+                projection={'attempts': True},
+                return_document=ReturnDocument.AFTER,
+            )
+            if session:
+                self.attempts = session['attempts']
                 raise ChallengeError("The value provided does not match.")
-            else:
-                logger.warning(
-                    f"Client ({self.bearer.pk}/{get_ip(request)}) has maxed out on session challenge attempts"
-                )
-                raise MaxedOutChallengeError()
-        else:
+        elif (
+            await self.collection.update_one(
+                {**query, 'active': True},
+                {'$set': {'active': False, 'date_updated': dt.datetime.utcnow()}},
+            )
+        ).modified_count:
             self.active = False
-            await self.commit()
+            return
+        elif await self.collection.count_documents(query, limit=1):
+            raise DeactivatedError("Session has already been used.")
+        logger.warning(
+            f"Client ({self.bearer.pk}/{get_ip(request)}) has maxed out on session challenge attempts"
+        )
+        raise MaxedOutChallengeError()
 
     class Meta:
         abstract = True
@@ -456,6 +722,8 @@ class TwoStepSession(VerificationSession, Document):
     Validates a client using a code sent via email or text.
     """
 
+    session_type = "twos"
+
     @classmethod
     async def new(cls, request: Request, account: Account, **kwargs):
         _session = await TwoStepSession(
@@ -476,6 +744,8 @@ class CaptchaSession(Document, VerificationSession, Session):
     Validates a client with a captcha challenge.
     """
 
+    session_type = "capt"
+
     @classmethod
     async def new(cls, request: Request, **kwargs):
         _captcha_session = await CaptchaSession(
@@ -495,8 +765,15 @@ class CaptchaSession(Document, VerificationSession, Session):
 class AuthenticationSession(Document, VerificationSession, Session, BaseMixin):
     """
     Used to authenticate and identify a client.
+
+    Attributes:
+        family (str): Identifier of the session first created on login, shared by every session refreshed from it.
     """
 
+    session_type = "auth"
+    purge_field = "refresh_expiration_date"
+    family: str = fields.StringField(allow_none=True)
+
     @classmethod
     async def new(cls, request: Request, account: Account, **kwargs):
         _auth_session = await AuthenticationSession(
@@ -512,6 +789,22 @@ class AuthenticationSession(Document, VerificationSession, Session, BaseMixin):
         ).commit()
         return await AuthenticationSession.find_one({'id': _auth_session.inserted_id})
 
+    @classmethod
+    async def deactivate_family(cls, family: str):
+        """
+        Deactivates every active session refreshed from the same session.
+
+        Args:
+            family (str): Identifier of the session first created on login.
+
+        Returns:
+            deactivated_sessions (list of id, expiration_date)
+        """
+        sessions = [session async for session in cls.find({'family': family, 'active': True})]
+        if sessions:
+            await cls.deactivate_many(sessions)
+        return [(session.id, session.expiration_date) for session in sessions]
+
 
 @instance.register
 class Role(Document, BaseMixin):
@@ -535,6 +828,16 @@ class Role(Document, BaseMixin):
     def validate(self) -> None:
         raise NotImplementedError()
 
+    async def post_update(self, ret):
+        if security_config.SANIC_SECURITY_ROLE_SNAPSHOTS:
+            async for account in Account.find({'roles': self.pk}):
+                await account.sync_role_snapshots()
+                await account.commit()
+        role_cache.bump()
+
+    async def post_delete(self, ret):
+        role_cache.bump()
+
     @staticmethod
     async def lookup(name: str):
         """
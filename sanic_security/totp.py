@@ -0,0 +1,111 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import struct
+import time
+from urllib.parse import quote, urlencode
+
+from sanic_security.cache import totp_attempts, used_totp_codes
+from sanic_security.configuration import config as security_config
+from sanic_security.exceptions import ChallengeError, MaxedOutChallengeError
+
+"""
+An effective, simple, and async security library for the Sanic framework.
+Copyright (C) 2020-present Aidan Stewart
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+def generate_totp_secret() -> str:
+    """
+    Generates a random secret to be enrolled in an authenticator app.
+
+    Returns:
+        totp_secret (base32)
+    """
+    return base64.b32encode(secrets.token_bytes(20)).decode()
+
+
+def get_totp_uri(secret: str, account_name: str) -> str:
+    """
+    Retrieves the provisioning URI of a secret, usually displayed as a QR code for authenticator apps to scan.
+
+    Args:
+        secret (str): Base32 secret of the account.
+        account_name (str): Identifier of the account displayed by authenticator apps, such as its email.
+
+    Returns:
+        totp_uri
+    """
+    issuer = security_config.SANIC_SECURITY_TOTP_ISSUER
+    parameters = {
+        "secret": secret,
+        "digits": security_config.SANIC_SECURITY_TOTP_DIGITS,
+        "period": security_config.SANIC_SECURITY_TOTP_PERIOD,
+    }
+    if issuer:
+        parameters["issuer"] = issuer
+        account_name = f"{issuer}:{account_name}"
+    return f"otpauth://totp/{quote(account_name)}?{urlencode(parameters, quote_via=quote)}"
+
+
+def get_totp(secret: str, counter: int) -> str:
+    """
+    Computes the code of a secret for a time step (RFC 6238, HMAC-SHA1).
+
+    Args:
+        secret (str): Base32 secret of the account.
+        counter (int): Time step the code is valid for.
+
+    Returns:
+        totp
+    """
+    key = base64.b32decode(secret.upper() + "=" * (-len(secret) % 8))
+    digest = hmac.new(key, struct.pack(">Q", counter), hashlib.sha1).digest()
+    offset = digest[-1] & 0x0F
+    code = struct.unpack(">I", digest[offset:offset + 4])[0] & 0x7FFFFFFF
+    digits = security_config.SANIC_SECURITY_TOTP_DIGITS
+    return str(code % 10 ** digits).zfill(digits)
+
+
+def check_totp(secret: str, code: str, key: str) -> None:
+    """
+    Checks if code passed is the secret's current code, tolerating `SANIC_SECURITY_TOTP_WINDOW` time steps of clock
+    drift. Accepted codes can't be used again, and failed attempts are limited to `SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS`
+    until no code attempted could still be valid. Both are tracked in memory by each worker.
+
+    Args:
+        secret (str): Base32 secret of the account.
+        code (str): Code being cross-checked with the secret's code.
+        key (str): Identifier of the account the secret is enrolled in.
+
+    Raises:
+        ChallengeError
+        MaxedOutChallengeError
+    """
+    if totp_attempts.get(key, 0) >= security_config.SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS:
+        raise MaxedOutChallengeError()
+    counter = int(time.time()) // security_config.SANIC_SECURITY_TOTP_PERIOD
+    window = security_config.SANIC_SECURITY_TOTP_WINDOW
+    for step in range(counter - window, counter + window + 1):
+        if code and hmac.compare_digest(get_totp(secret, step), code):
+            if (key, step) in used_totp_codes:
+                raise ChallengeError("The value provided has already been used.")
+            used_totp_codes.set((key, step), True)
+            totp_attempts.pop(key)
+            return
+    totp_attempts.set(key, totp_attempts.get(key, 0) + 1)
+    raise ChallengeError("The value provided does not match.")
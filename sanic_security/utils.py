@@ -1,19 +1,27 @@
 import datetime
+import hashlib
+import os
 import random
 import string
+import threading
+import time
 
 import jwt
-from jwt import DecodeError
+from jwt import DecodeError, ExpiredSignatureError
 
 from captcha.image import ImageCaptcha
 from io import BytesIO
+from PIL import features
 
 from sanic.request import Request
-from sanic.response import json as sanic_json, HTTPResponse, raw
+from sanic.response import json as sanic_json, HTTPResponse, empty, raw
 from sanic.log import logger
 
-from sanic_security.exceptions import JWTDecodeError, NotFoundError
+from sanic_security.cache import captcha_image_cache, session_cache
+from sanic_security.exceptions import ExpiredError, JWTDecodeError, NotFoundError
 from sanic_security.configuration import config as security_config
+from sanic_security.executor import executor
+from sanic_security.keyring import keyring
 
 """
 An effective, simple, and async security library for the Sanic framework.
@@ -91,36 +99,315 @@ def get_expiration_date(seconds: int) -> datetime.datetime:
     )
 
 
-def get_image(self) -> HTTPResponse:
+_captcha_generators = threading.local()
+
+
+def get_captcha_generator() -> ImageCaptcha:
+    """
+    Retrieves the captcha generator of the current thread, created once with the configured font so the font is not
+    loaded on every render. The captcha library's font is used if the configured font can't be found.
+
+    Returns:
+        captcha_generator
     """
-    Retrieves captcha image file.
+    source = (
+        security_config.SANIC_SECURITY_CAPTCHA_FONT,
+        security_config.SANIC_SECURITY_CAPTCHA_WIDTH,
+        security_config.SANIC_SECURITY_CAPTCHA_HEIGHT,
+    )
+    if getattr(_captcha_generators, "source", None) != source:
+        font, width, height = source
+        fonts = [font] if font and os.path.isfile(font) else None
+        if not fonts:
+            logger.warning(f"Captcha font {font} could not be found, using the default font.")
+        _captcha_generators.generator = ImageCaptcha(width, height, fonts=fonts)
+        _captcha_generators.source = source
+    return _captcha_generators.generator
+
+
+_captcha_formats = {
+    "jpeg": ("JPEG", "image/jpeg", {"optimize": True}),
+    "png": ("PNG", "image/png", {"optimize": True}),
+    "webp": ("WEBP", "image/webp", {}),
+}
+_captcha_encoder = None
+
+
+def _get_captcha_encoder_source() -> tuple:
+    return security_config.SANIC_SECURITY_CAPTCHA_FORMAT, security_config.SANIC_SECURITY_CAPTCHA_QUALITY
+
+
+def load_captcha_encoder() -> tuple:
+    """
+    Resolves the configured captcha image format into the encoder used by `render_captcha`. JPEG is used if the
+    installed Pillow can't encode the configured format.
+
+    Returns:
+        pil_format, content_type, save_options
+
+    Raises:
+        ValueError
+    """
+    global _captcha_encoder
+    captcha_format = security_config.SANIC_SECURITY_CAPTCHA_FORMAT.lower()
+    if captcha_format not in _captcha_formats:
+        raise ValueError(
+            f"Captcha format {captcha_format} is not one of: {', '.join(_captcha_formats)}."
+        )
+    if captcha_format == "webp" and not features.check("webp"):
+        logger.warning("Captcha format webp is not supported by the installed Pillow, using jpeg.")
+        captcha_format = "jpeg"
+    pil_format, content_type, save_options = _captcha_formats[captcha_format]
+    if pil_format != "PNG":
+        save_options = {**save_options, "quality": security_config.SANIC_SECURITY_CAPTCHA_QUALITY}
+    _captcha_encoder = (_get_captcha_encoder_source(), (pil_format, content_type, save_options))
+    return _captcha_encoder[1]
+
+
+def get_captcha_encoder() -> tuple:
+    """
+    Retrieves the encoder resolved by `load_captcha_encoder`, which is reloaded if the configured format or quality
+    changed.
+
+    Returns:
+        pil_format, content_type, save_options
+    """
+    if not _captcha_encoder or _captcha_encoder[0] != _get_captcha_encoder_source():
+        return load_captcha_encoder()
+    return _captcha_encoder[1]
+
+
+def render_captcha(code: str) -> bytes:
+    """
+    Renders a captcha challenge. Blocking, run in the executor.
+
+    Args:
+        code (str): Solution of the captcha challenge.
 
     Returns:
         captcha_image
     """
-    image = ImageCaptcha(190, 90)
+    pil_format, content_type, save_options = get_captcha_encoder()
     with BytesIO() as output:
-        image.generate_image(self.code).save(output, format="JPEG")
-        return raw(output.getvalue(), content_type="image/jpeg")
+        get_captcha_generator().generate_image(code).save(output, format=pil_format, **save_options)
+        return output.getvalue()
+
+
+def get_captcha_etag(captcha_session) -> str:
+    """
+    Retrieves the entity tag of a captcha session's image, which identifies the challenge and the image settings.
+
+    Args:
+        captcha_session (CaptchaSession): Captcha session the image is retrieved for.
+
+    Returns:
+        etag
+    """
+    digest = hashlib.blake2b(
+        f"{captcha_session.id}:{security_config.SANIC_SECURITY_CAPTCHA_FORMAT}:"
+        f"{security_config.SANIC_SECURITY_CAPTCHA_WIDTH}x{security_config.SANIC_SECURITY_CAPTCHA_HEIGHT}:"
+        f"{security_config.SANIC_SECURITY_CAPTCHA_QUALITY}".encode(),
+        digest_size=16,
+    ).hexdigest()
+    return f'W/"{digest}"'
+
+
+async def get_image(captcha_session, request: Request = None) -> HTTPResponse:
+    """
+    Retrieves captcha image file, pre-rendered images of pooled captchas are served as is.
+
+    Other captchas are rendered in the executor, with at most `SANIC_SECURITY_CAPTCHA_RENDER_LIMIT` renders pending.
+
+    Args:
+        captcha_session (CaptchaSession): Captcha session the image is retrieved for.
+        request (Request): Sanic request parameter. If provided and captcha ETags are enabled, clients that already
+            hold the image are answered with 304 Not Modified instead of a new render.
+
+    Returns:
+        captcha_image
+
+    Raises:
+        BusyError
+    """
+    headers = {}
+    if security_config.SANIC_SECURITY_CAPTCHA_CACHE_CONTROL:
+        headers["cache-control"] = security_config.SANIC_SECURITY_CAPTCHA_CACHE_CONTROL
+    if security_config.SANIC_SECURITY_CAPTCHA_ETAG:
+        headers["etag"] = get_captcha_etag(captcha_session)
+        if request and headers["etag"] in request.headers.get("if-none-match", ""):
+            return empty(304, headers)
+    image = captcha_image_cache.get(str(captcha_session.id))
+    if not image:
+        image = await executor.run_capped(
+            "captcha",
+            security_config.SANIC_SECURITY_CAPTCHA_RENDER_LIMIT,
+            render_captcha,
+            captcha_session.code,
+        )
+    return raw(image, content_type=get_captcha_encoder()[1], headers=headers)
+
+
+def get_session_type(cls) -> str:
+    """
+    Retrieves the short session type used to name a session's cookie.
+
+    Sessions may declare a `session_type` attribute, otherwise it is derived from the class name.
+
+    Args:
+        cls: Session, or class of the session.
+
+    Returns:
+        session_type
+    """
+    if not isinstance(cls, type):
+        cls = cls.__class__
+    return getattr(cls, "session_type", None) or cls.__name__.lower()[:4]
+
+
+_session_cookies = {}
+
+
+def register_session_cookies(*session_models) -> None:
+    """
+    Resolves the cookie name of each session model once, so sessions are not inspected on every encode and decode.
+
+    Args:
+        *session_models: Session models, or instances of them.
+
+    Raises:
+        ValueError
+    """
+    session_cookies = {}
+    cookie_models = {}
+    for session_model in session_models:
+        cls = session_model if isinstance(session_model, type) else session_model.__class__
+        session_type = get_session_type(cls)
+        cookie = f"{security_config.SANIC_SECURITY_SESSION_PREFIX}_{session_type}_session"
+        if cookie_models.get(cookie, cls) is not cls:
+            raise ValueError(
+                f"Session models {cookie_models[cookie].__name__} and {cls.__name__} share the cookie {cookie}, "
+                "declare a distinct session_type on one of them."
+            )
+        cookie_models[cookie] = cls
+        session_cookies[cls] = (cookie, session_type)
+    _session_cookies.clear()
+    _session_cookies.update(session_cookies)
+
+
+def get_session_cookie(cls) -> tuple:
+    """
+    Retrieves the cookie name and session type of a session, resolving and registering unregistered sessions.
+
+    Args:
+        cls: Session, or class of the session.
+
+    Returns:
+        cookie, session_type
+    """
+    if not isinstance(cls, type):
+        cls = cls.__class__
+    session_cookie = _session_cookies.get(cls)
+    if not session_cookie:
+        session_type = get_session_type(cls)
+        session_cookie = (
+            f"{security_config.SANIC_SECURITY_SESSION_PREFIX}_{session_type}_session",
+            session_type,
+        )
+        _session_cookies[cls] = session_cookie
+    return session_cookie
+
+
+def get_bearer_claims(session) -> dict:
+    """
+    Retrieves the account state claims used for stateless authentication.
+
+    The bearer is read from `session.loaded_bearer` when the session's bearer field only holds a reference.
+
+    Args:
+        session: Authentication session being encoded.
+
+    Returns:
+        bearer_claims (empty if the bearer has not been loaded)
+    """
+    bearer = getattr(session, "loaded_bearer", None) or getattr(session, "bearer", None)
+    if bearer is None or not hasattr(bearer, "verified"):
+        return {}
+    return {
+        "sub": str(bearer.id),
+        "verified": bool(bearer.verified),
+        "disabled": bool(bearer.disabled),
+        "deleted": bool(bearer.deleted),
+    }
+
 
+def _get_timestamp(date: datetime.datetime):
+    if date and not date.tzinfo:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp() if date else None
 
-def encode(session, response: HTTPResponse) -> None:
+
+def requires_reissue(session, request: Request) -> bool:
+    """
+    Determines if a session's cookie must be reissued, or if the cookie sent by the client can be kept.
+
+    The cookie is kept while less than `SANIC_SECURITY_SESSION_REISSUE_THRESHOLD` of its remaining lifetime, from when
+    it was issued to when the session expires, has passed and the session's encoded data is unchanged.
+
+    Args:
+        session: Session being encoded.
+        request (Request): Sanic request parameter, the session's cookie was decoded from it.
+
+    Returns:
+        requires_reissue
+    """
+    threshold = security_config.SANIC_SECURITY_SESSION_REISSUE_THRESHOLD
+    claims = getattr(request.ctx, "session_claims", {}).get(get_session_cookie(session)[0])
+    if not threshold or not claims or claims.get("sid") != str(session.id) or "iat" not in claims:
+        return True
+    if claims.get("ctx", {}) != session.ctx.__dict__:
+        return True
+    expires_at = _get_timestamp(session.expiration_date)
+    if not expires_at:
+        return False
+    return time.time() - claims["iat"] >= threshold * (expires_at - claims["iat"])
+
+
+def encode(session, response: HTTPResponse, request: Request = None) -> None:
     """
     Transforms session into JWT and then is stored in a cookie.
 
+    The JWT payload is compact: the session id (`sid`), issue (`iat`) and expiration (`exp`) epoch times, the client's
+    ip, the bearer's id (`sub`) with stateless authentication, and additional session data (`ctx`) only when present.
+
     Args:
+        session: Session being encoded.
         response (HTTPResponse): Sanic response used to store JWT into a cookie on the client.
+        request (Request): Sanic request parameter. If provided, the client's cookie is left as is until the session
+            requires reissue, see `requires_reissue`.
     """
-    payload = {
-        "id": str(session.id),
-        "date_created": str(session.date_created),
-        "expiration_date": str(session.expiration_date),
-        "ip": session.ip,
-        **session.ctx.__dict__,
-    }
-    cookie = f"{security_config.SANIC_SECURITY_SESSION_PREFIX}_{session.__class__.__name__.lower()[:4]}_session"
+    if request and not requires_reissue(session, request):
+        return
+    payload = {"sid": str(session.id), "iat": int(time.time())}
+    expires_at = _get_timestamp(session.expiration_date)
+    if expires_at:
+        payload["exp"] = int(expires_at)
+    if session.ip:
+        payload["ip"] = session.ip
+    if session.ctx.__dict__:
+        payload["ctx"] = session.ctx.__dict__
+    cookie, session_type = get_session_cookie(session)
+    if security_config.SANIC_SECURITY_STATELESS_AUTHENTICATION and session_type == "auth":
+        bearer_claims = get_bearer_claims(session)
+        if not bearer_claims:
+            logger.warning(
+                f"Bearer of session {session.id} is not loaded, stateless authentication claims were not encoded."
+            )
+        payload.update(bearer_claims)
     encoded_session = jwt.encode(
-        payload, security_config.SANIC_SECURITY_SECRET, security_config.SANIC_SECURITY_SESSION_ENCODING_ALGORITHM
+        payload,
+        keyring.get_signing_key(),
+        keyring.algorithm,
+        headers={"kid": keyring.kid} if keyring.kid else None,
     )
     if isinstance(encoded_session, bytes):
         response.cookies[cookie] = encoded_session.decode()
@@ -135,50 +422,94 @@ def encode(session, response: HTTPResponse) -> None:
         response.cookies[cookie]["domain"] = security_config.SANIC_SECURITY_SESSION_DOMAIN
 
 
-def decode_raw(cls, request: Request) -> dict:
+def decode_raw(cls, request: Request, allow_expired: bool = False) -> dict:
     """
-    Decodes JWT token from client cookie into a python dict.
+    Decodes JWT token from client cookie into a python dict of compact claims, see `encode`. Expired tokens are
+    rejected before any session lookup.
+
+    Decoded tokens are memoized on `request.ctx` for the rest of the request.
 
     Args:
         request (Request): Sanic request parameter.
+        allow_expired (bool): Decodes expired tokens, such as when refreshing a session. These are not memoized.
 
     Returns:
         session_dict
 
     Raises:
         JWTDecodeError
+        ExpiredError
     """
-    if isinstance(cls, type):
-        cookie = request.cookies.get(
-            f"{security_config.SANIC_SECURITY_SESSION_PREFIX}_{cls().__class__.__name__.lower()[:4]}_session"
-        )
-    else:
-        cookie = request.cookies.get(
-            f"{security_config.SANIC_SECURITY_SESSION_PREFIX}_{cls.__class__.__name__.lower()[:4]}_session"
-        )
-
+    cookie_name = get_session_cookie(cls)[0]
+    session_claims = getattr(request.ctx, "session_claims", None)
+    if session_claims is None:
+        session_claims = request.ctx.session_claims = {}
+    elif cookie_name in session_claims:
+        return session_claims[cookie_name]
+    cookie = request.cookies.get(cookie_name)
     try:
         if not cookie:
             raise JWTDecodeError("Session token not provided.")
         else:
-            return jwt.decode(
+            claims = jwt.decode(
                 cookie,
-                security_config.SANIC_SECURITY_SECRET
-                if not security_config.SANIC_SECURITY_PUBLIC_SECRET
-                else security_config.SANIC_SECURITY_PUBLIC_SECRET,
-                security_config.SANIC_SECURITY_SESSION_ENCODING_ALGORITHM,
+                keyring.get_verification_key(
+                    jwt.get_unverified_header(cookie).get("kid") if keyring.has_key_ids else None
+                ),
+                [keyring.algorithm],
+                options={"verify_exp": not allow_expired},
             )
+    except ExpiredSignatureError:
+        raise ExpiredError()
     except DecodeError as e:
         raise JWTDecodeError(str(e))
+    if "sid" not in claims:
+        claims = _get_compact_claims(claims, allow_expired)
+    if not allow_expired:
+        session_claims[cookie_name] = claims
+    return claims
+
+
+def _get_compact_claims(claims: dict, allow_expired: bool = False) -> dict:
+    """
+    Converts the claims of a token encoded before compact payloads were introduced.
+
+    Raises:
+        JWTDecodeError
+        ExpiredError
+    """
+    claims = dict(claims)
+    try:
+        compact_claims = {"sid": claims.pop("id")}
+    except KeyError:
+        raise JWTDecodeError("Session token does not identify a session.")
+    claims.pop("date_created", None)
+    expiration_date = claims.pop("expiration_date", None)
+    if expiration_date and expiration_date != "None":
+        compact_claims["exp"] = int(_get_timestamp(datetime.datetime.fromisoformat(expiration_date)))
+        if not allow_expired and compact_claims["exp"] <= time.time():
+            raise ExpiredError()
+    if "bearer" in claims:
+        compact_claims["sub"] = claims.pop("bearer")
+    for claim in ("iat", "ip", "verified", "disabled", "deleted"):
+        if claim in claims:
+            compact_claims[claim] = claims.pop(claim)
+    if claims:
+        compact_claims["ctx"] = claims
+    return compact_claims
+
 
 #@classmethod
-async def decode(cls, request: Request):
+async def decode(cls, request: Request, decoded_raw: dict = None):
     """
     Decodes session JWT from client cookie to a Sanic Security session.
 
+    Sessions found are held in the session cache, so repeated requests with the same cookie do not look them up again.
+
     Args:
         cls: Class of the session
         request (Request): Sanic request parameter.
+        decoded_raw (dict): Session dict already decoded from the client cookie, if available.
 
     Returns:
         session
@@ -188,11 +519,18 @@ async def decode(cls, request: Request):
         NotFoundError
     """
     try:
-        decoded_raw = decode_raw(cls, request)
+        if decoded_raw is None:
+            decoded_raw = decode_raw(cls, request)
         logger.debug(f'Decoded_Raw: {decoded_raw}')
-        decoded_session, session_bearer = await cls.lookup(id=decoded_raw["id"])
+        cache_key = session_cache.key(cls, decoded_raw["sid"])
+        cached = session_cache.get(cache_key)
+        if cached:
+            return cached
+        decoded_session, session_bearer = await cls.lookup(id=decoded_raw["sid"])
         if not decoded_session:
             raise NotFoundError("Session could not be found.")
+        decoded_session.loaded_bearer = session_bearer
+        session_cache.set(cache_key, (decoded_session, session_bearer))
     except NotFoundError:
         raise NotFoundError("Session could not be found.")
     return decoded_session, session_bearer
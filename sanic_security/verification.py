@@ -4,7 +4,10 @@ from contextlib import suppress
 from sanic import Sanic
 from sanic.request import Request
 
-from sanic_security.exceptions import AccountError, JWTDecodeError, NotFoundError
+from sanic_security.configuration import config as security_config
+from sanic_security.delivery import DeliveryMessage, delivery_queue
+from sanic_security.exceptions import AccountError, ChallengeError, JWTDecodeError, NotFoundError
+from sanic_security.totp import check_totp, generate_totp_secret, get_totp_uri
 from sanic_security.utils import decode
 
 """
@@ -26,18 +29,24 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 
-async def request_two_step_verification(request: Request, account = None):
+async def request_two_step_verification(request: Request, account = None, channel: str = None):
     """
     Creates a two-step session and deactivates the client's current two-step session if found.
 
+    If a transport is registered for the delivery channel, the session code is queued to be delivered to the account
+    in the background, see `delivery_queue`.
+
     Args:
         request (Request): Sanic request parameter. All request bodies are sent as 
                            form-data with the following arguments: email.
         account (Account): The account being associated with the verification session. 
                            If None, an account is retrieved via email in the request form-data.
+        channel (str): Channel the session code is delivered through, either email or sms. If None, the configured
+                           two-step delivery channel is used.
 
     Raises:
         NotFoundError
+        BusyError
 
     Returns:
          two_step_session
@@ -45,13 +54,17 @@ async def request_two_step_verification(request: Request, account = None):
     _orm = Sanic.get_app().ctx.extensions['security']
 
     with suppress(NotFoundError, JWTDecodeError):
-        two_step_session = await decode(_orm.twostep_session, request)
+        two_step_session, _ = await decode(_orm.twostep_session, request)
         if two_step_session.active:
-            two_step_session.active = False
-            await two_step_session.save(update_fields=["active"])
+            await _orm.twostep_session.deactivate(two_step_session)
     if not account:
         account = await _orm.account.lookup(request.form.get("email"))
     two_step_session = await _orm.twostep_session.new(request, account)
+    channel = channel or security_config.SANIC_SECURITY_TWO_STEP_DELIVERY_CHANNEL
+    if delivery_queue.has_transport(channel):
+        delivery_queue.enqueue(
+            DeliveryMessage(channel, account.phone if channel == "sms" else account.email, two_step_session.code)
+        )
     return two_step_session
 
 
@@ -59,6 +72,8 @@ async def two_step_verification(request: Request):
     """
     Validates a two-step verification attempt.
 
+    A successful attempt is memoized on `request.ctx` for the rest of the request.
+
     Args:
         request (Request): Sanic request parameter. All request bodies are sent as form-data with the following arguments: code.
 
@@ -78,10 +93,15 @@ async def two_step_verification(request: Request):
     """
     _orm = Sanic.get_app().ctx.extensions['security']
 
+    two_step_session = getattr(request.ctx, "two_step_session", None)
+    if two_step_session:
+        return two_step_session
+
     two_step_session, bearer = await decode(_orm.twostep_session, request)
     two_step_session.validate()
     bearer.validate()
     await two_step_session.check_code(request, request.form.get("code"))
+    request.ctx.two_step_session = two_step_session
     return two_step_session
 
 
@@ -150,3 +170,88 @@ def requires_two_step_verification():
         return wrapped
 
     return wrapper
+
+
+async def enroll_totp(account) -> str:
+    """
+    Enrolls an account in TOTP two-step verification with a new secret, replacing its current secret if enrolled.
+
+    Args:
+        account (Account): The account being enrolled.
+
+    Returns:
+        totp_uri
+    """
+    secret = generate_totp_secret()
+    await account.set_totp_secret(secret)
+    return get_totp_uri(secret, account.email)
+
+
+async def totp_verification(request: Request, account=None):
+    """
+    Validates a TOTP two-step verification attempt, without a two-step session.
+
+    A successful attempt is memoized on `request.ctx` for the rest of the request.
+
+    Args:
+        request (Request): Sanic request parameter. All request bodies are sent as form-data with the following arguments: code.
+        account (Account): The account being verified. If None, an account is retrieved via email in the request form-data.
+
+    Raises:
+        NotFoundError
+        DeletedError
+        UnverifiedError
+        DisabledError
+        ChallengeError
+        MaxedOutChallengeError
+
+    Returns:
+         account
+    """
+    _orm = Sanic.get_app().ctx.extensions['security']
+
+    totp_account = getattr(request.ctx, "totp_account", None)
+    if totp_account:
+        return totp_account
+
+    if not account:
+        account = await _orm.account.lookup(request.form.get("email"))
+    account.validate()
+    if not account.totp_secret:
+        raise ChallengeError("Account is not enrolled in TOTP two-step verification.")
+    check_totp(account.totp_secret, request.form.get("code"), str(account.pk))
+    request.ctx.totp_account = account
+    return account
+
+
+def requires_totp_verification():
+    """
+    Validates a TOTP two-step verification attempt, the account is retrieved via email in the request form-data.
+
+    Example:
+        This method is not called directly and instead used as a decorator:
+
+            @app.post("api/verification/totp")
+            @requires_totp_verification()
+            async def on_verified(request, account):
+                response = json("TOTP verification attempt successful!", await account.json())
+                return response
+
+    Raises:
+        NotFoundError
+        DeletedError
+        UnverifiedError
+        DisabledError
+        ChallengeError
+        MaxedOutChallengeError
+    """
+
+    def wrapper(func):
+        @functools.wraps(func)
+        async def wrapped(request, *args, **kwargs):
+            account = await totp_verification(request)
+            return await func(request, account, *args, **kwargs)
+
+        return wrapped
+
+    return wrapper
@@ -20,12 +20,20 @@ def logger():
     return logger
 
 
-@pytest.fixture(params=["custom", "tortoise", "umongo"])
+@pytest.fixture(params=["custom", "tortoise", "umongo", "memory", "redis"])
 def app(request, monkeypatch, logger):
 
-    # Use the fixture params to test all our ORM providers
-    monkeypatch.setitem(sanic_security.configuration.DEFAULT_CONFIG, 'SANIC_SECURITY_ORM', request.param)
-    monkeypatch.setenv('SANIC_SECURITY_ORM', request.param)
+    # Use the fixture params to test all our ORM providers, and the Redis session store next to Tortoise
+    orm = "tortoise" if request.param == "redis" else request.param
+    monkeypatch.setitem(sanic_security.configuration.DEFAULT_CONFIG, 'SANIC_SECURITY_ORM', orm)
+    monkeypatch.setenv('SANIC_SECURITY_ORM', orm)
+    if request.param == "redis":
+        monkeypatch.setitem(sanic_security.configuration.DEFAULT_CONFIG, 'SANIC_SECURITY_SESSION_STORE', "redis")
+        monkeypatch.setitem(sanic_security.configuration.DEFAULT_CONFIG, 'SANIC_SECURITY_REDIS_URL', "fake://")
+
+    if request.param == "memory":
+        from sanic_security.orm.memory import store
+        store.clear()
 
     sanic_app = test_app()
     # Hack to do some poor code work in the app for some workarounds for broken fucntions under pytest
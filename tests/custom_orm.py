@@ -15,6 +15,7 @@ from sanic.log import logger
 from sanic.request import Request
 from sanic.response import HTTPResponse
 
+from sanic_security.cache import role_cache, session_cache
 from sanic_security.configuration import config as security_config
 from sanic_security.exceptions import *
 from sanic_security.utils import get_ip, get_code, get_expiration_date
@@ -65,6 +66,7 @@ class BaseMixin():
 
     async def verify(self) -> None:
         self.verified = True
+        session_cache.discard_bearer(self)
 
     async def json(self) -> dict:
         return js.dumps(vars(self))
@@ -88,6 +90,7 @@ class Account(BaseMixin):
         password (str): Password of account for protection. Must be hashed via Argon.
         disabled (bool): Renders the account unusable but available.
         verified (bool): Renders the account unusable until verified via two-step verification or other method.
+        totp_secret (str): Base32 secret enrolled for TOTP two-step verification, None if not enrolled.
         roles (ManyToManyRelation[Role]): Roles associated with this account.
     """
 
@@ -105,6 +108,7 @@ class Account(BaseMixin):
     current_login_ip: str = None
     disabled: bool = False
     verified: bool = True
+    totp_secret: str = None
     roles: list = list([])
 
     def validate(self) -> None:
@@ -123,6 +127,16 @@ class Account(BaseMixin):
         elif self.disabled:
             raise DisabledError()
 
+    async def set_totp_secret(self, secret: str = None) -> None:
+        """
+        Enrolls the account in TOTP two-step verification.
+
+        Args:
+            secret (str): Base32 secret of the account, unenrolls the account if None.
+        """
+        self.totp_secret = secret
+        session_cache.discard_bearer(self)
+
     async def json(self) -> dict:
         _data: dict = dict([])
 
@@ -210,6 +224,19 @@ class Account(BaseMixin):
         return user
 
 
+    @staticmethod
+    async def get_revoked():
+        """
+        Retrieves accounts that can no longer authenticate.
+
+        Returns:
+            account_ids (list)
+        """
+        return [
+            account.id for account in Account.db
+            if account.deleted or account.disabled or not account.verified
+        ]
+
     async def get_roles(self, id = None):
         """
         Returns a list of roles for provided account
@@ -281,6 +308,7 @@ class Account(BaseMixin):
             account.roles.append(role)
         else:
             account.roles = [role]
+        role_cache.bump(str(account.id))
         return account
 
     @staticmethod
@@ -350,6 +378,7 @@ class Session(BaseMixin):
     ip: str = None
     bearer = None
     ctx = SimpleNamespace()
+    purge_field = "expiration_date"
 
     @classmethod
     async def new(cls, request: Request, account: Account, **kwargs):
@@ -415,6 +444,49 @@ class Session(BaseMixin):
         elif not self.active:
             raise DeactivatedError()
 
+    @classmethod
+    async def get_revoked(cls, since: dt.datetime = None):
+        """
+        Retrieves deactivated or deleted sessions that have not yet expired.
+
+        Args:
+            since (datetime): Only retrieve sessions revoked after this time, all revoked sessions if None.
+
+        Returns:
+            revoked_sessions (list of id, expiration_date)
+        """
+        if since:
+            since = since.astimezone(dt.timezone.utc).replace(tzinfo=None)
+        return [
+            (_session.id, _session.expiration_date)
+            for _session in cls.db
+            if (not _session.active or _session.deleted)
+            and (not _session.expiration_date or _session.expiration_date > dt.datetime.utcnow())
+            and (not since or (_session.date_updated and _session.date_updated >= since))
+        ]
+
+    @classmethod
+    async def purge(cls, before: dt.datetime, limit: int) -> int:
+        """
+        Deletes a batch of sessions that can no longer be used since before a date, see `purge_field`.
+
+        Args:
+            before (datetime): Sessions that could no longer be used since before this date are deleted.
+            limit (int): Maximum amount of sessions deleted.
+
+        Returns:
+            purged
+        """
+        before = before.astimezone(dt.timezone.utc).replace(tzinfo=None)
+        purged = [
+            _session
+            for _session in cls.db
+            if getattr(_session, cls.purge_field) and getattr(_session, cls.purge_field) < before
+        ][:limit]
+        for _session in purged:
+            cls.db.remove(_session)
+        return len(purged)
+
     @classmethod
     async def deactivate(cls, session):
         """
@@ -432,10 +504,12 @@ class Session(BaseMixin):
         """
         try:
             session.active = False
+            session.date_updated = dt.datetime.utcnow()
             if not session.id:
                 raise NotFoundError
         except NotFoundError:
             raise NotFoundError("Session could not be found.")
+        session_cache.discard(session)
         return session
 
     async def json(self) -> dict:
@@ -485,25 +559,32 @@ class VerificationSession(Session, BaseMixin):
         """
         Checks if code passed is equivalent to the session code.
 
+        Attempts are counted and the session deactivated with conditional updates, so concurrent attempts can't exceed
+        the maximum amount of attempts or use the session twice. Once maxed out, the session code is no longer accepted.
+
         Args:
             code (str): Code being cross-checked with session code.
             request (Request): Sanic request parameter.
 
         Raises:
             ChallengeError
+            DeactivatedError
             MaxedOutChallengeError
         """
-        if self.code != code:
-            if self.attempts < security_config.SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS:
+        session_cache.discard(self)
+        if self.attempts < security_config.SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS:
+            if self.code != code:
                 self.attempts += 1
                 raise ChallengeError("The value provided does not match.")
-            else:
-                logger.warning(
-                    f"Client ({self.bearer.pk}/{get_ip(request)}) has maxed out on session challenge attempts"
-                )
-                raise MaxedOutChallengeError()
-        else:
-            self.active = False
+            elif self.active:
+                self.active = False
+                self.date_updated = dt.datetime.utcnow()
+                return
+            raise DeactivatedError("Session has already been used.")
+        logger.warning(
+            f"Client ({self.bearer}/{get_ip(request)}) has maxed out on session challenge attempts"
+        )
+        raise MaxedOutChallengeError()
 
     class Meta:
         abstract = True
@@ -515,6 +596,7 @@ class TwoStepSession(VerificationSession):
     Validates a client using a code sent via email or text.
     """
 
+    session_type = "twos"
     db: list = list([])
 
     @classmethod
@@ -541,6 +623,7 @@ class CaptchaSession(VerificationSession, Session):
     Validates a client with a captcha challenge.
     """
 
+    session_type = "capt"
     db: list = list([])
 
     @classmethod
@@ -568,7 +651,10 @@ class AuthenticationSession(VerificationSession, Session, BaseMixin):
     Used to authenticate and identify a client.
     """
 
+    session_type = "auth"
     db: list = []
+    family: str = None
+    purge_field = "refresh_expiration_date"
 
     @classmethod
     async def new(cls, request: Request, account: Account, **kwargs):
@@ -589,6 +675,24 @@ class AuthenticationSession(VerificationSession, Session, BaseMixin):
         #Session.db.append(new_auth_session)
         cls.db.append(new_auth_session)
         return new_auth_session
+
+    @classmethod
+    async def deactivate_family(cls, family: str):
+        """
+        Deactivates every active session refreshed from the same session.
+
+        Args:
+            family (str): Identifier of the session first created on login.
+
+        Returns:
+            deactivated_sessions (list of id, expiration_date)
+        """
+        deactivated_sessions = []
+        for _session in cls.db:
+            if _session.family == family and _session.active:
+                await cls.deactivate(_session)
+                deactivated_sessions.append((_session.id, _session.expiration_date))
+        return deactivated_sessions
     
     class Meta:
         abstract = True
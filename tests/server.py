@@ -12,6 +12,7 @@ from sanic_security.authentication import (
     register,
     requires_authentication,
     logout,
+    refresh,
     create_initial_admin_account,
 )
 from sanic_security.authorization import (
@@ -19,12 +20,14 @@ from sanic_security.authorization import (
     check_permissions,
     check_roles,
 )
-from sanic_security.captcha import request_captcha, requires_captcha
+from sanic_security.captcha import decode_captcha, request_captcha, requires_captcha
 from sanic_security.configuration import config as security_config
 from sanic_security.exceptions import SecurityError, IntegrityError
 from sanic_security.utils import json, get_image, encode, decode
 from sanic_security.verification import (
+    enroll_totp,
     request_two_step_verification,
+    requires_totp_verification,
     requires_two_step_verification,
     verify_account,
 )
@@ -144,6 +147,17 @@ def make_app():
         return response
 
 
+    @app.post("api/test/auth/refresh")
+    async def on_refresh(request):
+        """
+        Refresh client authentication session without reauthenticating.
+        """
+        authentication_session = await refresh(request)
+        response = json("Refresh successful!", await authentication_session.json())
+        encode(authentication_session, response)
+        return response
+
+
     @app.post("api/test/auth/logout")
     async def on_logout(request):
         """
@@ -161,7 +175,7 @@ def make_app():
         Check if current authentication session is valid.
         """
         response = json("Authenticated!", await authentication_session.json())
-        encode(authentication_session, response)
+        encode(authentication_session, response, request)
         return response
 
 
@@ -181,8 +195,8 @@ def make_app():
         """
         Request captcha image.
         """
-        captcha_session = await decode(_orm.captcha_session, request)
-        response = get_image()
+        captcha_session = await decode_captcha(request)
+        response = await get_image(captcha_session, request)
         encode(captcha_session, response)
         return response
 
@@ -218,6 +232,24 @@ def make_app():
         #return json("Two step verification attempt successful!", two_step_session)
 
 
+    @app.post("api/test/totp/enroll")
+    async def on_totp_enroll(request):
+        """
+        Enroll account in TOTP two-step verification with provisioning URI in the response.
+        """
+        account = await _orm.account.lookup(request.form.get("email"))
+        return json("TOTP enrollment successful!", await enroll_totp(account))
+
+
+    @app.post("api/test/totp")
+    @requires_totp_verification()
+    async def on_totp_attempt(request, account):
+        """
+        Attempt TOTP two-step verification.
+        """
+        return json("TOTP verification attempt successful!", str(account.pk))
+
+
     @app.post("api/test/auth/roles")
     @requires_authentication()
     async def on_authorization(request, authentication_session):
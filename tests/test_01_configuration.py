@@ -3,7 +3,14 @@ import pytest
 
 from sanic import Sanic
 
+from sanic_security import utils
 from sanic_security.configuration import Config
+from sanic_security.orm.backend import (
+    AccountBackend,
+    SessionBackend,
+    VerificationSessionBackend,
+    validate_backend,
+)
 
 """
 An effective, simple, and async security library for the Sanic framework.
@@ -42,3 +49,38 @@ class TestConfiguration:
         assert 'SECRET' not in app.config
         app.config.update_config(security_config)
         assert app.config.SANIC_SECURITY_SECRET == 'test-secret'
+
+    def test_session_cookie_registry(self, app: Sanic, monkeypatch):
+        """
+        Session cookie names are resolved from the registry and colliding session models are rejected.
+        """
+        monkeypatch.setattr(utils, "_session_cookies", {})
+        _orm = app.ctx.extensions["security"]
+        utils.register_session_cookies(_orm.authentication_session, _orm.captcha_session)
+        assert utils.get_session_cookie(_orm.authentication_session)[0] == "token_auth_session"
+        assert utils.get_session_cookie(_orm.captcha_session) == ("token_capt_session", "capt")
+
+        class AuthenticationAudit:
+            session_type = "auth"
+
+        with pytest.raises(ValueError):
+            utils.register_session_cookies(_orm.authentication_session, AuthenticationAudit)
+
+    def test_backend_protocols(self, app: Sanic):
+        """
+        Models implement their backend protocol and models missing methods are rejected.
+        """
+        _orm = app.ctx.extensions["security"]
+        assert isinstance(_orm.account, AccountBackend)
+        assert isinstance(_orm.twostep_session, VerificationSessionBackend)
+        validate_backend(_orm.authentication_session, SessionBackend)
+
+        class TwoStepAudit:
+            async def new(self, request, account, **kwargs):
+                pass
+
+            async def lookup(self, id=None):
+                pass
+
+        with pytest.raises(TypeError, match="deactivate, check_code|check_code, deactivate"):
+            validate_backend(TwoStepAudit, VerificationSessionBackend)
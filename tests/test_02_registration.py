@@ -60,6 +60,8 @@ class TestRegistration:
                 _client, "emailpass1@register.com", "emailpass1", False, True, rand_phone,
             )
             assert registration_response.status == 200, registration_response.text
+            if app.ctx.extensions["security"].orm != "custom":
+                assert "password" not in registration_response.text
 
     def test_invalid_registration(self, app: Sanic, rand_phone):
         """
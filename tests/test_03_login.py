@@ -1,8 +1,21 @@
+import asyncio
+import time
+
+import jwt
 import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
 
 from sanic import Sanic
 from sanic_testing.reusable import ReusableClient
 
+from sanic_security.authentication import refresh_revoked_sessions
+from sanic_security.cache import session_cache
+from sanic_security.configuration import config as security_config
+from sanic_security.executor import executor
+from sanic_security.keyring import keyring
+from sanic_security.orm.backend import deactivate_many, get_roles_many, lookup_many
+
 """
 An effective, simple, and async security library for the Sanic framework.
 Copyright (C) 2020-present Aidan Stewart
@@ -117,6 +130,504 @@ class TestLogin:
             )
             assert authenticate_response.status == 401, authenticate_response.text
 
+    def test_stateless_authentication(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Authenticate from JWT claims without a session lookup and attempt to authenticate after logout.
+        """
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_STATELESS_AUTHENTICATION", True)
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _orm = app.ctx.extensions["security"]
+            _client.post(
+                "/api/test/account",
+                data={"email": "stateless@login.com", "username": "stateless", "phone": rand_phone},
+            )
+            _client.post(
+                "/api/test/auth/login",
+                auth=("stateless@login.com", "testtest"),
+            )
+            lookup = _orm.authentication_session.lookup
+
+            async def failing_lookup(*args, **kwargs):
+                raise AssertionError("Session lookup during stateless authentication.")
+
+            monkeypatch.setattr(_orm.authentication_session, "lookup", failing_lookup)
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 200, authenticate_response.text
+            monkeypatch.setattr(_orm.authentication_session, "lookup", lookup)
+            logout_request, logout_response = _client.post("/api/test/auth/logout")
+            assert logout_response.status == 200, logout_response.text
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 401, authenticate_response.text
+
+    def test_stateless_authentication_revocation(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Attempt stateless authentication with a session deactivated outside of this process, before and after revoked
+        sessions are refreshed.
+        """
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_STATELESS_AUTHENTICATION", True)
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _orm = app.ctx.extensions["security"]
+            _client.post(
+                "/api/test/account",
+                data={"email": "revoked@login.com", "username": "revoked", "phone": rand_phone},
+            )
+            login_request, login_response = _client.post(
+                "/api/test/auth/login",
+                auth=("revoked@login.com", "testtest"),
+            )
+            session_id = jwt.decode(
+                login_response.cookies.get("token_auth_session"), options={"verify_signature": False}
+            )["sid"]
+            authentication_session, _ = _client._run(_orm.authentication_session.lookup(id=session_id))
+            _client._run(_orm.authentication_session.deactivate(authentication_session))
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 200, authenticate_response.text
+            _client._run(refresh_revoked_sessions())
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 401, authenticate_response.text
+
+    def test_session_cache(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Authenticate repeatedly from the session cache, then logout and attempt authentication with the discarded session.
+        """
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _orm = app.ctx.extensions["security"]
+            _client.post(
+                "/api/test/account",
+                data={"email": "cached@login.com", "username": "cached", "phone": rand_phone},
+            )
+            _client.post(
+                "/api/test/auth/login",
+                auth=("cached@login.com", "testtest"),
+            )
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 200, authenticate_response.text
+            lookup = _orm.authentication_session.lookup
+
+            async def failing_lookup(*args, **kwargs):
+                raise AssertionError("Session lookup with a cached session.")
+
+            monkeypatch.setattr(_orm.authentication_session, "lookup", failing_lookup)
+            hits = session_cache.hits
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 200, authenticate_response.text
+            assert session_cache.hits == hits + 1
+            monkeypatch.setattr(_orm.authentication_session, "lookup", lookup)
+            logout_request, logout_response = _client.post("/api/test/auth/logout")
+            assert logout_response.status == 200, logout_response.text
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 401, authenticate_response.text
+
+    def test_login_busy(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Login while the password hashing executor queue is full.
+        """
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _client.post(
+                "/api/test/account",
+                data={"email": "busy@login.com", "username": "busy", "phone": rand_phone},
+            )
+            monkeypatch.setattr(executor, "pending", executor.limit)
+            login_request, login_response = _client.post(
+                "/api/test/auth/login",
+                auth=("busy@login.com", "testtest"),
+            )
+            assert login_response.status == 503, login_response.text
+            monkeypatch.setattr(executor, "pending", 0)
+            login_request, login_response = _client.post(
+                "/api/test/auth/login",
+                auth=("busy@login.com", "testtest"),
+            )
+            assert login_response.status == 200, login_response.text
+
+    def test_key_rotation(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Authenticate with a session signed by a previous key after rotation, without and with the previous key listed.
+        """
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _client.post(
+                "/api/test/account",
+                data={"email": "rotation@login.com", "username": "rotation", "phone": rand_phone},
+            )
+            monkeypatch.setattr(security_config, "SANIC_SECURITY_KEY_ID", "previous")
+            _client.post(
+                "/api/test/auth/login",
+                auth=("rotation@login.com", "testtest"),
+            )
+            previous_public_secret = security_config.SANIC_SECURITY_PUBLIC_SECRET
+            private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            monkeypatch.setattr(
+                security_config,
+                "SANIC_SECURITY_SECRET",
+                private_key.private_bytes(
+                    serialization.Encoding.PEM,
+                    serialization.PrivateFormat.PKCS8,
+                    serialization.NoEncryption(),
+                ),
+            )
+            monkeypatch.setattr(
+                security_config,
+                "SANIC_SECURITY_PUBLIC_SECRET",
+                private_key.public_key().public_bytes(
+                    serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+                ),
+            )
+            monkeypatch.setattr(security_config, "SANIC_SECURITY_KEY_ID", "current")
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 400, authenticate_response.text
+            monkeypatch.setattr(
+                security_config, "SANIC_SECURITY_VERIFICATION_KEYS", {"previous": previous_public_secret}
+            )
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 200, authenticate_response.text
+
+    def test_session_reissue(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Authenticate without reissuing the session cookie, then once past the reissue threshold.
+        """
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _client.post(
+                "/api/test/account",
+                data={"email": "reissue@login.com", "username": "reissue", "phone": rand_phone},
+            )
+            monkeypatch.setattr(security_config, "SANIC_SECURITY_SESSION_REISSUE_THRESHOLD", 0.5)
+            login_request, login_response = _client.post(
+                "/api/test/auth/login",
+                auth=("reissue@login.com", "testtest"),
+            )
+            assert "token_auth_session" in login_response.cookies
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 200, authenticate_response.text
+            assert "token_auth_session" not in authenticate_response.cookies
+            now = time.time()
+            monkeypatch.setattr(
+                time,
+                "time",
+                lambda: now + security_config.SANIC_SECURITY_AUTHENTICATION_SESSION_EXPIRATION * 0.6,
+            )
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 200, authenticate_response.text
+            assert "token_auth_session" in authenticate_response.cookies
+
+    def test_session_claims(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Authenticate with a compact and a legacy session token, then attempt authentication with an expired token.
+        """
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _orm = app.ctx.extensions["security"]
+            _client.post(
+                "/api/test/account",
+                data={"email": "claims@login.com", "username": "claims", "phone": rand_phone},
+            )
+            login_request, login_response = _client.post(
+                "/api/test/auth/login",
+                auth=("claims@login.com", "testtest"),
+            )
+            claims = jwt.decode(
+                login_response.cookies.get("token_auth_session"), options={"verify_signature": False}
+            )
+            assert {"sid", "iat", "exp"} <= claims.keys()
+            assert "id" not in claims and "date_created" not in claims
+            legacy_token = jwt.encode(
+                {
+                    "id": claims["sid"],
+                    "date_created": "2020-01-01 00:00:00",
+                    "expiration_date": "None",
+                    "ip": claims["ip"],
+                },
+                keyring.get_signing_key(),
+                keyring.algorithm,
+            )
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth", cookies={"token_auth_session": legacy_token}
+            )
+            assert authenticate_response.status == 200, authenticate_response.text
+
+            async def failing_lookup(*args, **kwargs):
+                raise AssertionError("Session lookup with an expired token.")
+
+            monkeypatch.setattr(_orm.authentication_session, "lookup", failing_lookup)
+            expired_token = jwt.encode(
+                {**claims, "exp": int(time.time()) - 1}, keyring.get_signing_key(), keyring.algorithm
+            )
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth", cookies={"token_auth_session": expired_token}
+            )
+            assert authenticate_response.status == 401, authenticate_response.text
+
+    def test_refresh(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Refresh an expired session, then attempt to refresh the replaced session again.
+        """
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _client.post(
+                "/api/test/account",
+                data={"email": "refresh@login.com", "username": "refresh", "phone": rand_phone},
+            )
+            with monkeypatch.context() as expiring:
+                expiring.setattr(security_config, "SANIC_SECURITY_AUTHENTICATION_SESSION_EXPIRATION", 1)
+                login_request, login_response = _client.post(
+                    "/api/test/auth/login",
+                    auth=("refresh@login.com", "testtest"),
+                )
+            refreshed_token = login_response.cookies.get("token_auth_session")
+            time.sleep(1.1)
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 401, authenticate_response.text
+            refresh_request, refresh_response = _client.post(
+                "/api/test/auth/refresh",
+            )
+            assert refresh_response.status == 200, refresh_response.text
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 200, authenticate_response.text
+            reused_refresh_request, reused_refresh_response = _client.post(
+                "/api/test/auth/refresh", cookies={"token_auth_session": refreshed_token}
+            )
+            assert reused_refresh_response.status == 401, reused_refresh_response.text
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 401, authenticate_response.text
+
+    def test_purge_sessions(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Purge sessions in batches, then attempt authentication with a purged session.
+        """
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _orm = app.ctx.extensions["security"]
+            _client.post(
+                "/api/test/account",
+                data={"email": "purge@login.com", "username": "purge", "phone": rand_phone},
+            )
+            for i in range(2):
+                login_request, login_response = _client.post(
+                    "/api/test/auth/login",
+                    auth=("purge@login.com", "testtest"),
+                )
+                assert login_response.status == 200, login_response.text
+            assert _client._run(_orm.purge_sessions()) == 0
+            monkeypatch.setattr(
+                security_config,
+                "SANIC_SECURITY_SESSION_PURGE_RETENTION",
+                -security_config.SANIC_SECURITY_AUTHENTICATION_SESSION_EXPIRATION * 3,
+            )
+            monkeypatch.setattr(security_config, "SANIC_SECURITY_SESSION_PURGE_BATCH_SIZE", 1)
+            assert _client._run(_orm.purge_sessions()) >= 2
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+            )
+            assert authenticate_response.status == 404, authenticate_response.text
+            if _orm.orm == "umongo":
+                monkeypatch.setattr(security_config, "SANIC_SECURITY_SESSION_PURGE_RETENTION", 60)
+                _client._run(_orm._ensure_ttl_indexes())
+                index_information = _client._run(
+                    _orm.authentication_session.collection.index_information()
+                )
+                assert any(
+                    index.get("expireAfterSeconds") == 60 and index["key"][0][0] == "refresh_expiration_date"
+                    for index in index_information.values()
+                )
+
+    def test_session_lookup_queries(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Look up an authentication session and its bearer in a single query.
+        """
+        if app.ctx.extensions["security"].orm != "tortoise" or app.ctx.extensions["security"].session_store:
+            pytest.skip("Query count only applies to Tortoise.")
+        from tortoise import Tortoise
+
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _orm = app.ctx.extensions["security"]
+            _client.post(
+                "/api/test/account",
+                data={"email": "queries@login.com", "username": "queries", "phone": rand_phone},
+            )
+            login_request, login_response = _client.post(
+                "/api/test/auth/login",
+                auth=("queries@login.com", "testtest"),
+            )
+            session_id = jwt.decode(
+                login_response.cookies.get("token_auth_session"), options={"verify_signature": False}
+            )["sid"]
+            connection = Tortoise.get_connection("default")
+            execute_query = connection.execute_query
+            queries = []
+
+            async def counted_execute_query(query, *args, **kwargs):
+                queries.append(query)
+                return await execute_query(query, *args, **kwargs)
+
+            monkeypatch.setattr(connection, "execute_query", counted_execute_query)
+            authentication_session, bearer = _client._run(_orm.authentication_session.lookup(id=session_id))
+            assert len(queries) == 1, queries
+            assert bearer.email == "queries@login.com"
+            queries.clear()
+            authentication_session, bearer = _client._run(
+                _orm.authentication_session.lookup(id=session_id, roles=True)
+            )
+            assert len(queries) == 2, queries
+
+    def test_memory_snapshot(self, app: Sanic, rand_phone, monkeypatch, tmp_path):
+        """
+        Authenticate with a session restored from a memory ORM snapshot after a restart.
+        """
+        if app.ctx.extensions["security"].orm != "memory":
+            pytest.skip("Snapshots only apply to the memory ORM.")
+        from sanic_security.orm.memory import store
+
+        _orm = app.ctx.extensions["security"]
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_MEMORY_SNAPSHOT_PATH", str(tmp_path / "security.json"))
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _client.post(
+                "/api/test/account",
+                data={"email": "snapshot@login.com", "username": "snapshot", "phone": rand_phone},
+            )
+            login_request, login_response = _client.post(
+                "/api/test/auth/login",
+                auth=("snapshot@login.com", "testtest"),
+            )
+            assert login_response.status == 200, login_response.text
+        assert (tmp_path / "security.json").is_file()
+        store.clear()
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            authenticate_request, authenticate_response = _client.post(
+                "/api/test/auth",
+                cookies={"token_auth_session": login_response.cookies.get("token_auth_session")},
+            )
+            assert authenticate_response.status == 200, authenticate_response.text
+            bearer = _client._run(_orm.account.lookup(email="snapshot@login.com"))
+            assert authenticate_response.json["data"]["bearer"] == bearer.id
+
+    def test_redis_session_store(self, app: Sanic, rand_phone):
+        """
+        Store sessions through the Redis protocol client, with a server speaking RESP backed by the Redis stand-in.
+        """
+        _orm = app.ctx.extensions["security"]
+        if _orm.session_store != "redis":
+            pytest.skip("Only applies to the Redis session store.")
+        from sanic_security.orm import redis
+
+        async def serve(reader, writer):
+            while line := await reader.readline():
+                command = []
+                for _ in range(int(line[1:])):
+                    length = int((await reader.readline())[1:])
+                    command.append((await reader.readexactly(length + 2))[:-2].decode())
+                try:
+                    reply = (await fake_redis.pipeline(command))[0]
+                except redis.RedisError as e:
+                    writer.write(b"-%s\r\n" % str(e).encode())
+                    continue
+                if isinstance(reply, int):
+                    writer.write(b":%d\r\n" % reply)
+                elif isinstance(reply, list):
+                    writer.write(b"*%d\r\n" % len(reply))
+                    writer.writelines(b"$%d\r\n%s\r\n" % (len(item), item.encode()) for item in reply)
+                else:
+                    writer.write(b"$-1\r\n" if reply is None else b"$%d\r\n%s\r\n" % (len(reply), reply.encode()))
+
+        fake_redis = redis.FakeRedis()
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            server = _client._run(asyncio.start_server(serve, "127.0.0.1", 0))
+            redis.connect(f"redis://127.0.0.1:{server.sockets[0].getsockname()[1]}/0")
+            _client.post(
+                "/api/test/account",
+                data={"email": "redis@login.com", "username": "redis", "phone": rand_phone},
+            )
+            login_request, login_response = _client.post(
+                "/api/test/auth/login",
+                auth=("redis@login.com", "testtest"),
+            )
+            assert login_response.status == 200, login_response.text
+            assert any(key.startswith("sanic_security:auth:") for key in fake_redis._data)
+            authenticate_request, authenticate_response = _client.post("/api/test/auth")
+            assert authenticate_response.status == 200, authenticate_response.text
+            logout_request, logout_response = _client.post("/api/test/auth/logout")
+            assert logout_response.status == 200, logout_response.text
+            authenticate_request, authenticate_response = _client.post("/api/test/auth")
+            assert authenticate_response.status == 401, authenticate_response.text
+            with pytest.raises(redis.RedisError):
+                _client._run(redis.client.pipeline(("PING",), ("UNKNOWN",)))
+            assert _client._run(redis.client.execute("PING")) == "PONG"
+            _client._run(redis.client.close())
+            server.close()
+
+    def test_batch_operations(self, app: Sanic, rand_phone):
+        """
+        Look up accounts, sessions and roles, and deactivate sessions, in batches.
+        """
+        _orm = app.ctx.extensions["security"]
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            session_cookies = []
+            for i in range(2):
+                _client.post(
+                    "/api/test/account",
+                    data={"email": f"batch{i}@login.com", "username": f"batch{i}", "phone": f"{rand_phone[:-1]}{i}"},
+                )
+                login_request, login_response = _client.post(
+                    "/api/test/auth/login",
+                    auth=(f"batch{i}@login.com", "testtest"),
+                )
+                assert login_response.status == 200, login_response.text
+                session_cookies.append(login_response.cookies.get("token_auth_session"))
+            accounts = [_client._run(_orm.account.lookup(email=f"batch{i}@login.com")) for i in range(2)]
+            account_ids = [str(account.id) for account in accounts]
+            assert {str(account.id) for account in _client._run(lookup_many(_orm.account, account_ids))} == set(account_ids)
+            assert set(_client._run(get_roles_many(_orm.account, account_ids))) == set(account_ids)
+            session_ids = [
+                jwt.decode(cookie, options={"verify_signature": False})["sid"] for cookie in session_cookies
+            ]
+            sessions = _client._run(lookup_many(_orm.authentication_session, session_ids))
+            assert {str(session.id) for session, bearer in sessions} == set(session_ids)
+            assert {str(bearer.id) for session, bearer in sessions} == set(account_ids)
+            _client._run(deactivate_many(_orm.authentication_session, [session for session, bearer in sessions]))
+            for cookie in session_cookies:
+                authenticate_request, authenticate_response = _client.post(
+                    "/api/test/auth",
+                    cookies={"token_auth_session": cookie},
+                )
+                assert authenticate_response.status == 401, authenticate_response.text
+
     def test_initial_admin_login(self, app: Sanic, rand_phone):
         """
         Initial admin account login and authorization.
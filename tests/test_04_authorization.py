@@ -3,6 +3,9 @@ import pytest
 from sanic import Sanic
 from sanic_testing.reusable import ReusableClient
 
+from sanic_security.cache import session_cache
+from sanic_security.configuration import config as security_config
+
 """
 An effective, simple, and async security library for the Sanic framework.
 Copyright (C) 2020-present Aidan Stewart
@@ -70,6 +73,39 @@ class TestAuthorization:
                 prohibited_authorization_response.status == 403
             ), prohibited_authorization_response.text
 
+    def test_permissions_any_of_authorization(self, app: Sanic, rand_phone):
+        """
+        Authorization with any of the required permissions, in any order relative to the role's permissions.
+        """
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _client.post(
+                "/api/test/account",
+                data={"email": "anyof@authorization.com", "username": "anyof", "phone": rand_phone},
+            )
+            _client.post(
+                "/api/test/auth/login",
+                auth=("anyof@authorization.com", "testtest"),
+            )
+            _client.post(
+                "/api/test/auth/roles/assign",
+                data={"name": "AuthTestAnyOf", "permissions": "perm5:read, perm6:*"},
+            )
+            permitted_authorization_request, permitted_authorization_response = _client.post(
+                "/api/test/auth/roles",
+                data={"role": "AuthTestAnyOf", "permissions_required": "perm7:read, perm6:write,delete"},
+            )
+            assert (
+                permitted_authorization_response.status == 200
+            ), permitted_authorization_response.text
+            prohibited_authorization_request, prohibited_authorization_response = _client.post(
+                "/api/test/auth/roles",
+                data={"role": "AuthTestAnyOf", "permissions_required": "perm7:read, perm5:read,write"},
+            )
+            assert (
+                prohibited_authorization_response.status == 403
+            ), prohibited_authorization_response.text
+
     def test_roles_authorization(self, app: Sanic, rand_phone):
         """
         Authorization with roles.
@@ -102,3 +138,163 @@ class TestAuthorization:
             assert (
                 prohibited_authorization_response.status == 403
             ), prohibited_authorization_response.text
+
+    def test_stateless_roles_authorization(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Authorization with roles and permissions while authenticating statelessly.
+        """
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_STATELESS_AUTHENTICATION", True)
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _client.post(
+                "/api/test/account",
+                data={"email": "stateless@authorization.com", "username": "stateless_roles", "phone": rand_phone},
+            )
+            _client.post(
+                "/api/test/auth/login",
+                auth=("stateless@authorization.com", "testtest"),
+            )
+            assign_request, assign_response = _client.post(
+                "/api/test/auth/roles/assign",
+                data={"name": "AuthTestStateless", "permissions": "perm3:read"},
+            )
+            assert assign_response.status == 200, assign_response.text
+            permitted_authorization_request, permitted_authorization_response = _client.post(
+                "/api/test/auth/roles",
+                data={"role": "AuthTestStateless", "permissions_required": "perm3:read"},
+            )
+            assert (
+                permitted_authorization_response.status == 200
+            ), permitted_authorization_response.text
+            prohibited_authorization_request, prohibited_authorization_response = _client.post(
+                "/api/test/auth/roles",
+                data={"role": "InvalidRole"},
+            )
+            assert (
+                prohibited_authorization_response.status == 403
+            ), prohibited_authorization_response.text
+
+    def test_stacked_authorization(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Authorization with roles and permissions checked after authentication, looking the session and roles up once.
+        """
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _orm = app.ctx.extensions["security"]
+            monkeypatch.setattr(session_cache, "ttl", 0)
+            _client.post(
+                "/api/test/account",
+                data={"email": "stacked@authorization.com", "username": "stacked", "phone": rand_phone},
+            )
+            _client.post(
+                "/api/test/auth/login",
+                auth=("stacked@authorization.com", "testtest"),
+            )
+            _client.post(
+                "/api/test/auth/roles/assign",
+                data={"name": "AuthTestStacked", "permissions": "perm4:read"},
+            )
+            lookups = []
+            lookup, get_roles = _orm.authentication_session.lookup, _orm.account.get_roles
+
+            async def counted_lookup(*args, **kwargs):
+                lookups.append("session")
+                return await lookup(*args, **kwargs)
+
+            async def counted_get_roles(*args, **kwargs):
+                lookups.append("roles")
+                return await get_roles(*args, **kwargs)
+
+            monkeypatch.setattr(_orm.authentication_session, "lookup", counted_lookup)
+            monkeypatch.setattr(_orm.account, "get_roles", counted_get_roles)
+            permitted_authorization_request, permitted_authorization_response = _client.post(
+                "/api/test/auth/roles",
+                data={"role": "AuthTestStacked", "permissions_required": "perm4:read"},
+            )
+            assert (
+                permitted_authorization_response.status == 200
+            ), permitted_authorization_response.text
+            assert lookups == ["session", "roles"]
+
+    def test_role_cache(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Authorization with cached roles, then with a role assigned after they were cached.
+        """
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _orm = app.ctx.extensions["security"]
+            _client.post(
+                "/api/test/account",
+                data={"email": "cached@authorization.com", "username": "cached_roles", "phone": rand_phone},
+            )
+            _client.post(
+                "/api/test/auth/login",
+                auth=("cached@authorization.com", "testtest"),
+            )
+            _client.post(
+                "/api/test/auth/roles/assign",
+                data={"name": "AuthTestCached", "permissions": "perm8:read"},
+            )
+            permitted_authorization_request, permitted_authorization_response = _client.post(
+                "/api/test/auth/roles",
+                data={"role": "AuthTestCached", "permissions_required": "perm8:read"},
+            )
+            assert (
+                permitted_authorization_response.status == 200
+            ), permitted_authorization_response.text
+            get_roles = _orm.account.get_roles
+
+            async def failing_get_roles(*args, **kwargs):
+                raise AssertionError("Roles lookup with cached roles.")
+
+            monkeypatch.setattr(_orm.account, "get_roles", failing_get_roles)
+            permitted_authorization_request, permitted_authorization_response = _client.post(
+                "/api/test/auth/roles",
+                data={"role": "AuthTestCached", "permissions_required": "perm8:read"},
+            )
+            assert (
+                permitted_authorization_response.status == 200
+            ), permitted_authorization_response.text
+            monkeypatch.setattr(_orm.account, "get_roles", get_roles)
+            _client.post(
+                "/api/test/auth/roles/assign",
+                data={"name": "AuthTestCachedAssigned", "permissions": "perm9:read"},
+            )
+            permitted_authorization_request, permitted_authorization_response = _client.post(
+                "/api/test/auth/roles",
+                data={"role": "AuthTestCachedAssigned", "permissions_required": "perm9:read"},
+            )
+            assert (
+                permitted_authorization_response.status == 200
+            ), permitted_authorization_response.text
+
+    def test_role_snapshots_authorization(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Authorization with roles and permissions read from role snapshots, where supported.
+        """
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_ROLE_SNAPSHOTS", True)
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _orm = app.ctx.extensions["security"]
+            _client.post(
+                "/api/test/account",
+                data={"email": "snapshots@authorization.com", "username": "snapshots", "phone": rand_phone},
+            )
+            _client.post(
+                "/api/test/auth/login",
+                auth=("snapshots@authorization.com", "testtest"),
+            )
+            _client.post(
+                "/api/test/auth/roles/assign",
+                data={"name": "AuthTestSnapshot", "permissions": "perm10:read"},
+            )
+            account = _client._run(_orm.account.lookup(email="snapshots@authorization.com"))
+            if hasattr(account, "role_snapshots"):
+                assert [role.name for role in account.role_snapshots] == ["AuthTestSnapshot"]
+            permitted_authorization_request, permitted_authorization_response = _client.post(
+                "/api/test/auth/roles",
+                data={"role": "AuthTestSnapshot", "permissions_required": "perm10:read"},
+            )
+            assert (
+                permitted_authorization_response.status == 200
+            ), permitted_authorization_response.text
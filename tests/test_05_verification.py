@@ -1,9 +1,20 @@
+import asyncio
 import pytest
 import json
+import time
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
 
 from sanic import Sanic
 from sanic_testing.reusable import ReusableClient
 
+from sanic_security.captcha import captcha_pool
+from sanic_security.configuration import config as security_config
+from sanic_security.delivery import MemoryTransport, delivery_queue
+from sanic_security.totp import get_totp
+
 """
 An effective, simple, and async security library for the Sanic framework.
 Copyright (C) 2020-present Aidan Stewart
@@ -49,6 +60,128 @@ class TestVerification:
                 captcha_attempt_response.status == 200
             ), captcha_attempt_response.text
 
+    def test_captcha_pool(self, app: Sanic, monkeypatch):
+        """
+        Captcha request and attempt with a pre-rendered captcha, then retrieve its image.
+        """
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_CAPTCHA_POOL_SIZE", 2)
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_CAPTCHA_POOL_LOW_WATERMARK", 1)
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_CAPTCHA_POOL_REFILL_RATE", 0)
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            for _ in range(100):
+                if len(captcha_pool) == 2:
+                    break
+                _client._run(asyncio.sleep(0.05))
+            code, image = captcha_pool._captchas[0]
+            captcha_request_request, captcha_request_response = _client.get(
+                "/api/test/capt/request"
+            )
+            assert (
+                json.loads(captcha_request_response.text)["data"] == code
+            ), captcha_request_response.text
+            captcha_image_request, captcha_image_response = _client.get(
+                "/api/test/capt/image"
+            )
+            assert captcha_image_response.status == 200, captcha_image_response.text
+            assert captcha_image_response.content == image
+            captcha_request_request, captcha_attempt_response = _client.post(
+                "/api/test/capt",
+                data={"captcha": code},
+            )
+            assert (
+                captcha_attempt_response.status == 200
+            ), captcha_attempt_response.text
+
+    def test_captcha_image(self, app: Sanic, monkeypatch):
+        """
+        Captcha image request, then while the maximum amount of captchas are being rendered.
+        """
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _client.get("/api/test/capt/request")
+            captcha_image_request, captcha_image_response = _client.get(
+                "/api/test/capt/image"
+            )
+            assert captcha_image_response.status == 200, captcha_image_response.text
+            assert captcha_image_response.headers["content-type"] == "image/jpeg"
+            monkeypatch.setattr(security_config, "SANIC_SECURITY_CAPTCHA_RENDER_LIMIT", 0)
+            captcha_image_request, captcha_image_response = _client.get(
+                "/api/test/capt/image"
+            )
+            assert captcha_image_response.status == 503, captcha_image_response.text
+
+    def test_captcha_image_format(self, app: Sanic, monkeypatch):
+        """
+        Captcha image request with the configured format, dimensions and headers, then with the image's ETag.
+        """
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_CAPTCHA_FORMAT", "webp")
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_CAPTCHA_WIDTH", 160)
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_CAPTCHA_HEIGHT", 60)
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_CAPTCHA_QUALITY", 50)
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_CAPTCHA_CACHE_CONTROL", "private, no-cache")
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_CAPTCHA_ETAG", True)
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _client.get("/api/test/capt/request")
+            captcha_image_request, captcha_image_response = _client.get(
+                "/api/test/capt/image"
+            )
+            assert captcha_image_response.status == 200, captcha_image_response.text
+            assert captcha_image_response.headers["content-type"] == "image/webp"
+            assert captcha_image_response.headers["cache-control"] == "private, no-cache"
+            with Image.open(BytesIO(captcha_image_response.content)) as image:
+                assert image.format == "WEBP" and image.size == (160, 60)
+            captcha_image_request, captcha_image_response = _client.get(
+                "/api/test/capt/image",
+                headers={"if-none-match": captcha_image_response.headers["etag"]},
+            )
+            assert captcha_image_response.status == 304, captcha_image_response.text
+
+    def test_stateless_captcha(self, app: Sanic, monkeypatch):
+        """
+        Stateless captcha request and attempt without a captcha session being stored, then replay the attempt and
+        attempt a failed challenge again.
+        """
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            monkeypatch.setattr(security_config, "SANIC_SECURITY_STATELESS_CAPTCHA", True)
+            monkeypatch.setattr(
+                app.ctx.extensions["security"].captcha_session, "new", None, raising=False
+            )
+            captcha_request_request, captcha_request_response = _client.get(
+                "/api/test/capt/request"
+            )
+            assert captcha_request_response.status == 200, captcha_request_response.text
+            code = json.loads(captcha_request_response.text)["data"]
+            cookies = dict(captcha_request_request.cookies)
+            cookies.update(captcha_request_response.cookies)
+            captcha_image_request, captcha_image_response = _client.get(
+                "/api/test/capt/image", cookies=cookies
+            )
+            assert captcha_image_response.status == 200, captcha_image_response.text
+            captcha_attempt_request, captcha_attempt_response = _client.post(
+                "/api/test/capt", data={"captcha": code}, cookies=cookies
+            )
+            assert captcha_attempt_response.status == 200, captcha_attempt_response.text
+            captcha_attempt_request, captcha_attempt_response = _client.post(
+                "/api/test/capt", data={"captcha": code}, cookies=cookies
+            )
+            assert captcha_attempt_response.status == 401, captcha_attempt_response.text
+            captcha_request_request, captcha_request_response = _client.get(
+                "/api/test/capt/request"
+            )
+            code = json.loads(captcha_request_response.text)["data"]
+            cookies = dict(captcha_request_response.cookies)
+            captcha_attempt_request, captcha_attempt_response = _client.post(
+                "/api/test/capt", data={"captcha": "INVALID"}, cookies=cookies
+            )
+            assert captcha_attempt_response.status == 401, captcha_attempt_response.text
+            captcha_attempt_request, captcha_attempt_response = _client.post(
+                "/api/test/capt", data={"captcha": code}, cookies=cookies
+            )
+            assert captcha_attempt_response.status == 401, captcha_attempt_response.text
+
     def test_two_step_verification(self, app: Sanic, rand_phone):
         """
         Two step verification request and attempt.
@@ -83,6 +216,125 @@ class TestVerification:
                 two_step_verification_attempt_response.status == 200
             ), two_step_verification_attempt_response.text
 
+    def test_two_step_verification_attempts(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Concurrent invalid two step verification attempts, then an attempt with the code once maxed out.
+        """
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS", 2)
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _client.post(
+                "/api/test/account",
+                data={"email": "two_step_attempts@verification.com", "username": "two_step_attempts", "phone": rand_phone},
+            )
+            two_step_verification_request_request, two_step_verification_request_response = _client.post(
+                "/api/test/two-step/request",
+                data={"email": "two_step_attempts@verification.com"},
+            )
+            two_step_verification_invalid_attempt_responses = _client._run(
+                asyncio.gather(
+                    *(
+                        _client._local_request(
+                            "post", "http://127.0.0.1:8000/api/test/two-step", data={"code": "123xyz"}
+                        )
+                        for _ in range(6)
+                    )
+                )
+            )
+            assert all(
+                response.status_code == 401 for response in two_step_verification_invalid_attempt_responses
+            )
+            assert [
+                json.loads(response.text)["message"] for response in two_step_verification_invalid_attempt_responses
+            ].count("The value provided does not match.") == 2
+            two_step_verification_attempt_request, two_step_verification_attempt_response = _client.post(
+                "/api/test/two-step",
+                data={
+                    "code": json.loads(two_step_verification_request_response.text)["data"]
+                },
+            )
+            assert (
+                json.loads(two_step_verification_attempt_response.text)["message"]
+                == "The maximum amount of attempts has been reached."
+            ), two_step_verification_attempt_response.text
+
+    def test_two_step_delivery(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        Two step verification request with the code delivered in the background, retried after failing once.
+        """
+
+        class FlakyTransport(MemoryTransport):
+            async def send(self, messages: list) -> None:
+                if not self.failed:
+                    self.failed = True
+                    raise ConnectionError("Provider unavailable.")
+                await super().send(messages)
+
+        transport = FlakyTransport()
+        transport.failed = False
+        monkeypatch.setitem(delivery_queue._transports, "email", transport)
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_DELIVERY_RETRY_DELAY", 0)
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _client.post(
+                "/api/test/account",
+                data={"email": "two_step_delivery@verification.com", "username": "two_step_delivery", "phone": rand_phone},
+            )
+            two_step_verification_request_request, two_step_verification_request_response = _client.post(
+                "/api/test/two-step/request",
+                data={"email": "two_step_delivery@verification.com"},
+            )
+            assert (
+                two_step_verification_request_response.status == 200
+            ), two_step_verification_request_response.text
+            _client._run(asyncio.wait_for(delivery_queue.join(), 5))
+            assert [message.json() for message in transport.sent] == [
+                {
+                    "channel": "email",
+                    "recipient": "two_step_delivery@verification.com",
+                    "code": json.loads(two_step_verification_request_response.text)["data"],
+                }
+            ]
+
+    def test_totp_verification(self, app: Sanic, rand_phone, monkeypatch):
+        """
+        TOTP enrollment and attempt, then a replayed attempt and invalid attempts until maxed out.
+        """
+        monkeypatch.setattr(security_config, "SANIC_SECURITY_MAX_CHALLENGE_ATTEMPTS", 2)
+        _client = ReusableClient(app, host='127.0.0.1', port='8000')
+        with _client:
+            _client.post(
+                "/api/test/account",
+                data={"email": "totp@verification.com", "username": "totp", "phone": rand_phone},
+            )
+            totp_enroll_request, totp_enroll_response = _client.post(
+                "/api/test/totp/enroll", data={"email": "totp@verification.com"}
+            )
+            assert totp_enroll_response.status == 200, totp_enroll_response.text
+            totp_uri = urlparse(json.loads(totp_enroll_response.text)["data"])
+            secret = parse_qs(totp_uri.query)["secret"][0]
+            code = get_totp(secret, int(time.time()) // security_config.SANIC_SECURITY_TOTP_PERIOD)
+            totp_attempt_request, totp_attempt_response = _client.post(
+                "/api/test/totp", data={"email": "totp@verification.com", "code": code}
+            )
+            assert totp_attempt_response.status == 200, totp_attempt_response.text
+            totp_attempt_request, totp_attempt_response = _client.post(
+                "/api/test/totp", data={"email": "totp@verification.com", "code": code}
+            )
+            assert totp_attempt_response.status == 401, totp_attempt_response.text
+            for _ in range(2):
+                totp_attempt_request, totp_attempt_response = _client.post(
+                    "/api/test/totp", data={"email": "totp@verification.com", "code": "invalid"}
+                )
+                assert totp_attempt_response.status == 401, totp_attempt_response.text
+            totp_attempt_request, totp_attempt_response = _client.post(
+                "/api/test/totp", data={"email": "totp@verification.com", "code": code}
+            )
+            assert (
+                json.loads(totp_attempt_response.text)["message"]
+                == "The maximum amount of attempts has been reached."
+            ), totp_attempt_response.text
+
     def test_account_verification(self, logger, app: Sanic, rand_phone):
         """
         Account registration and verification process with successful login.